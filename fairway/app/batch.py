@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, Union
+
+import inject
+
+from fairway.app.config import create_config
+from fairway.app.datasets import read_players, read_teams
+from fairway.domain.player import Player
+from fairway.domain.player_table import PlayerTable
+from fairway.domain.tournament import Tournament
+from fairway.usecases.interactors import create_teams, estimate_teams_fairness
+from fairway.usecases.kernels import KERNELS
+
+
+class Event(object):
+    """
+    A tournament to evaluate in a batch: the fairness of given teams is estimated, or, if a number of teams is given,
+    the players are assigned to teams.
+    Events are read from JSON objects:
+        {"id": "week-1", "players_file": "teams.csv", "best_balls": 2, "allowance": 100}
+        {"id": "week-2", "players": [{"handicap": 10}, {"handicap": 3}, ...], "nteams": 4, "format": "stableford"}
+    Players are read either from players_file (relative to the manifest) or from the inline players, whose team ids
+    ("team") are required to estimate the fairness of teams
+    """
+
+    def __init__(self, event_id, handicaps, team_ids, number_of_teams: int = None, number_of_best_balls: int = 1,
+                 allowance: int = 100, game_format: str = 'best-ball'):
+        """
+        :param event_id: identifies the event in the results
+        :param handicaps: the handicap of each player
+        :param team_ids: the team of each player (None to assign them to number_of_teams teams)
+        :param number_of_teams:
+        :param number_of_best_balls:
+        :param allowance: the handicap allowance (percentage)
+        :param game_format: the scoring of the teams (see KERNELS)
+        :raise ValueError: if the event cannot be evaluated
+        """
+        if number_of_teams is None and (team_ids is None or any(team_id is None for team_id in team_ids)):
+            raise ValueError("Event {}: every player needs a team, or the number of teams (nteams) is required"
+                             .format(event_id))
+        if number_of_teams is not None and not 1 <= number_of_teams <= len(handicaps):
+            raise ValueError("Event {}: {} teams cannot be made of {} players"
+                             .format(event_id, number_of_teams, len(handicaps)))
+        if not all(0 <= handicap <= 36 for handicap in handicaps):
+            raise ValueError("Event {}: handicaps must be within 0 and 36".format(event_id))
+        if number_of_best_balls < 1:
+            raise ValueError("Event {}: the number of best balls must be at least 1".format(event_id))
+        if not 0 <= allowance <= 100:
+            raise ValueError("Event {}: the allowance must be within 0 and 100".format(event_id))
+        if game_format not in KERNELS:
+            raise ValueError("Event {}: unknown format {}".format(event_id, game_format))
+        self.event_id = event_id
+        self.handicaps = tuple(handicaps)
+        self.team_ids = tuple(team_ids) if team_ids is not None else None
+        self.number_of_teams = number_of_teams
+        self.number_of_best_balls = number_of_best_balls
+        self.allowance = allowance
+        self.game_format = game_format
+
+    @classmethod
+    def from_json(cls, line_number: int, record: dict, base_directory: str, number_of_best_balls: int = 1,
+                  allowance: int = 100, game_format: str = 'best-ball') -> 'Event':
+        """
+        :param line_number: the id of events without one
+        :param record:
+        :param base_directory: the directory of the relative players files
+        :param number_of_best_balls: the default number of best balls
+        :param allowance: the default handicap allowance
+        :param game_format: the default format
+        :return:
+        :raise ValueError: if the record is not a valid event
+        """
+        if not isinstance(record, dict):
+            raise ValueError("Event {}: events are JSON objects".format(line_number))
+        event_id = record.get('id', line_number)
+        number_of_teams = record.get('nteams')
+        if number_of_teams is not None:
+            number_of_teams = int(number_of_teams)
+        if 'players_file' not in record and not isinstance(record.get('players'), list):
+            raise ValueError("Event {}: a players file (players_file), or a list of players, is required"
+                             .format(event_id))
+        if 'players_file' in record:
+            players_file = os.path.join(base_directory, record['players_file'])
+            if number_of_teams is None:
+                player_records = [player for team in read_teams(players_file) for player in team.players]
+            else:
+                player_records = list(read_players(players_file))
+            handicaps = [player.handicap for player in player_records]
+            team_ids = [player.team_id for player in player_records]
+        else:
+            if not all(isinstance(player, dict) and 'handicap' in player for player in record['players']):
+                raise ValueError("Event {}: every player needs a handicap".format(event_id))
+            handicaps = [int(player['handicap']) for player in record['players']]
+            team_ids = [player.get('team') for player in record['players']]
+        return cls(event_id, handicaps, team_ids if number_of_teams is None else None, number_of_teams,
+                   int(record.get('best_balls', number_of_best_balls)), int(record.get('allowance', allowance)),
+                   record.get('format', game_format))
+
+
+# An event of a manifest that cannot be evaluated, and why
+InvalidEvent = namedtuple('InvalidEvent', ['event_id', 'error'])
+
+
+def read_events(manifest, number_of_best_balls: int = 1, allowance: int = 100,
+                game_format: str = 'best-ball') -> Iterator[Union[Event, InvalidEvent]]:
+    """
+    Read the events of a JSONL manifest
+    :param manifest: a text file with a JSON object per line
+    :param number_of_best_balls: the number of best balls of the events that do not set it
+    :param allowance: the handicap allowance of the events that do not set it
+    :param game_format: the format of the events that do not set it
+    :return: the events, and an InvalidEvent for each line that is not a valid one
+    """
+    base_directory = os.path.dirname(os.path.abspath(getattr(manifest, 'name', '.')))
+    for line_number, line in enumerate(manifest, start=1):
+        if not line.strip():
+            continue
+        event_id = line_number
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                event_id = record.get('id', line_number)
+            event = Event.from_json(line_number, record, base_directory, number_of_best_balls, allowance, game_format)
+        except Exception as e:
+            # The other events of the manifest are still evaluated
+            logging.error("Invalid event {}: {}".format(event_id, e))
+            event = InvalidEvent(event_id, str(e) or repr(e))
+        yield event
+
+
+def evaluate_event(event: Union[Event, InvalidEvent], optimize: bool = False) -> dict:
+    """
+    Evaluate an event with the configured dependencies. The players of each event live in their own table, so that
+    events do not share state
+    :param event:
+    :param optimize: try to improve the fairness of assigned teams
+    :return: the JSON-serializable result of the event
+    """
+    if isinstance(event, InvalidEvent):
+        return {'id': event.event_id, 'error': event.error}
+    try:
+        players = Player.create_all(event.handicaps, event.team_ids, table=PlayerTable(len(event.handicaps)))
+        if event.number_of_teams is None:
+            tournament = estimate_teams_fairness(players, event.number_of_best_balls, event.allowance / 100.0,
+                                                 event.game_format)
+        else:
+            tournament = create_teams(players, event.number_of_teams, event.number_of_best_balls,
+                                      event.allowance / 100.0, optimize, event.game_format)
+        return {'id': event.event_id, 'teams': teams_to_json(tournament, event)}
+    except Exception as e:
+        logging.exception("Event {} failed".format(event.event_id))
+        return {'id': event.event_id, 'error': str(e) or repr(e)}
+
+
+def teams_to_json(tournament: Tournament, event: Event) -> list:
+    """
+    The teams are identified by the team ids of the event, or by their position for assigned teams, since the ids of
+    the teams of a tournament depend on the events evaluated before it
+    """
+    def team_key(position, team):
+        if event.team_ids is None:
+            return position
+        return event.team_ids[tournament.roster.index_of(team.members[0])] if team.members else None
+
+    return [{'team': team_key(position, team), 'expected_score': float(team.expected_score),
+             'prob_of_winning': float(team.prob_of_winning),
+             'handicaps': [player.handicap for player in team.members]}
+            for position, team in enumerate(tournament.teams)]
+
+
+def run_batch(events: Iterable[Union[Event, InvalidEvent]], config: dict, number_of_workers: int = 1,
+              optimize: bool = False) -> Iterator[dict]:
+    """
+    Evaluate the events, and yield the result of each of them as soon as it is available (in order of completion,
+    when running on several workers). The dataset is loaded once per worker
+    :param events:
+    :param config: the arguments of create_config
+    :param number_of_workers: the number of processes evaluating events
+    :param optimize: try to improve the fairness of assigned teams
+    :return:
+    """
+    if number_of_workers == 1:
+        inject.clear_and_configure(create_config(**config))
+        for event in events:
+            yield evaluate_event(event, optimize)
+        return
+
+    with ProcessPoolExecutor(max_workers=number_of_workers, initializer=initialize_worker,
+                             initargs=(config, logging.getLogger().level)) as executor:
+        futures = [executor.submit(evaluate_event, event, optimize) for event in events]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def initialize_worker(config: dict, logging_level: int):
+    """
+    Configure a worker process evaluating events
+    """
+    logging.basicConfig(level=logging_level)
+    inject.clear_and_configure(create_config(**config))
@@ -1,19 +1,71 @@
+import asyncio
+import cProfile
+import csv
+import json
 import logging
 
 import click
 import inject
-from click import echo, INT, Path, IntRange
+from click import echo, INT, Path, IntRange, FloatRange
 
+from fairway.app.batch import read_events, run_batch
 from fairway.app.config import create_config
 from fairway.app.datasets import read_teams, read_players
+from fairway.app.server import EstimationServer
 from fairway.domain.player import Player
 
-from fairway.usecases.interactors import estimate_teams_fairness, create_teams
+from fairway.usecases.interactors import estimate_teams_fairness, estimate_teams_fairness_progressively, \
+    create_teams, merge_teams_fairness, save_partial_result
+from fairway.usecases.fairness import FAIRNESS_EVALUATORS
+from fairway.usecases.kernels import KERNELS
+from fairway.usecases.results import PartialResult
+from fairway.usecases.swaps import Swapper, TracePoint
+from fairway.util import profiling
 
 
-@click.group()
+def validate_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise click.BadParameter("shards need to be in the format INDEX/COUNT, e.g. 0/4")
+    if not (0 <= index < count):
+        raise click.BadParameter("INDEX must be within 0 and COUNT-1")
+    return index, count
+
+
+class PlayersFileGroup(click.Group):
+    """
+    A group whose commands also take their players file before their name, as the earlier versions of the program
+    did: fairway [OPTIONS] PLAYERS_FILE COMMAND [ARGS] is fairway [OPTIONS] COMMAND PLAYERS_FILE [ARGS]
+    """
+
+    def parse_args(self, ctx, args):
+        return super().parse_args(ctx, self._move_players_file(list(args)))
+
+    def _move_players_file(self, args):
+        # Skip the options of the group, and their values
+        takes_value = {name: not (param.is_flag or param.count) for param in self.params
+                       if isinstance(param, click.Option) for name in param.opts + param.secondary_opts}
+        index = 0
+        while index < len(args) and args[index].startswith('-') and args[index] != '--':
+            index += 2 if takes_value.get(args[index], False) else 1
+        if index + 1 >= len(args) or args[index] in self.commands or args[index + 1] not in self.commands:
+            return args
+        players_file, command_name = args[index], args[index + 1]
+        if 'players_file' not in (param.name for param in self.commands[command_name].params):
+            raise click.UsageError("{} does not take a players file".format(command_name))
+        return args[:index] + [command_name, players_file] + args[index + 2:]
+
+    def collect_usage_pieces(self, ctx):
+        pieces = super().collect_usage_pieces(ctx)
+        return pieces[:-1] + ['[PLAYERS_FILE]'] + pieces[-1:]
+
+
+@click.group(cls=PlayersFileGroup)
 @click.option('-i', '--iterations',
-              type=IntRange(min=500, max=10000, clamp=False), default=500,
+              type=IntRange(min=500, clamp=False), default=500,
               help="the number of simulations to be performed")
 @click.option('-f', '--full-handicap', 'allowance',
               type=INT, flag_value=100, default=True,
@@ -27,15 +79,61 @@ from fairway.usecases.interactors import estimate_teams_fairness, create_teams
 @click.option('-b', '--best-balls',
               type=IntRange(min=1, max=3, clamp=False),
               help="number of best balls")
+@click.option('-g', '--format', 'game_format',
+              type=click.Choice(list(KERNELS)), default='best-ball', show_default=True,
+              help="the scoring of the teams: stroke play of the best balls, a scramble (approximated from the "
+                   "lowest scores of the teams), the Stableford points of the best balls, or match play of the best "
+                   "balls against every other team")
+@click.option('--fairness',
+              type=click.Choice(list(FAIRNESS_EVALUATORS)), default='max-difference', show_default=True,
+              help="the index of fairness that assign minimizes: the difference between the highest and the lowest "
+                   "probabilities of winning, their variance, their Gini coefficient, or the worst imbalance of the "
+                   "head-to-head probabilities of a pair of teams")
 @click.option('-d', "--distributions",
               type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True),
               help="the file containing the handicap distributions file")
-@click.argument("players-file",
-                type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True))
 @click.option('-l', '--logging-level',
               type=click.Choice(['info', 'warn', 'debug']), default='warn')
+@click.option('-j', '--processes',
+              type=IntRange(min=1, clamp=False), default=1,
+              help="the number of processes running the simulations")
+@click.option('-s', '--seed',
+              type=IntRange(min=0, max=2**32-1, clamp=False),
+              help="the master seed of the simulations (default: random)")
+@click.option('--shard', callback=validate_shard, metavar='INDEX/COUNT',
+              help="simulate only the INDEX-th (starting from 0) of COUNT shards of the iterations")
+@click.option('-p', '--precision',
+              type=FloatRange(min=0.0, max=0.5, min_open=True),
+              help="stop the simulations once the 95% confidence intervals of the probabilities of winning are "
+                   "narrower than +/-PRECISION. --iterations becomes the maximum number of simulations")
+@click.option('-x', '--exact', is_flag=True, default=False,
+              help="compute the exact probabilities of winning and expected scores instead of simulating games")
+@click.option('-c', '--cache', 'cache_file',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True),
+              help="reuse the estimates of teams with the same handicaps, cached in the given SQLite database (only "
+                   "by seeded or exact runs)")
+@click.option('--cache-size',
+              type=IntRange(min=1, clamp=False), default=64,
+              help="the maximum size of the cached estimates, in MB (the least recently used ones are evicted)")
+@click.option('-m', '--memory-budget',
+              type=IntRange(min=1, clamp=False),
+              help="the memory (in MB) that the scenarios of a simulation may take: it sizes the chunks of scenarios, "
+                   "and bounds the scenarios kept in memory to evaluate the swaps of players (default: unbounded)")
+@click.option('--profile', is_flag=True, default=False,
+              help="profile the stages of the run (time, calls, iterations per second and peak memory), print a "
+                   "summary and write a JSON report")
+@click.option('--profile-output',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True), default='profile.json',
+              show_default=True,
+              help="the JSON report of --profile")
+@click.option('--cprofile', 'cprofile_file',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True),
+              help="with --profile, also dump the cProfile statistics of the run in the given file")
 @click.pass_context
-def main(ctx, iterations, allowance: int, distributions: str, players_file: str, best_balls: int, logging_level):
+def main(ctx, iterations, allowance: int, distributions: str, best_balls: int, game_format: str, fairness: str,
+         logging_level, processes: int,
+         seed: int, shard, precision: float, exact: bool, cache_file: str, cache_size: int, memory_budget: int,
+         profile: bool, profile_output: str, cprofile_file: str):
     """
     Program to create fair Best Ball teams, evaluate their fairness, and predict their scores.
     """
@@ -44,63 +142,296 @@ def main(ctx, iterations, allowance: int, distributions: str, players_file: str,
         'warn': logging.WARN,
         'debug': logging.DEBUG
     }
+    if shard and precision:
+        raise click.BadParameter("--precision cannot be used together with --shard", param_hint="'--precision'")
+    if exact and game_format != 'best-ball':
+        raise click.BadParameter("exact estimates only support the best-ball format", param_hint="'--exact'")
     logging.basicConfig(level=logging_opt[logging_level])
+    if profile:
+        start_profiling(ctx, profile_output, cprofile_file)
     ctx.obj = {
         'iterations': iterations,
         'best_balls': best_balls,
+        'format': game_format,
         'allowance': allowance / 100.0,     # Convert percentage to decimal value
+        'allowance_percentage': allowance,
         'distributions': distributions,
-        'players_file': players_file,
-        #'optimize': optimize
+        'exact': exact,
+        'config': {
+            'distributions': distributions,
+            'number_of_iterations': iterations,
+            'number_of_processes': processes,
+            'seed': seed,
+            'shard': shard,
+            'precision': precision,
+            'exact': exact,
+            'cache_file': cache_file,
+            'cache_size': cache_size * 2**20,
+            'memory_budget': memory_budget * 2**20 if memory_budget else None,
+            'fairness': fairness
+        }
     }
-    echo_config(iterations, allowance, distributions, players_file)
-    inject.configure(create_config(distributions, iterations))
+
+
+def start_profiling(ctx, profile_output, cprofile_file):
+    """
+    Profile the stages of the command, and report them once it is over. Only the stages run by this process are
+    profiled (not the ones run by worker processes)
+    """
+    profiler = profiling.enable()
+    code_profiler = cProfile.Profile() if cprofile_file else None
+    if code_profiler:
+        code_profiler.enable()
+
+    def report():
+        if code_profiler:
+            code_profiler.disable()
+            code_profiler.dump_stats(cprofile_file)
+        profiling.disable()
+        with open(profile_output, 'w') as report_file:
+            json.dump(profiler.report(), report_file, indent=2)
+        echo(profiler.summary(), err=True)
+        echo("Profile report: " + profile_output, err=True)
+
+    ctx.call_on_close(report)
+
+
+def configure(ctx, players_file, **options):
+    """
+    Echo the configuration, and configure the dependencies with the options of the group and the given options of
+    the command
+    """
+    echo_config(ctx.obj['iterations'], ctx.obj['allowance_percentage'], ctx.obj['distributions'], players_file)
+    inject.configure(create_config(**ctx.obj['config'], **options))
 
 
 @main.command()
+@click.argument("players-file",
+                type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True))
+@click.option('--save-partial',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True),
+              help="save the partial result of the simulation (see merge) in the given file")
+@click.option('--progress', 'progress_interval',
+              type=IntRange(min=1, clamp=False),
+              help="show the running estimates every PROGRESS_INTERVAL iterations. Ctrl-C then stops the simulation, "
+                   "keeping the estimates of the iterations played so far")
+@click.option('--head-to-head', is_flag=True, default=False,
+              help="also show the probability that each team beats each other one")
 @click.pass_context
-def estimate(ctx):
+def estimate(ctx, players_file: str, save_partial: str, progress_interval: int, head_to_head: bool):
     """
     Estimate the probabilities of winning, and the expected scores, of each team
     :param ctx:
     :return:
     """
     allowance = ctx.obj['allowance']
-    players_file = ctx.obj['players_file']
+    best_balls = ctx.obj['best_balls']
+    if save_partial and ctx.obj['exact']:
+        raise click.BadParameter("exact estimates have no partial results", param_hint="'--save-partial'")
+    if save_partial and progress_interval:
+        # An interrupted estimate would be saved as a whole shard
+        raise click.BadParameter("progressive estimates may stop before the end of the simulation",
+                                 param_hint="'--save-partial'")
+    configure(ctx, players_file)
+
+    # Config
+    players = read_assigned_players(players_file)
+
+    # Execute command
+    if progress_interval:
+        tournament = estimate_with_progress(players, best_balls, allowance, progress_interval, ctx.obj['iterations'],
+                                            ctx.obj['format'])
+    else:
+        tournament = estimate_teams_fairness(players, best_balls, allowance, ctx.obj['format'])
+    if save_partial:
+        save_partial_result(tournament, save_partial)
+    echo_teams(tournament)
+    if head_to_head:
+        echo_head_to_head(tournament)
+
+
+@main.command()
+@click.argument("players-file",
+                type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True))
+@click.argument("partial-files", nargs=-1, required=True,
+                type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True))
+@click.pass_context
+def merge(ctx, players_file: str, partial_files):
+    """
+    Merge the partial results of estimate (see --shard and --save-partial). They must be all the shards of the same
+    simulation (the same seed and iterations) of the teams of the players file, each one once
+    :param ctx:
+    :param partial_files:
+    :return:
+    """
+    allowance = ctx.obj['allowance']
     best_balls = ctx.obj['best_balls']
 
     # Config
-    players = tuple(Player.create(player_record.handicap, player_record.team_id) for team in read_teams(players_file)
-                    for player_record in team.players)
+    configure(ctx, players_file)
+    players = read_assigned_players(players_file)
 
     # Execute command
-    tournament = estimate_teams_fairness(players, best_balls, allowance)
+    try:
+        tournament = merge_teams_fairness(players, best_balls, allowance,
+                                          [PartialResult.load_shard(partial_file) for partial_file in partial_files],
+                                          ctx.obj['format'])
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'PARTIAL_FILES'")
     echo_teams(tournament)
 
 
 @main.command()
+@click.argument("players-file",
+                type=Path(exists=True, file_okay=True, dir_okay=False, writable=False, readable=True, resolve_path=True))
 @click.option('-t', '--nteams',
               type=INT, default=2,
               help="The number of teams")
-@click.option('--optimize/--no-optimize', default=False,
-              help="attempts to improve the fairness of the found solution")
+@click.option('-o', '--optimize',
+              type=click.Choice(['none', 'simple', 'annealing', 'branch-and-bound']), default='none',
+              help="attempts to improve the fairness of the found solution by swapping players: by hill climbing "
+                   "(simple), by simulated annealing within --time-budget (annealing), or by an exact search of the "
+                   "fairest assignment of fields of up to 24 players within --time-budget (branch-and-bound)")
+@click.option('--time-budget',
+              type=FloatRange(min=0.0, min_open=True), default=5.0,
+              help="the seconds the annealing and branch-and-bound optimizers run for")
+@click.option('--target-fairness',
+              type=FloatRange(min=0.0),
+              help="stop the annealing optimizer as soon as the index of fairness of the teams (see --fairness) is at "
+                   "most TARGET_FAIRNESS")
+@click.option('--trace',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True),
+              help="write the convergence trace of the annealing optimizer in the given CSV file")
 @click.pass_context
-def assign(ctx, nteams: int, optimize: bool):
+def assign(ctx, players_file: str, nteams: int, optimize: str, time_budget: float, target_fairness: float,
+           trace: str):
     """
     Assign the input players to the desired number of teams
     :param ctx:
     :return:
     """
     allowance = ctx.obj['allowance']
-    players_file = ctx.obj['players_file']
     best_balls = ctx.obj['best_balls']
 
     # Config
-    players = tuple(Player.create(player_record.handicap) for player_record in read_players(players_file))
+    configure(ctx, players_file, optimizer=optimize, time_budget=time_budget, target_fairness=target_fairness)
+    players = Player.create_all([player_record.handicap for player_record in read_players(players_file)])
 
     # Execute command
-    tournament = create_teams(players, nteams, best_balls, allowance)
+    tournament = create_teams(players, nteams, best_balls, allowance, optimize != 'none', ctx.obj['format'])
     echo_teams(tournament)
+    if trace and optimize == 'annealing':
+        write_trace(inject.instance(Swapper).trace, trace)
+
+
+@main.command()
+@click.argument("manifest", type=click.File('r'))
+@click.option('-w', '--workers',
+              type=IntRange(min=1, clamp=False), default=1,
+              help="the number of processes evaluating events")
+@click.option('-o', '--optimize',
+              type=click.Choice(['none', 'simple', 'annealing', 'branch-and-bound']), default='none',
+              help="the optimizer of the teams of the events that assign players (see assign)")
+@click.option('--time-budget',
+              type=FloatRange(min=0.0, min_open=True), default=5.0,
+              help="the seconds the annealing and branch-and-bound optimizers run for, for each event")
+@click.pass_context
+def batch(ctx, manifest, workers: int, optimize: str, time_budget: float):
+    """
+    Evaluate the events of a JSONL manifest ("-" for the standard input), and write a JSON result line per event.
+    Events estimate the fairness of the teams of a players file ("players_file") or of inline players ("players":
+    [{"handicap": 10, "team": 1}, ...]), or, given a number of teams ("nteams"), assign the players to teams.
+    "best_balls", "allowance" and "format" default to the options of the program
+    :param ctx:
+    :return:
+    """
+    events = read_events(manifest, ctx.obj['best_balls'] or 1, ctx.obj['allowance_percentage'], ctx.obj['format'])
+    config = dict(ctx.obj['config'], optimizer=optimize, time_budget=time_budget)
+    if workers > 1:
+        config['number_of_processes'] = 1     # Events run in parallel instead
+    for result in run_batch(events, config, workers, optimize != 'none'):
+        echo(json.dumps(result))
+
+
+@main.command()
+@click.option('--host', default='127.0.0.1',
+              help="the address to listen on")
+@click.option('--port', type=IntRange(min=0, max=65535), default=8080,
+              help="the port to listen on")
+@click.option('--socket', 'socket_path',
+              type=Path(file_okay=True, dir_okay=False, writable=True, resolve_path=True),
+              help="listen on a Unix socket instead of a TCP port")
+@click.option('-w', '--workers',
+              type=IntRange(min=1, clamp=False), default=1,
+              help="the number of processes evaluating requests")
+@click.option('-q', '--queue-size',
+              type=IntRange(min=0, clamp=False), default=16,
+              help="the number of requests waiting for a worker before new ones are rejected")
+@click.option('-o', '--optimize',
+              type=click.Choice(['none', 'simple', 'annealing', 'branch-and-bound']), default='none',
+              help="the optimizer of the teams of the assign requests (see assign)")
+@click.option('--time-budget',
+              type=FloatRange(min=0.0, min_open=True), default=5.0,
+              help="the seconds the annealing and branch-and-bound optimizers run for, for each request")
+@click.pass_context
+def serve(ctx, host: str, port: int, socket_path: str, workers: int, queue_size: int, optimize: str,
+          time_budget: float):
+    """
+    Serve estimates (POST /estimate) and team assignments (POST /assign) of JSON tournaments over HTTP, keeping the
+    configuration and the distributions loaded
+    :param ctx:
+    :return:
+    """
+    config = dict(ctx.obj['config'], optimizer=optimize, time_budget=time_budget)
+    server = EstimationServer(config, workers, queue_size, optimize != 'none', ctx.obj['best_balls'] or 1,
+                              ctx.obj['allowance_percentage'], ctx.obj['format'])
+    try:
+        asyncio.run(server.serve(host, port, socket_path))
+    except KeyboardInterrupt:
+        pass
+
+
+def estimate_with_progress(players, best_balls, allowance, progress_interval, number_of_iterations,
+                           game_format='best-ball'):
+    """
+    Estimate the fairness of the teams, showing the running estimates on the standard error. Ctrl-C stops the
+    estimate, and the teams keep the last running estimates
+    """
+    live = click.get_text_stream('stderr').isatty()
+    tournament = None
+    try:
+        for tournament, result in estimate_teams_fairness_progressively(players, best_balls, allowance,
+                                                                         progress_interval, game_format):
+            echo_progress(tournament, result, number_of_iterations, live)
+    except KeyboardInterrupt:
+        if tournament is None:
+            raise click.Abort()
+        echo("\nInterrupted: the estimates are based on the iterations played so far", err=True)
+    else:
+        if live:
+            echo(err=True)
+    return tournament
+
+
+def echo_progress(tournament, result, number_of_iterations, live):
+    iterations = getattr(result, 'number_of_scenarios', number_of_iterations)
+    estimates = ", ".join("{}: {:.2f} {:.4f} ({:.4f})".format(team.id, expected_score, win_probability, error)
+                          for team, expected_score, win_probability, error
+                          in zip(tournament.teams, result.expected_scores, result.win_probabilities,
+                                 result.standard_errors))
+    line = "{}/{} iterations. Team: Estimated Score, Prob. of Winning (std. error): {}".format(
+        iterations, number_of_iterations, estimates)
+    if live:
+        # Redraw the line in place
+        echo("\r\x1b[K" + line, err=True, nl=False)
+    else:
+        echo(line, err=True)
+
+
+def read_assigned_players(players_file):
+    player_records = [player_record for team in read_teams(players_file) for player_record in team.players]
+    return Player.create_all([player_record.handicap for player_record in player_records],
+                             [player_record.team_id for player_record in player_records])
 
 
 def echo_teams(tournament):
@@ -109,6 +440,24 @@ def echo_teams(tournament):
              .format(team.id, team.expected_score, team.prob_of_winning, [player.handicap for player in team.members]))
 
 
+def echo_head_to_head(tournament):
+    head_to_head = tournament.game.last_result.head_to_head
+    if head_to_head is None:
+        echo("Head to head: not available for cached estimates", err=True)
+        return
+    echo("Head to head (probability that the team of the row beats the team of the column):")
+    echo("{:>8}".format("") + "".join("{:>8}".format(team.id) for team in tournament.teams))
+    for team, probabilities in zip(tournament.teams, head_to_head):
+        echo("{:>8}".format(team.id) + "".join("{:>8.4f}".format(probability) for probability in probabilities))
+
+
+def write_trace(trace, trace_file):
+    with open(trace_file, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(TracePoint._fields)
+        writer.writerows(trace)
+
+
 def echo_config(number_of_iterations, allowance, distributions, teams):
     echo("Distributions file: " + distributions)
     echo("Players file: " + teams)
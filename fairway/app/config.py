@@ -1,24 +1,79 @@
+import hashlib
+import json
+import logging
+
 from fairway.app.datasets import CSVDataset
+from fairway.app.result_cache import SQLiteResultCache
 from fairway.domain.game import Game
 from fairway.usecases.bestball import BestBallGame
+from fairway.usecases.branch_and_bound import BranchAndBoundSwapper
+from fairway.usecases.cache import NoResultCache, ResultCache
 from fairway.usecases.dataset import Dataset
-from fairway.usecases.fairness import FairnessEvaluator, MaxDifference
+from fairway.usecases.exact import ExactSimulator
+from fairway.usecases.fairness import FAIRNESS_EVALUATORS, FairnessEvaluator
 from fairway.usecases.simulator import Simulator, MonteCarloSimulator
-from fairway.usecases.swaps import SwapGenerator, UnfairTeamsPairsWorsePlayersOnly, Swapper, SimpleSwapper
+from fairway.usecases.swaps import SwapGenerator, UnfairTeamsPairsWorsePlayersOnly, Swapper, SimpleSwapper, \
+    AnnealingSwapper
 
 
-def create_config(distributions, number_of_iterations):
+def create_config(distributions, number_of_iterations, number_of_processes=1, seed=None, shard=None, precision=None,
+                  exact=False, optimizer='simple', time_budget=5.0, target_fairness=None, cache_file=None,
+                  cache_size=64 * 2**20, memory_budget=None, fairness='max-difference'):
     """
 
     :param distributions:
     :param number_of_iterations:
+    :param number_of_processes: the number of processes used by each simulation
+    :param seed: the master seed of the simulations (default: random)
+    :param shard: (index, count) simulate only the index-th of count shards of each simulation (default: all of them)
+    :param precision: stop simulations once the 95% confidence intervals of the probabilities of winning are
+    narrower than +/-precision. number_of_iterations becomes the maximum number of iterations
+    :param exact: compute expected scores and probabilities of winning exactly, instead of simulating games
+    :param optimizer: the swapper that improves the fairness of the teams: 'simple' (hill climbing), 'annealing' or
+    'branch-and-bound' (exact search of small fields)
+    :param time_budget: the wall-clock seconds of the annealing or branch and bound search
+    :param target_fairness: stop the annealing search once the teams are at least this fair
+    :param cache_file: the SQLite database caching the estimates of teams (default: no cache). Only the estimates of
+    reproducible runs (seeded, or exact) are cached
+    :param cache_size: the maximum size of the cached estimates, in bytes
+    :param memory_budget: the bytes that the scenarios of a simulation may take (default: unbounded)
+    :param fairness: the index of fairness of the teams (see FAIRNESS_EVALUATORS)
     :return:
     """
+    # Common random numbers: all the candidate assignments of a field are evaluated against the same scenarios
+    simulator_options = {'number_of_processes': number_of_processes, 'seed': seed, 'precision': precision,
+                         'common_random_numbers': True, 'memory_budget': memory_budget}
+    if shard:
+        index, count = shard
+        simulator_options.update({'number_of_shards': count, 'shard_indexes': (index,)})
+
+    if cache_file and seed is None and not exact:
+        # A random seed would make the estimate of a run the one of every later run
+        logging.warning("The results cache is only used by seeded (or exact) runs: ignoring it")
+        cache_file = None
+    if cache_file:
+        # Cached estimates are only reused by the same configuration
+        with open(str(distributions), 'rb') as f:
+            distributions_digest = hashlib.sha256(f.read()).hexdigest()
+        namespace = json.dumps({'distributions': distributions_digest, 'iterations': number_of_iterations,
+                                'processes': number_of_processes, 'seed': seed, 'shard': shard, 'precision': precision,
+                                'exact': exact}, sort_keys=True)
+        result_cache = SQLiteResultCache(cache_file, namespace, cache_size)
+    else:
+        result_cache = NoResultCache()
+
     def config(binder):
         binder.bind(SwapGenerator, UnfairTeamsPairsWorsePlayersOnly())
-        binder.bind(FairnessEvaluator, MaxDifference())
+        binder.bind(FairnessEvaluator, FAIRNESS_EVALUATORS[fairness]())
         binder.bind(Dataset, CSVDataset(distributions))
-        binder.bind(Simulator, MonteCarloSimulator(number_of_iterations))
+        binder.bind(ResultCache, result_cache)
+        binder.bind(Simulator, ExactSimulator() if exact else MonteCarloSimulator(number_of_iterations,
+                                                                                  **simulator_options))
         binder.bind_to_constructor(Game, BestBallGame)
-        binder.bind_to_constructor(Swapper, SimpleSwapper)
+        if optimizer == 'annealing':
+            binder.bind(Swapper, AnnealingSwapper(time_budget, target_fairness, seed=seed))
+        elif optimizer == 'branch-and-bound':
+            binder.bind(Swapper, BranchAndBoundSwapper(time_budget))
+        else:
+            binder.bind_to_constructor(Swapper, SimpleSwapper)
     return config
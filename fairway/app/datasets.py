@@ -1,29 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
 from csv import reader
 from collections import namedtuple
 from itertools import groupby
+from typing import Optional, Tuple
 
+import numpy as np
 from numpy import loadtxt
 
 from fairway.usecases.dataset import Dataset
 from fairway.usecases.distributions import ScoreDistributions
+from fairway.util import profiling
 
 
-PlayerRecord = namedtuple('PlayerRecord', ['name', 'lastname', 'handicap', 'team_id'], verbose=False)
-TeamRecord = namedtuple('TeamRecord', ['team_id', 'players'], verbose=False)
+PlayerRecord = namedtuple('PlayerRecord', ['name', 'lastname', 'handicap', 'team_id'])
+TeamRecord = namedtuple('TeamRecord', ['team_id', 'players'])
 
 
 class CSVDataset(Dataset):
+    """
+    Score distributions read from a CSV file. The normalized sampling tables are cached in a binary sidecar
+    (<file>.cache.npy, memory-mapped on load) described by <file>.cache.json, and rebuilt when the file changes
+    """
 
-    def __init__(self, handicap_distributions_file):
+    # Bump when the layout of the cached tables changes
+    CACHE_VERSION = 1
+
+    def __init__(self, handicap_distributions_file, use_cache: bool = True):
         # Make this code a bit more portable. Older versions of loadtxt do not support pathlib
         handicap_distributions_file = str(handicap_distributions_file)
-        self._score_distributions = ScoreDistributions(loadtxt(fname=handicap_distributions_file, delimiter=',',
-                                                               dtype=float))
+        self._score_distributions = None
+        with profiling.stage('dataset load'):
+            if use_cache:
+                self._score_distributions = _load_cached_distributions(handicap_distributions_file)
+            if self._score_distributions is None:
+                self._score_distributions = ScoreDistributions(loadtxt(fname=handicap_distributions_file,
+                                                                       delimiter=',', dtype=float))
+                if use_cache:
+                    _save_cached_distributions(handicap_distributions_file, self._score_distributions)
 
     def get_score_distributions(self) -> ScoreDistributions:
         return self._score_distributions
 
 
+def _cache_files(handicap_distributions_file: str) -> Tuple[str, str]:
+    return handicap_distributions_file + '.cache.npy', handicap_distributions_file + '.cache.json'
+
+
+def _file_digest(file_name: str) -> str:
+    with open(file_name, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _load_cached_distributions(handicap_distributions_file: str) -> Optional[ScoreDistributions]:
+    """
+    Returns the cached distributions of the file, or None if there are none or they are stale
+    """
+    tables_file, metadata_file = _cache_files(handicap_distributions_file)
+    try:
+        with open(metadata_file) as f:
+            metadata = json.load(f)
+        source = os.stat(handicap_distributions_file)
+        if metadata.get('version') != CSVDataset.CACHE_VERSION:
+            return None
+        if (metadata.get('mtime_ns'), metadata.get('size')) != (source.st_mtime_ns, source.st_size):
+            # Touched, or copied: the cache is still valid if the content did not change
+            if metadata.get('sha256') != _file_digest(handicap_distributions_file):
+                return None
+            metadata.update({'mtime_ns': source.st_mtime_ns, 'size': source.st_size})
+            _write_atomically(metadata_file, lambda f: f.write(json.dumps(metadata).encode()))
+        tables = np.load(tables_file, mmap_mode='r')
+        return ScoreDistributions.from_tables(tables[0], tables[1])
+    except (OSError, ValueError) as e:
+        logging.debug("No usable cache for {}: {}".format(handicap_distributions_file, e))
+        return None
+
+
+def _save_cached_distributions(handicap_distributions_file: str, score_distributions: ScoreDistributions):
+    tables_file, metadata_file = _cache_files(handicap_distributions_file)
+    source = os.stat(handicap_distributions_file)
+    metadata = {'version': CSVDataset.CACHE_VERSION, 'sha256': _file_digest(handicap_distributions_file),
+                'mtime_ns': source.st_mtime_ns, 'size': source.st_size}
+    tables = np.stack((score_distributions.handicap_distributions, score_distributions.cumulative_distributions))
+    try:
+        # The tables first: metadata only ever describes complete tables
+        _write_atomically(tables_file, lambda f: np.save(f, tables))
+        _write_atomically(metadata_file, lambda f: f.write(json.dumps(metadata).encode()))
+    except OSError as e:
+        logging.debug("Cannot cache {}: {}".format(handicap_distributions_file, e))
+
+
+def _write_atomically(file_name: str, write):
+    directory, base_name = os.path.split(file_name)
+    fd, temporary_file = tempfile.mkstemp(prefix=base_name, dir=directory or None)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temporary_file, file_name)
+    except BaseException:
+        os.remove(temporary_file)
+        raise
+
+
 def read_players(players_file):
     # name, lastname, handicap
     for t in _read_players(players_file, [str, str, int]):
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import logging
+import sqlite3
+import time
+
+from fairway.usecases.cache import ResultCache
+from fairway.usecases.exact import ExactResult
+from fairway.usecases.results import PartialResult
+
+
+class SQLiteResultCache(ResultCache):
+    """
+    Results stored in a SQLite database, as .npz blobs. The least recently used results are evicted once the blobs
+    take more than max_size bytes.
+    Keys are scoped by a namespace describing everything else results depend on (e.g. distributions, iterations
+    and seed), so that databases can be shared by different configurations
+    """
+
+    _result_types = {result_type.__name__: result_type for result_type in (PartialResult, ExactResult)}
+
+    def __init__(self, database_file: str, namespace: str = '', max_size: int = 64 * 2**20):
+        """
+        :param database_file:
+        :param namespace:
+        :param max_size: the maximum size of the cached results, in bytes
+        """
+        super().__init__()
+        assert (max_size > 0)
+        self._database_file = str(database_file)
+        self._namespace = namespace
+        self._max_size = max_size
+        self._connection = None
+
+    def __getstate__(self):
+        # Connections are not shared across processes
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def get(self, key: str):
+        key = self._scoped(key)
+        try:
+            with self._connect() as connection:
+                row = connection.execute("SELECT kind, data FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            kind, data = row
+            return self._result_types[kind].load(io.BytesIO(data))
+        except (sqlite3.Error, KeyError, ValueError, OSError) as e:
+            logging.warning("Cannot read the result cache {}: {}".format(self._database_file, e))
+            return None
+
+    def put(self, key: str, result):
+        if result.__class__.__name__ not in self._result_types:
+            return
+        data = io.BytesIO()
+        result.save(data)
+        data = data.getvalue()
+        try:
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO results (key, kind, data, size, last_used) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   (self._scoped(key), result.__class__.__name__, data, len(data), time.time()))
+                self._evict(connection)
+        except sqlite3.Error as e:
+            logging.warning("Cannot write the result cache {}: {}".format(self._database_file, e))
+
+    def _evict(self, connection: sqlite3.Connection):
+        total_size, = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        if total_size <= self._max_size:
+            return
+        # Walk the results from the least recently used one, until enough space is freed
+        evicted = list()
+        for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total_size <= self._max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+        connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def _scoped(self, key: str) -> str:
+        return hashlib.sha256((self._namespace + '\n' + key).encode()).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._database_file, timeout=30)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                                     "data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        return self._connection
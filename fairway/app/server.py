@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from itertools import count
+
+import inject
+
+from fairway.app.batch import Event, evaluate_event, initialize_worker
+from fairway.usecases.simulator import Simulator
+
+
+MAX_REQUEST_SIZE = 1 << 20
+
+
+class EstimationServer(object):
+    """
+    Local HTTP server evaluating tournaments on a pool of warm worker processes (configured, with the distributions
+    loaded, once). Requests are JSON objects with inline players, like the events of a batch (see Event):
+        POST /estimate  {"players": [{"handicap": 10, "team": 1}, ...], "best_balls": 2, "allowance": 100}
+        POST /assign    {"players": [{"handicap": 10}, ...], "nteams": 4, "best_balls": 2, "format": "scramble"}
+        GET  /health
+    At most number_of_workers + queue_size requests are admitted at a time; the others are rejected with 503
+    """
+
+    def __init__(self, config: dict, number_of_workers: int = 1, queue_size: int = 16, optimize: bool = False,
+                 number_of_best_balls: int = 1, allowance: int = 100, game_format: str = 'best-ball'):
+        """
+        :param config: the arguments of create_config
+        :param number_of_workers: the number of processes evaluating requests
+        :param queue_size: the number of admitted requests waiting for a worker
+        :param optimize: try to improve the fairness of assigned teams
+        :param number_of_best_balls: the number of best balls of the requests that do not set it
+        :param allowance: the handicap allowance of the requests that do not set it
+        :param game_format: the format of the requests that do not set it
+        """
+        assert (number_of_workers >= 1)
+        assert (queue_size >= 0)
+        self._config = config
+        self._number_of_workers = number_of_workers
+        self._admissions = asyncio.BoundedSemaphore(number_of_workers + queue_size)
+        self._optimize = optimize
+        self._number_of_best_balls = number_of_best_balls
+        self._allowance = allowance
+        self._game_format = game_format
+        self._request_ids = count(1)
+        self._executor = None
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080, socket_path: str = None):
+        """
+        Serve on a TCP port, or on a Unix socket if socket_path is given, until cancelled
+        """
+        self._executor = ProcessPoolExecutor(max_workers=self._number_of_workers, initializer=initialize_worker,
+                                             initargs=(self._config, logging.getLogger().level))
+        try:
+            # Start the workers, and load their distributions, so that the first requests do not pay for it
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up)
+                                   for _ in range(self._number_of_workers)))
+            if socket_path:
+                server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+            else:
+                server = await asyncio.start_server(self._handle_connection, host, port)
+            logging.info("Serving on {}".format(socket_path or "{}:{}".format(host, port)))
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                status, body = await self._handle_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                status, body = HTTPStatus.BAD_REQUEST, {'error': str(e)}
+            except Exception as e:
+                # Faults of the server (e.g. a broken pool of workers) still get a response
+                logging.exception("Request failed")
+                status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e) or repr(e)}
+            payload = json.dumps(body).encode()
+            writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                         "Connection: close\r\n\r\n".format(status.value, status.phrase, len(payload)).encode() +
+                         payload)
+            await writer.drain()
+        except ConnectionError as e:
+            logging.debug("Connection lost: {}".format(e))
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        method, path, _ = request_line
+        headers = dict()
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, {'status': 'ok'}
+        if path not in ('/estimate', '/assign'):
+            return HTTPStatus.NOT_FOUND, {'error': "Unknown path {}".format(path)}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use POST"}
+        content_length = int(headers.get('content-length', 0))
+        if content_length > MAX_REQUEST_SIZE:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Requests are limited to {} bytes"
+                                                                  .format(MAX_REQUEST_SIZE)}
+        body = await reader.readexactly(content_length)
+
+        if self._admissions.locked():
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Too many requests, retry later"}
+        async with self._admissions:
+            event = self._parse_event(path, json.loads(body or b'{}'))
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, evaluate_event, event,
+                                                                      self._optimize)
+        return (HTTPStatus.INTERNAL_SERVER_ERROR if 'error' in result else HTTPStatus.OK), result
+
+    def _parse_event(self, path: str, record: dict) -> Event:
+        """
+        The event of a request, checked here so that invalid requests are answered with 400, and not failed by the
+        workers (see Event)
+        :raise ValueError: if the request is not a valid event
+        """
+        if not isinstance(record, dict) or 'players' not in record:
+            raise ValueError("Requests need inline players")
+        if path == '/assign' and 'nteams' not in record:
+            raise ValueError("Assignments need the number of teams (nteams)")
+        # Players are only read inline: requests cannot read files of the server
+        record = {key: value for key, value in record.items()
+                  if key != 'players_file' and not (path == '/estimate' and key == 'nteams')}
+        try:
+            return Event.from_json(next(self._request_ids), record, '', self._number_of_best_balls, self._allowance,
+                                   self._game_format)
+        except (AssertionError, KeyError, TypeError) as e:
+            raise ValueError("Invalid request: {!r}".format(e))
+
+
+def _warm_up():
+    """
+    Load the score distributions of a worker (configured by initialize_worker), so that its first request does not pay
+    for it
+    """
+    score_distributions = inject.instance(Simulator).score_distributions
+    score_distributions.get_cumulative_distributions(range(len(score_distributions.cumulative_distributions)))
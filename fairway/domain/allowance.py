@@ -1,10 +1,13 @@
-from typing import Iterable
+from functools import lru_cache
+from typing import Iterable, Tuple
 
 from numpy import floor
 
 import numpy as np
 
 from fairway.domain.player import Player
+from fairway.domain.player_table import table_rows
+from fairway.util import profiling
 
 
 def get_allowances(players: Iterable[Player], number_of_holes: int, allowance_adjustment: float)-> np.ndarray:
@@ -15,16 +18,35 @@ def get_allowances(players: Iterable[Player], number_of_holes: int, allowance_ad
     :param allowance_adjustment:
     :return:
     """
-    n_players = len(players)
-    handicaps = tuple(player.handicap for player in players)
-    min_handicap = min(handicaps)
-    allowances = np.zeros((n_players, number_of_holes))
-    for index, handicap in enumerate(handicaps):
-        for hole in range(number_of_holes):
-            allowance = 0
-            if hole <= (handicap * allowance_adjustment):
-                allowance = get_allowance(hole, handicap - min_handicap, number_of_holes)
-            allowances[index][hole] = allowance
+    with profiling.stage('allowances'):
+        rows = table_rows(players)
+        if rows is not None:
+            table, rows = rows
+            handicaps = table.handicaps[rows]
+        else:
+            handicaps = np.fromiter((player.handicap for player in players), dtype=np.int64, count=len(players))
+        # Allowances only depend on the handicap of the player and on the lowest one: fields with the same handicaps,
+        # in any order, share the allowances of each distinct handicap
+        distinct_handicaps, inverse = np.unique(handicaps, return_inverse=True)
+        distinct_allowances = _get_allowances(tuple(int(handicap) for handicap in distinct_handicaps),
+                                              number_of_holes, float(allowance_adjustment))
+        return distinct_allowances[inverse]
+
+
+@lru_cache(maxsize=256)
+def _get_allowances(distinct_handicaps: Tuple[int, ...], number_of_holes: int,
+                    allowance_adjustment: float) -> np.ndarray:
+    """
+    Vectorized get_allowance over the holes that each (sorted, distinct) handicap is granted allowances on
+    """
+    handicaps = np.array(distinct_handicaps)
+    diffs = (handicaps - handicaps[0])[:, np.newaxis]
+    holes = np.arange(number_of_holes)[np.newaxis, :]
+    # Every hole gets diff // #holes strokes, and the first diff % #holes holes one more
+    allowances = -(diffs // number_of_holes + (holes + 1 <= diffs % number_of_holes))
+    # Whole strokes: the same compact integers as the scores they are added to
+    allowances = np.where(holes <= handicaps[:, np.newaxis] * allowance_adjustment, allowances, 0).astype(np.int8)
+    allowances.setflags(write=False)    # Shared by the cache
     return allowances
 
 
@@ -18,3 +18,19 @@ class Game(ABC):
     @abstractmethod
     def play_team_game(self, players, teams):
         pass
+
+    @abstractmethod
+    def play_team_game_progressively(self, players, teams, progress_interval: int):
+        """
+        Play the team game like play_team_game, yielding the running results every progress_interval iterations.
+        Each result is applied to the teams before being yielded, so the teams keep the last one if the game is
+        stopped early
+        """
+        pass
+
+    def incremental_evaluator(self, players, teams):
+        """
+        Returns an evaluator that re-plays the team game cheaply after swapping players, or None if the game does not
+        support it
+        """
+        return None
@@ -1,55 +1,126 @@
-import uuid
+from typing import Iterable, Sequence
 
+from fairway.domain.player_table import PlayerTable, table_rows
 from fairway.domain.playing_entity import PlayingEntity
 
 
-Player_Id = 0
-
-
 class Player(PlayingEntity):
+    """
+    A view onto a row of a PlayerTable
+    """
+
+    __slots__ = ('_table', '_row', '_allowances_by_hole')
 
     def __init__(self, player_id: int, handicap_index: int, team_id=None,
-                 expected_score: float = 0.0, prob_of_winning: float = 0.0):
+                 expected_score: float = 0.0, prob_of_winning: float = 0.0, table: PlayerTable = None, row: int = None):
+        """
+        Add a player to the table (a new one of its own, if not given), or, given a row, create a view onto an existing
+        one
+        """
         assert isinstance(player_id, int)
         assert isinstance(handicap_index, int)
-        assert isinstance(handicap_index, int)
         assert (0 <= handicap_index <= 36)
 
-        super().__init__(expected_score, prob_of_winning)
-        self._player_id = player_id
-        self._handicap = handicap_index
+        self._table = table if table is not None else PlayerTable(1)
+        if row is None:
+            row, = self._table.append([player_id], [handicap_index], [team_id], [expected_score], [prob_of_winning])
+        self._row = int(row)
         self._allowances_by_hole = None
-        self._team_id = team_id
 
     def __repr__(self):
         return "{}: id= {} ({}), handicap:{}, win prob.:{}, expected score:{}".format(
             self.__class__.__name__, self.id, self.team_id, self.handicap, self.prob_of_winning, self.expected_score)
 
     @classmethod
-    def create(cls, handicap_index: int, team_id: int = None):
-        global Player_Id
-        player_id = Player_Id #uuid.uuid4().int
-        Player_Id += 1
-        player = cls(player_id, handicap_index)
-        player.team_id = team_id
+    def create(cls, handicap_index: int, team_id: int = None, table: PlayerTable = None):
+        """
+        Add a player to the table (default: a new table of its own, until a tournament gathers its players, see
+        share_table). Players are numbered in the order they are added to their table
+        """
+        table = table if table is not None else PlayerTable(1)
+        return cls(len(table), handicap_index, team_id, table=table)
+
+    @classmethod
+    def create_all(cls, handicap_indexes: Sequence[int], team_ids: Sequence[int] = None,
+                   table: PlayerTable = None) -> Iterable['Player']:
+        """
+        Create many players at once, adding their rows to the table in bulk (see create)
+        :param handicap_indexes:
+        :param team_ids: (default: no team)
+        :param table: (default: a new table of their own)
+        :return: the tuple of the players
+        """
+        assert all(0 <= handicap_index <= 36 for handicap_index in handicap_indexes)
+        table = table if table is not None else PlayerTable(max(len(handicap_indexes), 1))
+        player_ids = range(len(table), len(table) + len(handicap_indexes))
+        rows = table.append(player_ids, handicap_indexes, team_ids)
+        return tuple(cls(player_id, int(handicap_index), table=table, row=row)
+                     for player_id, handicap_index, row in zip(player_ids, handicap_indexes, rows))
+
+    @classmethod
+    def share_table(cls, players: Sequence['Player']) -> PlayerTable:
+        """
+        Move the rows of players that do not share a table (e.g. created one at a time) to a new table of their own,
+        renumbering them in their order, so that the columns of the field are read at once and the tables of one
+        player are freed
+        :param players:
+        :return: the table of the players
+        """
+        rows = table_rows(players)
+        if rows is not None:
+            return rows[0]
+        table = PlayerTable(max(len(players), 1))
+        rows = table.append(range(len(players)), [player.handicap for player in players],
+                            [player.team_id for player in players], [player.expected_score for player in players],
+                            [player.prob_of_winning for player in players])
+        for player, row in zip(players, rows):
+            player._table = table
+            player._row = int(row)
+        return table
+
+    @property
+    def table(self) -> PlayerTable:
+        return self._table
 
-        return player
+    @property
+    def row(self) -> int:
+        return self._row
 
     @property
     def id(self):
-        return self._player_id
+        return self._table.get_id(self._row)
 
     @property
     def team_id(self):
-        return self._team_id
+        return self._table.get_team_id(self._row)
 
     @team_id.setter
     def team_id(self, team_id):
-        self._team_id = team_id
+        self._table.set_team_id(self._row, team_id)
 
     @property
     def handicap(self):
-        return self._handicap
+        return self._table.get_handicap(self._row)
+
+    @property
+    def expected_score(self):
+        return self._table.get_expected_score(self._row)
+
+    @expected_score.setter
+    def expected_score(self, score):
+        self._table.set_expected_score(self._row, score)
+
+    @property
+    def prob_of_winning(self):
+        return self._table.get_win_probability(self._row)
+
+    @prob_of_winning.setter
+    def prob_of_winning(self, score):
+        self._table.set_win_probability(self._row, score)
+
+    def reset(self):
+        self.expected_score = 0.0
+        self.prob_of_winning = 0.0
 
     @property
     def allowances_by_hole(self):
@@ -0,0 +1,127 @@
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Team id of the players that do not belong to any team
+NO_TEAM = -1
+
+
+class PlayerTable(object):
+    """
+    Columnar storage of the players: ids, handicaps, team ids, expected scores and probabilities of winning are kept
+    in arrays, and players are views onto a row of the table (see Player). Columns of a whole field are then read and
+    written at once, without gathering the attributes of each player. Each run, or each request of a service, keeps
+    its players in a table of its own, that goes away with them
+    """
+
+    def __init__(self, capacity: int = 64):
+        assert (capacity > 0)
+        self._size = 0
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._handicaps = np.empty(capacity, dtype=np.int64)
+        self._team_ids = np.empty(capacity, dtype=np.int64)
+        self._expected_scores = np.empty(capacity, dtype=np.float64)
+        self._win_probabilities = np.empty(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def handicaps(self) -> np.ndarray:
+        return self._handicaps[:self._size]
+
+    @property
+    def team_ids(self) -> np.ndarray:
+        """
+        The team id of each player (NO_TEAM for players without a team)
+        """
+        return self._team_ids[:self._size]
+
+    @property
+    def expected_scores(self) -> np.ndarray:
+        return self._expected_scores[:self._size]
+
+    @property
+    def win_probabilities(self) -> np.ndarray:
+        return self._win_probabilities[:self._size]
+
+    def append(self, ids: Sequence[int], handicaps: Sequence[int], team_ids: Sequence[Optional[int]] = None,
+               expected_scores: Sequence[float] = None, win_probabilities: Sequence[float] = None) -> np.ndarray:
+        """
+        Add rows to the table
+        :param ids:
+        :param handicaps:
+        :param team_ids: (default: no team)
+        :param expected_scores: (default: 0)
+        :param win_probabilities: (default: 0)
+        :return: the indexes of the new rows
+        """
+        n_rows = len(ids)
+        assert (len(handicaps) == n_rows)
+        self._reserve(self._size + n_rows)
+        rows = slice(self._size, self._size + n_rows)
+        self._ids[rows] = ids
+        self._handicaps[rows] = handicaps
+        self._team_ids[rows] = NO_TEAM if team_ids is None else \
+            [NO_TEAM if team_id is None else team_id for team_id in team_ids]
+        self._expected_scores[rows] = 0.0 if expected_scores is None else expected_scores
+        self._win_probabilities[rows] = 0.0 if win_probabilities is None else win_probabilities
+        self._size += n_rows
+        return np.arange(rows.start, rows.stop)
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self._ids):
+            return
+        capacity = max(capacity, 2 * len(self._ids))
+        for column in ('_ids', '_handicaps', '_team_ids', '_expected_scores', '_win_probabilities'):
+            array = getattr(self, column)
+            resized = np.empty(capacity, dtype=array.dtype)
+            resized[:self._size] = array[:self._size]
+            setattr(self, column, resized)
+
+    # Access to the row of a player
+
+    def get_id(self, index: int) -> int:
+        return int(self._ids[index])
+
+    def get_handicap(self, index: int) -> int:
+        return int(self._handicaps[index])
+
+    def get_team_id(self, index: int) -> Optional[int]:
+        team_id = int(self._team_ids[index])
+        return None if team_id == NO_TEAM else team_id
+
+    def set_team_id(self, index: int, team_id: Optional[int]):
+        self._team_ids[index] = NO_TEAM if team_id is None else team_id
+
+    def get_expected_score(self, index: int) -> float:
+        return float(self._expected_scores[index])
+
+    def set_expected_score(self, index: int, expected_score: float):
+        self._expected_scores[index] = expected_score
+
+    def get_win_probability(self, index: int) -> float:
+        return float(self._win_probabilities[index])
+
+    def set_win_probability(self, index: int, win_probability: float):
+        self._win_probabilities[index] = win_probability
+
+
+def table_rows(players: Iterable) -> Optional[Tuple[PlayerTable, np.ndarray]]:
+    """
+    Returns the table and the rows of the players if they are all views onto the same table, None otherwise
+    :param players:
+    :return:
+    """
+    players = tuple(players)
+    if not players:
+        return None
+    table = getattr(players[0], 'table', None)
+    if table is None or any(getattr(player, 'table', None) is not table for player in players):
+        return None
+    return table, np.fromiter((player.row for player in players), dtype=np.int64, count=len(players))
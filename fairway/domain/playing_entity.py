@@ -3,6 +3,8 @@ from abc import ABC, abstractmethod
 
 class PlayingEntity(ABC):
 
+    __slots__ = ('_expected_score', '_prob_of_winning')
+
     def __init__(self, expected_score=0.0, prob_of_winning=0.0):
         self._expected_score = expected_score
         self._prob_of_winning = prob_of_winning
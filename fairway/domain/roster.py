@@ -0,0 +1,72 @@
+from typing import Iterable, Sequence, Tuple
+
+from fairway.domain.player import Player
+from fairway.domain.team import Team
+
+
+class Roster(object):
+    """
+    Index of the players and teams of a tournament: the position of each player, and each team by id, so that looking
+    them up and moving players between teams take constant time
+    """
+
+    def __init__(self, players: Iterable[Player], teams: Iterable[Team]):
+        self._players = tuple(players)
+        self._teams = tuple(teams)
+        self._player_indexes = {player.id: index for index, player in enumerate(self._players)}
+        self._teams_by_id = {team.id: team for team in self._teams}
+        self._team_indexes = {team.id: index for index, team in enumerate(self._teams)}
+
+    @property
+    def players(self) -> Tuple[Player, ...]:
+        return self._players
+
+    @property
+    def teams(self) -> Tuple[Team, ...]:
+        return self._teams
+
+    def index_of(self, player: Player) -> int:
+        """
+        The position of the player in players
+        """
+        return self._player_indexes[player.id]
+
+    def get_team(self, team_id: int) -> Team:
+        return self._teams_by_id.get(team_id)
+
+    def team_index_of(self, player: Player) -> int:
+        """
+        The position in teams of the team of the player (None for players without a team)
+        """
+        return self._team_indexes.get(player.team_id)
+
+    def move(self, player: Player, team: Team):
+        """
+        Move the player to the given team
+        :param player:
+        :param team:
+        :return:
+        """
+        current_team = self.get_team(player.team_id)
+        if current_team is not None:
+            current_team.remove_player(player)
+        team.add_player(player)
+
+    def swap(self, player_0: Player, player_1: Player):
+        """
+        Move each player to the team of the other one
+        """
+        team_0 = self.get_team(player_0.team_id)
+        team_1 = self.get_team(player_1.team_id)
+        self.move(player_0, team_1)
+        self.move(player_1, team_0)
+
+    def assign(self, team_indexes: Sequence[int]):
+        """
+        Move each player to the team at the given position
+        :param team_indexes: the position in teams of the team of each player
+        :return:
+        """
+        for player, team_index in zip(self._players, team_indexes):
+            if self.team_index_of(player) != team_index:
+                self.move(player, self._teams[team_index])
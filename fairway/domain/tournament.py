@@ -3,7 +3,8 @@ from typing import Iterable
 from fairway.domain.allowance import get_allowances
 from fairway.domain.game import Game
 from fairway.domain.player import Player
-from fairway.domain.team import Team
+from fairway.domain.roster import Roster
+from fairway.domain.team import Team, create_empty_teams
 
 
 class Tournament(object):
@@ -17,20 +18,20 @@ class Tournament(object):
         assert (0.0 <= allowance_adjustment <= 1.0)
         self.allowance_adjustment = allowance_adjustment
         self.game = game
+        Player.share_table(players)
         self._players = players
-        self.teams = tuple(Team.create() for i in range(number_of_teams))
+        self.teams = create_empty_teams(number_of_teams)
+        self.roster = Roster(players, self.teams)
         allowances = get_allowances(players, self.game.number_of_holes, allowance_adjustment)
         for index, player in enumerate(self._players):
             player.allowances_by_hole = allowances[index, :]
 
     @property
     def players(self):
-        return tuple(player for player in self._players)
+        return self.roster.players
 
     def get_team(self, team_id: int) -> Team:
-        for team in self.teams:
-            if team.id is team_id:
-                return team
+        return self.roster.get_team(team_id)
 
     def number_of_teams(self):
         return len(self.teams)
@@ -6,6 +6,7 @@ setup(
     name="fairway",
     version="0.1",
     packages=find_packages(),
+    python_requires=">=3.9",
     install_requires=[
         "click",
         "numpy",
@@ -109,8 +109,11 @@ def weakest_first(teams, player_goodness_criteria):
     teams_q = []  # Min heap
     for team_wrapper in sorted_team_wrappers:
         heappush(teams_q, team_wrapper)
-    while len(sorted_team_wrappers) > 0:
+    while len(teams_q) > 0:
         team_wrapper = heappop(teams_q)   # Pop weakest team
+        number_of_members = len(team_wrapper[1].members)
         yield team_wrapper[1]
+        if len(team_wrapper[1].members) == number_of_members:
+            continue    # The team is full: yielding it again would never end
         team_wrapper = (goodness(team_wrapper[1], player_goodness_criteria), team_wrapper[1])
         heappush(teams_q, team_wrapper)     # Push it back
@@ -1,28 +1,40 @@
-from typing import Iterable
+from abc import ABC, abstractmethod
+from functools import partial
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
 
 import inject
 
 import numpy as np
 
-from operator import itemgetter
 from fairway.domain.game import Game
 from fairway.domain.player import Player
+from fairway.domain.player_table import table_rows
 from fairway.domain.playing_entity import PlayingEntity
 from fairway.domain.team import Team
-from fairway.usecases.simulator import Simulator
-from fairway.util.corutine import coroutine, limit
+from fairway.usecases.distributions import SCORE_DTYPE
+from fairway.usecases.kernels import TOTAL_DTYPE, BestBallKernel, ScoringKernel, pairwise_wins, split_ties
+from fairway.usecases.results import PartialResult
+from fairway.usecases.simulator import Simulator, SimulationTask
 
 
 class BestBallGame(Game):
+    """
+    Players play individually, scored by hole wins, and in teams, scored by a kernel: the best balls of the teams in
+    stroke play by default, or any other format (see ScoringKernel)
+    """
 
     simulator = inject.attr(Simulator)
 
-    def __init__(self, number_of_holes: int = 18, number_of_best_balls: int = 1):
+    def __init__(self, number_of_holes: int = 18, number_of_best_balls: int = 1, kernel: ScoringKernel = None):
         assert isinstance(number_of_holes, int)
         assert isinstance(number_of_best_balls, int)
 
         self._number_of_holes = number_of_holes
         self._number_of_best_balls = number_of_best_balls
+        self._kernel = kernel if kernel is not None else BestBallKernel(number_of_best_balls)
+        self._last_result = None
+        self._indexed_players = None
+        self._player_id_to_index = None
 
     @property
     def number_of_best_balls(self):
@@ -32,143 +44,294 @@ class BestBallGame(Game):
     def number_of_holes(self):
         return self._number_of_holes
 
+    @property
+    def kernel(self) -> ScoringKernel:
+        """
+        The scoring of the team game
+        """
+        return self._kernel
+
+    @property
+    def last_result(self) -> PartialResult:
+        """
+        The results of the last simulated (or applied) game
+        """
+        return self._last_result
+
     def play_individual_game(self, players: Iterable[Player]):
-        self._play(count_hole_wins(), players)
+        self._play(HoleWinsCounter, players)
 
     def play_team_game(self, players: Iterable[Player], teams: Iterable[Team]):
-        self._play(count_game_wins(), players, teams)
+        self._play(self._team_counter(), players, teams)
+
+    def play_team_game_progressively(self, players: Iterable[Player], teams: Iterable[Team],
+                                     progress_interval: int) -> Iterator[PartialResult]:
+        task = self._create_task(self._team_counter(), players, teams)
+        for result in self.simulator.simulate_progressively(task, progress_interval):
+            self.apply_result(teams, result)
+            yield result
+
+    def _play(self, counter_type, players, teams=None) -> Iterable[PlayingEntity]:
+        result = self.simulator.simulate(self._create_task(counter_type, players, teams))
+        self.apply_result(teams if teams else players, result)
+        return teams if teams else players
 
-    def _play(self, counter_fn, players, teams=None) -> Iterable[PlayingEntity]:
+    def _team_counter(self):
+        return partial(GameWinsCounter, self._kernel)
+
+    def incremental_evaluator(self, players: Iterable[Player],
+                              teams: Iterable[Team]) -> Optional['IncrementalEvaluator']:
+        """
+        Returns an evaluator of the team game that re-plays the scenarios of the players after swaps, or None if the
+        simulator does not sample scenarios, or if the kernel does not score teams independently
+        :param players:
+        :param teams:
+        :return:
+        """
+        from fairway.usecases.incremental import IncrementalEvaluator
+        if not self._kernel.separable:
+            return None
+        task = self._create_task(self._team_counter(), players, teams)
+        players_scenarios = self.simulator.get_players_scenarios(task)
+        if players_scenarios is None:
+            return None
+        return IncrementalEvaluator(players_scenarios, self._teams_as_player_indexes(players, teams), self._kernel,
+                                    self.simulator.memory_budget)
+
+    def hole_distributions(self, players: Iterable[Player]) -> Optional[Sequence[Sequence['Distribution']]]:
+        """
+        Returns the exact score distribution of each player on each hole (allowances included), or None if the teams
+        of the kernel cannot be evaluated exactly (see ExactSimulator)
+        :param players:
+        :return: #holes x #players distributions
+        """
+        from fairway.usecases.exact import get_hole_distributions
+        if not isinstance(self._kernel, BestBallKernel):
+            return None
+        return get_hole_distributions(self._create_task(HoleWinsCounter, players))
+
+    def _create_task(self, counter_type, players, teams=None) -> SimulationTask:
         # Vectorize objects for faster processing:
         # Players -> enumerable of handicaps
         # Teams -> enumerable of indexes
         # Create allowance matrix
-        teams_as_player_indexes = None
-        if teams:
-            teams_as_player_indexes = list()
-            player_id_to_index = dict()
-            for index, player in enumerate(players):
-                player_id_to_index[player.id] = index
-            for team in teams:
-                teams_as_player_indexes.append(tuple(player_id_to_index[player.id] for player in team.members))
-        player_handicaps = tuple(player.handicap for player in players)
-        all_allowances = np.vstack((player.allowances_by_hole for player in players))  # Pre-compute allowance matrix
+        rows = table_rows(players)
+        if rows is not None:
+            table, rows = rows
+            player_handicaps = table.handicaps[rows]
+        else:
+            player_handicaps = tuple(player.handicap for player in players)
+        all_allowances = np.vstack([player.allowances_by_hole for player in players])  # Pre-compute allowance matrix
         assert (all_allowances.shape == (len(players), self._number_of_holes))
+        reduce = TeamScenarios(self._teams_as_player_indexes(players, teams), self._kernel) if teams else None
+        task = self.simulator.create_task(player_handicaps, all_allowances, reduce, counter_type)
+        check_score_range(task.cumulative_distributions.shape[1], int(np.min(all_allowances, initial=0)),
+                          self._number_of_holes, self._number_of_best_balls if teams else 1)
+        return task
+
+    def _teams_as_player_indexes(self, players, teams):
+        if not (isinstance(players, tuple) and players is self._indexed_players):
+            # Tournaments pass the same tuple of players every time: index it once
+            self._indexed_players = players
+            self._player_id_to_index = {player.id: index for index, player in enumerate(players)}
+        return [tuple(self._player_id_to_index[player.id] for player in team.members) for team in teams]
+
+    def apply_result(self, entities: Iterable[PlayingEntity], result: PartialResult):
+        """
+        Update the expected scores and the probabilities of winning of the entities with the simulation results, which
+        become the last result
+        :param entities: the playing entities, in the same order used by the simulation
+        :param result:
+        :return:
+        """
+        self._last_result = result
+        scores = np.round(result.expected_scores, 2)
+        rows = table_rows(entities)
+        if rows is not None:
+            # Players: write the columns of the table at once
+            table, rows = rows
+            table.expected_scores[rows] = scores
+            table.win_probabilities[rows] = result.win_probabilities
+            return
+        for entity, score, win_prob in zip(entities, scores, result.win_probabilities):
+            entity.expected_score = score
+            entity.prob_of_winning = win_prob
 
-        # Algorithm
-        self.simulator.reset()
-        tot_scores = None
-        number_of_wins = dict()
+    def to_team_scenario(self, players_scenarios, teams):
+        """
+        Reduce the scores of the players to the scores of their teams on each hole, by the kernel of the game
+        :param players_scenarios: a #players x #holes array, or a batch of them (#scenarios x #players x #holes)
+        :param teams: an enumerable containing the indexes of the players of each team
+        :return: a #teams x #holes array, or a #scenarios x #teams x #holes array for batches
+        """
+        return TeamScenarios(teams, self._kernel)(players_scenarios)
 
-        for tot_scores, number_of_wins in limit(self.simulator.number_of_iterations, self._scenario(all_allowances,
-                                                                                                    player_handicaps, teams_as_player_indexes,
-                                                                                                    counter_fn)):
-            pass
-        counter_fn.close()
 
-        total = sum(v for k, v in number_of_wins.items())
-        win_probabilities = np.zeros(len(teams_as_player_indexes) if teams_as_player_indexes else len(players))
-        for k, v in number_of_wins.items():
-            win_probabilities[k] = v / total
+def check_score_range(highest_score: int, lowest_allowance: int, number_of_holes: int, number_of_best_balls: int):
+    """
+    Scores flow through the simulation as compact integers: per-hole scores of players and teams as SCORE_DTYPE, total
+    scores of a scenario as TOTAL_DTYPE (accumulators over scenarios are 64-bit). Asserts that no score of a game can
+    overflow them
+    :param highest_score: the highest score of a hole
+    :param lowest_allowance: the lowest (most negative) allowance of a hole
+    :param number_of_holes:
+    :param number_of_best_balls: the scores summed for each hole (1 for individual games)
+    :return:
+    """
+    hole_scores = np.iinfo(SCORE_DTYPE)
+    total_scores = np.iinfo(TOTAL_DTYPE)
+    lowest_hole_score = number_of_best_balls * (1 + lowest_allowance)
+    # The highest value of SCORE_DTYPE pads the best balls of smaller teams: actual scores stay below it
+    highest_hole_score = number_of_best_balls * highest_score
+    assert (hole_scores.min <= lowest_hole_score and highest_hole_score < hole_scores.max), \
+        "Hole scores within [{}, {}] overflow {}".format(lowest_hole_score, highest_hole_score, hole_scores.dtype)
+    assert (total_scores.min <= lowest_hole_score * number_of_holes and
+            highest_hole_score * number_of_holes <= total_scores.max), \
+        "Total scores overflow {}".format(total_scores.dtype)
+
+
+class TeamScenarios(object):
+    """
+    Picklable reduction of batches of player scenarios to the hole scores of the teams, by a scoring kernel
+    """
 
-        scores = np.round(tot_scores / self.simulator.number_of_iterations, 2)
+    def __init__(self, teams, kernel: ScoringKernel):
+        """
+        :param teams: an enumerable containing the indexes of the players of each team
+        :param kernel:
+        """
+        self.membership, self.team_sizes = team_membership_index(teams)
+        self.kernel = kernel
 
-        # Update entities
-        for entity, score, win_prob in zip(teams if teams else players, scores, win_probabilities):
-            entity.expected_score = score
-            entity.prob_of_winning = win_prob
+    def __call__(self, players_scenarios: np.ndarray) -> np.ndarray:
+        return self.kernel.hole_scores(players_scenarios, self.membership, self.team_sizes)
 
-        return teams if teams else players
 
-    def _scenario(self, allowances: np.ndarray, player_handicaps: Iterable[int], teams=None, aggregate_by=None):
-        while True:
-            sample = self.simulator.sample_game_scenario(player_handicaps, self.number_of_holes)
-            s = np.add(self.simulator.sample_game_scenario(player_handicaps, self.number_of_holes), allowances)
-            if teams:
-                s = self.to_team_scenario(s, teams)
+def team_membership_index(teams) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns a #teams x #players-in-the-largest-team array with the indexes of the players of each team, and the size
+    of each team. Rows of teams smaller than the largest one are padded with -1
+    :param teams: an enumerable containing the indexes of the players of each team
+    :return:
+    """
+    team_sizes = np.fromiter((len(player_indexes) for player_indexes in teams), dtype=int, count=len(teams))
+    membership = np.full((len(teams), np.max(team_sizes)), -1, dtype=int)
+    for team_index, player_indexes in enumerate(teams):
+        membership[team_index, :team_sizes[team_index]] = player_indexes
+    return membership, team_sizes
 
-            if aggregate_by:
-                yield aggregate_by.send(s)
-            else:
-                yield s
 
-    def to_team_scenario(self, players_scenarios, teams):
-        n_players, n_holes = players_scenarios.shape
-        team_scenarios = np.zeros((len(teams), n_holes), dtype=int)
-        players_scenarios_tr = players_scenarios.transpose()
-        for team_index, player_indexes in enumerate(teams):
-            for hole in range(n_holes):
-                all_team_scores = np.asarray(itemgetter(*player_indexes)(players_scenarios_tr[hole]), dtype=int)
-                if self._number_of_best_balls < len(player_indexes):
-                    indexes = np.argpartition(all_team_scores, self.number_of_best_balls)
-                    team_best_scores_sum = np.sum(all_team_scores[indexes[:self.number_of_best_balls]])
-                else:
-                    team_best_scores_sum = np.sum(all_team_scores)
-                team_scenarios[team_index, hole] = team_best_scores_sum
-
-        return team_scenarios
-
-
-def _update_scores(game_scenario, current_tot_scores):
-    n_players, _ = game_scenario.shape
-    scores = np.zeros(n_players)
-    for player_index in range(n_players):
-        scores[player_index] = np.sum(game_scenario[player_index, :])
-
-    tot_scores = np.add(current_tot_scores, scores)
-    return scores, tot_scores
-
-
-@coroutine
-def count_hole_wins():
+class WinsCounter(ABC):
+    """
+    Accumulates the total scores and the number of wins of each playing entity over batches of game scenarios, and,
+    for games, the wins of each entity against each other one (the head-to-head matrix).
+    Ties are split evenly: each of the k tied winners is credited 1/k of a win
     """
 
-    :return: counts the
+    def __init__(self):
+        super().__init__()
+        self._number_of_scenarios = 0
+        self._total_scores = None
+        self._number_of_wins = None
+        self._squared_win_shares = None
+        self._head_to_head_wins = None
+
+    @property
+    def number_of_scenarios(self) -> int:
+        return self._number_of_scenarios
+
+    @property
+    def total_scores(self) -> np.ndarray:
+        return self._total_scores
+
+    @property
+    def number_of_wins(self) -> np.ndarray:
+        return self._number_of_wins
+
+    @property
+    def expected_scores(self) -> np.ndarray:
+        return self._total_scores / self._number_of_scenarios
+
+    @property
+    def win_probabilities(self) -> np.ndarray:
+        return self._number_of_wins / np.sum(self._number_of_wins)
+
+    def update(self, game_scenarios: np.ndarray):
+        """
+        :param game_scenarios: a #scenarios x #entities x #holes array
+        :return:
+        """
+        n_scenarios, n_entities, _ = game_scenarios.shape
+        if self._total_scores is None:
+            self._total_scores = np.zeros(n_entities, dtype=np.int64)
+            self._number_of_wins = np.zeros(n_entities)
+            self._squared_win_shares = np.zeros(n_entities)
+
+        scores = self._game_scores(game_scenarios)
+        wins = self._count_wins(game_scenarios, scores)
+        win_shares = wins / np.sum(wins, axis=1, keepdims=True)
+        self._total_scores += np.sum(scores, axis=0, dtype=np.int64)
+        self._number_of_wins += np.sum(wins, axis=0)
+        self._squared_win_shares += np.sum(np.square(win_shares), axis=0)
+        head_to_head_wins = self._count_head_to_head_wins(game_scenarios, scores)
+        if head_to_head_wins is not None:
+            self._head_to_head_wins = head_to_head_wins if self._head_to_head_wins is None \
+                else self._head_to_head_wins + head_to_head_wins
+        self._number_of_scenarios += n_scenarios
+
+    def result(self) -> PartialResult:
+        return PartialResult(self._number_of_scenarios, self._total_scores, self._number_of_wins,
+                             self._squared_win_shares, self._head_to_head_wins)
+
+    def _game_scores(self, game_scenarios: np.ndarray) -> np.ndarray:
+        """
+        :return: a #scenarios x #entities array with the score of each entity in each scenario
+        """
+        return np.sum(game_scenarios, axis=2, dtype=TOTAL_DTYPE)
+
+    @abstractmethod
+    def _count_wins(self, game_scenarios: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """
+        :return: a #scenarios x #entities array with the wins of each entity in each scenario
+        """
+        pass
+
+    def _count_head_to_head_wins(self, game_scenarios: np.ndarray, scores: np.ndarray) -> Optional[np.ndarray]:
+        """
+        :return: an #entities x #entities array with the wins of each entity against each other one, or None
+        """
+        return None
+
+
+class HoleWinsCounter(WinsCounter):
     """
-    tot_scores = None
-    curr_counts = dict()
-    while True:
-        game_scenario = (yield (tot_scores, curr_counts))
-
-        # Update Scores
-        if tot_scores is None:
-            n_players, _ = game_scenario.shape
-            tot_scores = np.zeros(n_players, dtype=int)
-        _, tot_scores = _update_scores(game_scenario, tot_scores)
-
-        # Update Hole Win Counts
-        _, n_holes = game_scenario.shape
-        for hole in range(n_holes):
-            hole_scores = game_scenario[:, hole]
-            winning_score = np.min(hole_scores)
-            winners = [idx for idx, score in enumerate(hole_scores) if score == winning_score]
-            for winner in winners:
-                curr_counts[winner] = curr_counts.get(winner, 0) + (1.0 / len(winners))
-
-
-@coroutine
-def count_game_wins():
+    Counts the holes won by each entity
     """
 
-    :return:
+    def _count_wins(self, game_scenarios: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        return np.sum(split_ties(game_scenarios, axis=1), axis=2)
+
+
+class GameWinsCounter(WinsCounter):
     """
-    tot_scores = None
-    curr_counts = dict()
-    while True:
-        game_scenario = (yield (tot_scores, curr_counts))
-
-        # Update Scores
-        if tot_scores is None:
-            n_players, _ = game_scenario.shape
-            tot_scores = np.zeros(n_players, dtype=int)
-        scores, tot_scores = _update_scores(game_scenario, tot_scores)
-
-        # Update Game Win Counts
-        winners = game_winners(scores)
-        for winner in winners:
-            curr_counts[winner] = curr_counts.get(winner, 0) + (1.0/len(winners))
-
-
-def game_winners(scores):
-    winning_score = np.min(scores)
-    return tuple(idx for idx in range(len(scores)) if scores[idx] == winning_score)
+    Counts the games won by each entity: the lowest total score wins, or the game is scored by a kernel
+    """
+
+    def __init__(self, kernel: ScoringKernel = None):
+        super().__init__()
+        self._kernel = kernel
+
+    def _game_scores(self, game_scenarios: np.ndarray) -> np.ndarray:
+        if self._kernel is None:
+            return super()._game_scores(game_scenarios)
+        return self._kernel.game_scores(game_scenarios)
+
+    def _count_wins(self, game_scenarios: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        if self._kernel is None:
+            return split_ties(scores, axis=1)
+        return self._kernel.win_shares(scores, axis=1)
+
+    def _count_head_to_head_wins(self, game_scenarios: np.ndarray, scores: np.ndarray) -> Optional[np.ndarray]:
+        if self._kernel is None:
+            return pairwise_wins(scores, scores)
+        return self._kernel.head_to_head_wins(game_scenarios, scores)
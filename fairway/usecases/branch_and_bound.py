@@ -0,0 +1,266 @@
+import logging
+import time
+from collections import defaultdict
+from typing import Iterator, Sequence, Tuple
+
+import inject
+
+import numpy as np
+
+from fairway.domain.tournament import Tournament
+from fairway.usecases.exact import Distribution, beat_probabilities, best_balls_distribution, convolve, envelope, \
+    head_to_head_of, win_probabilities_against, win_probabilities_of
+from fairway.usecases.fairness import FairnessEvaluator
+from fairway.usecases.swaps import SimpleSwapper, Swapper
+from fairway.util import profiling
+
+
+# The largest fields searched exactly
+MAX_PLAYERS = 24
+
+# A team, as the sorted indexes of the (distinct) handicaps of its members
+TeamHandicaps = Tuple[int, ...]
+
+
+class BranchAndBoundSwapper(Swapper):
+    """
+    Exact search of the fairest assignment of the players of small fields to teams, by branch and bound (see
+    AssignmentSearch). Teams are evaluated exactly (see ExactSimulator), so players with the same handicap are
+    interchangeable, and so are teams of the same size. The search starts from the current assignment, and applies
+    the fairest one found within the time budget: the fairest of all, if the search completes
+    """
+
+    _fairness_evaluator = inject.attr(FairnessEvaluator)
+
+    def __init__(self, time_budget: float = 5.0, max_players: int = MAX_PLAYERS):
+        """
+        :param time_budget: the wall-clock seconds the search runs for, at most
+        :param max_players: the largest fields searched (the others fall back to simple swaps)
+        """
+        super().__init__()
+        assert (time_budget > 0)
+        self._time_budget = time_budget
+        self._max_players = max_players
+
+    def adjust_teams(self, tournament: Tournament):
+        players = tournament.players
+        if len(players) > self._max_players:
+            logging.warning("Fields of more than {} players are not searched exactly: falling back to simple swaps"
+                            .format(self._max_players))
+            SimpleSwapper().adjust_teams(tournament)
+            return
+        hole_distributions = tournament.game.hole_distributions(players)
+        if hole_distributions is None:
+            logging.warning("The game cannot be evaluated exactly: falling back to simple swaps")
+            SimpleSwapper().adjust_teams(tournament)
+            return
+
+        # Players with the same handicap are interchangeable: the search assigns handicaps
+        handicaps = sorted({player.handicap for player in players})
+        handicap_indexes = {handicap: index for index, handicap in enumerate(handicaps)}
+        players_by_handicap = defaultdict(list)
+        for index, player in enumerate(players):
+            players_by_handicap[handicap_indexes[player.handicap]].append(index)
+        distributions = [[distributions[players_by_handicap[handicap][0]] for handicap in range(len(handicaps))]
+                         for distributions in hole_distributions]
+
+        # The search fills the largest teams first
+        team_order = sorted(range(len(tournament.teams)), key=lambda team: -len(tournament.teams[team].members))
+        current_teams = tuple(tuple(sorted(handicap_indexes[member.handicap]
+                                           for member in tournament.teams[team].members)) for team in team_order)
+        search = AssignmentSearch(distributions, [len(players_by_handicap[handicap])
+                                                  for handicap in range(len(handicaps))],
+                                  [len(team) for team in current_teams], tournament.game.kernel.number_of_best_balls,
+                                  self._fairness_evaluator)
+
+        start_time = time.perf_counter()
+        with profiling.stage('branch and bound'):
+            teams, fairness, complete = search.run(current_teams, start_time + self._time_budget)
+        profiling.count('branch and bound', search.number_of_nodes)
+        logging.info("Branch and bound: fairness {} in {} nodes ({:.2f}s)"
+                     .format(fairness, search.number_of_nodes, time.perf_counter() - start_time))
+        if not complete:
+            logging.warning("The time budget ran out before the exact search completed: there may be fairer teams")
+        if teams == current_teams:
+            return
+
+        team_indexes = [None] * len(players)
+        for team, team_handicaps in zip(team_order, teams):
+            for handicap in team_handicaps:
+                team_indexes[players_by_handicap[handicap].pop()] = team
+        tournament.roster.assign(team_indexes)
+        tournament.game.play_team_game(tournament.players, tournament.teams)
+
+
+class AssignmentSearch(object):
+    """
+    Branch and bound over the assignments of the players of a field, grouped by handicap, to teams of given sizes.
+    Handicaps are assigned one at a time, from the extremes inward, so that the remaining ones are as alike as
+    possible. Identical teams (the same handicaps so far, and the same size) are interchangeable, so they get
+    non-increasing numbers of players of each handicap. The distributions of the teams are memoized by handicaps.
+
+    A partial assignment is bounded by the best and the worst completions of its teams: on each hole, an open place
+    scores as the best (or the worst) envelope of the remaining handicaps (see envelope), stochastically better (worse)
+    than any remaining player. Teams are independent, so the probability of winning of a team is at most the one of
+    its best completion against the worst completions of the others (and at least the reverse), and so is the
+    probability that it beats each other team. The fairness evaluator bounds its index from them
+    """
+
+    def __init__(self, hole_distributions: Sequence[Sequence[Distribution]], counts: Sequence[int],
+                 team_sizes: Sequence[int], number_of_best_balls: int, fairness_evaluator: FairnessEvaluator):
+        """
+        :param hole_distributions: the score distribution of the players of each handicap on each hole
+        (#holes x #handicaps)
+        :param counts: the number of players of each handicap
+        :param team_sizes: the size of each team, the largest first
+        :param number_of_best_balls:
+        :param fairness_evaluator:
+        """
+        assert (sum(counts) == sum(team_sizes))
+        assert (min(team_sizes) > 0 and list(team_sizes) == sorted(team_sizes, reverse=True))
+        self._hole_distributions = hole_distributions
+        self._counts = counts
+        self._team_sizes = tuple(team_sizes)
+        self._number_of_best_balls = number_of_best_balls
+        self._fairness_evaluator = fairness_evaluator
+        self._order = _extremes_first(len(counts))
+        self._team_distributions = dict()
+        self._envelopes = dict()
+        self._best_teams = None
+        self._best_fairness = None
+        self._deadline = None
+        self._complete = True
+        self.number_of_nodes = 0
+
+    def run(self, teams: Sequence[TeamHandicaps], deadline: float) -> Tuple[Tuple[TeamHandicaps, ...], float, bool]:
+        """
+        Search the fairest assignment
+        :param teams: the current assignment: the handicaps of each team
+        :param deadline: the time (see time.perf_counter) at which the search stops
+        :return: the fairest assignment found (teams, if there is none fairer), its index of fairness, and whether
+        the search completed
+        """
+        self._best_teams = tuple(teams)
+        self._best_fairness = self.fairness(self._best_teams)
+        self._deadline = deadline
+        self._complete = True
+        self._visit(0, tuple(() for _ in self._team_sizes))
+        return self._best_teams, self._best_fairness, self._complete
+
+    def fairness(self, teams: Sequence[TeamHandicaps]) -> float:
+        """
+        The exact index of fairness of a complete assignment
+        """
+        distributions = [self._team_distribution(team) for team in teams]
+        head_to_head = head_to_head_of(distributions) if self._fairness_evaluator.uses_head_to_head else None
+        return float(self._fairness_evaluator.get_fairness_of_probabilities(win_probabilities_of(distributions),
+                                                                            head_to_head))
+
+    def _visit(self, level: int, teams: Tuple[TeamHandicaps, ...]):
+        """
+        Search the assignments of the handicaps from the level-th one on
+        """
+        if time.perf_counter() > self._deadline:
+            self._complete = False
+            return
+        self.number_of_nodes += 1
+        handicap = self._order[level]
+        children = [tuple(tuple(sorted(team + (handicap,) * count)) for team, count in zip(teams, counts))
+                    for counts in self._distributions(handicap, teams)]
+        child_level = level + 1
+        if child_level == len(self._order) - 1:
+            # The last handicap fills the open places
+            handicap = self._order[child_level]
+            children = [tuple(tuple(sorted(team + (handicap,) * (size - len(team))))
+                              for team, size in zip(child, self._team_sizes)) for child in children]
+            child_level += 1
+
+        # The most promising children first
+        bounds = [self._bound(child_level, child) for child in children]
+        for bound, child in sorted(zip(bounds, children)):
+            if bound >= self._best_fairness:
+                break
+            if child_level == len(self._order):
+                # The bound of a complete assignment is its fairness
+                self._best_teams, self._best_fairness = child, bound
+            else:
+                self._visit(child_level, child)
+
+    def _distributions(self, handicap: int, teams: Tuple[TeamHandicaps, ...]) -> Iterator[Tuple[int, ...]]:
+        """
+        Enumerates the numbers of players of the handicap that each team can get, up to the symmetries of the teams
+        """
+        open_places = [size - len(team) for team, size in zip(teams, self._team_sizes)]
+        places_left = np.cumsum(open_places[::-1])[::-1]
+        number_of_teams = len(teams)
+
+        def distribute(team: int, players_left: int, counts: Tuple[int, ...]):
+            if team == number_of_teams:
+                yield counts
+                return
+            most = min(players_left, open_places[team])
+            if team > 0 and teams[team] == teams[team - 1] and self._team_sizes[team] == self._team_sizes[team - 1]:
+                most = min(most, counts[-1])
+            least = max(0, players_left - (places_left[team + 1] if team + 1 < number_of_teams else 0))
+            for count in range(most, least - 1, -1):
+                yield from distribute(team + 1, players_left - count, counts + (count,))
+
+        return distribute(0, self._counts[handicap], ())
+
+    def _bound(self, level: int, teams: Tuple[TeamHandicaps, ...]) -> float:
+        """
+        A lower bound of the index of fairness of the completions of the assignment of the handicaps before level
+        """
+        if level == len(self._order):
+            return self.fairness(teams)
+        best = [self._team_distribution(team, size - len(team), level, True)
+                for team, size in zip(teams, self._team_sizes)]
+        worst = [self._team_distribution(team, size - len(team), level, False)
+                 for team, size in zip(teams, self._team_sizes)]
+        lower_head_to_head = beat_probabilities(worst, best)
+        np.fill_diagonal(lower_head_to_head, 0.5)
+        return self._fairness_evaluator.get_fairness_bound(win_probabilities_against(worst, best),
+                                                           win_probabilities_against(best, worst), lower_head_to_head)
+
+    def _team_distribution(self, team: TeamHandicaps, open_places: int = 0, level: int = None,
+                           best: bool = True) -> Distribution:
+        """
+        The distribution of the total score of a team, whose open places (if any) score as the best or the worst
+        envelope of the handicaps from the level-th one on
+        """
+        key = (team, open_places, level, best) if open_places else team
+        distribution = self._team_distributions.get(key)
+        if distribution is None:
+            envelopes = self._envelopes_of(level, best) if open_places else None
+            for hole, distributions in enumerate(self._hole_distributions):
+                members = tuple(distributions[handicap] for handicap in team)
+                if open_places:
+                    members += (envelopes[hole],) * open_places
+                hole_distribution = best_balls_distribution(members, self._number_of_best_balls)
+                distribution = hole_distribution if hole == 0 else convolve(distribution, hole_distribution)
+            self._team_distributions[key] = distribution
+        return distribution
+
+    def _envelopes_of(self, level: int, best: bool) -> Sequence[Distribution]:
+        # The envelope of the remaining handicaps on each hole
+        key = (level, best)
+        envelopes = self._envelopes.get(key)
+        if envelopes is None:
+            envelopes = self._envelopes[key] = [envelope([distributions[handicap]
+                                                          for handicap in self._order[level:]], best)
+                                                for distributions in self._hole_distributions]
+        return envelopes
+
+
+def _extremes_first(number_of_handicaps: int) -> Sequence[int]:
+    """
+    The indexes of the sorted handicaps, alternating the lowest and the highest remaining ones
+    """
+    order = list()
+    low, high = 0, number_of_handicaps - 1
+    while low <= high:
+        order.append(low)
+        if low < high:
+            order.append(high)
+        low, high = low + 1, high - 1
+    return order
@@ -0,0 +1,61 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from typing import Iterable, Sequence, Tuple
+
+from fairway.domain.team import Team
+
+
+class ResultCache(ABC):
+    """
+    Store of the results of simulated games, by key (see teams_key)
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    @abstractmethod
+    def get(self, key: str):
+        """
+        :param key:
+        :return: the cached result, or None
+        """
+        pass
+
+    @abstractmethod
+    def put(self, key: str, result):
+        pass
+
+
+class NoResultCache(ResultCache):
+    """
+    Caches nothing
+    """
+
+    def get(self, key: str):
+        return None
+
+    def put(self, key: str, result):
+        pass
+
+
+def teams_key(teams: Iterable[Team], number_of_best_balls: int, allowance_adjustment: float, number_of_holes: int,
+              game_format: str = 'best-ball', progress_interval: int = None) -> Tuple[str, Sequence[int]]:
+    """
+    Returns the canonical key of a team game, and the order of the teams in it. Results only depend on the handicaps
+    of the members of each team, so teams are identified by their sorted handicaps, and sorted
+    :param teams:
+    :param number_of_best_balls:
+    :param allowance_adjustment:
+    :param number_of_holes:
+    :param game_format:
+    :param progress_interval: the progress interval of progressive simulations, whose rounds depend on it
+    :return: the key, and the index of the team at each position of the canonical order
+    """
+    team_handicaps = [tuple(sorted(player.handicap for player in team.members)) for team in teams]
+    order = sorted(range(len(team_handicaps)), key=lambda index: team_handicaps[index])
+    canonical_form = {'teams': [team_handicaps[index] for index in order], 'best_balls': number_of_best_balls,
+                      'allowance': allowance_adjustment, 'holes': number_of_holes, 'format': game_format}
+    if progress_interval is not None:
+        canonical_form['progress_interval'] = progress_interval
+    return hashlib.sha256(json.dumps(canonical_form, sort_keys=True).encode()).hexdigest(), order
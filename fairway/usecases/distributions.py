@@ -1,6 +1,10 @@
 import numpy as np
 
 
+# Scores of a hole (allowances included), and of the best balls of a team on a hole
+SCORE_DTYPE = np.int8
+
+
 class ScoreDistributions(object):
     """
     Class representing score distributions on a par 4 hole.
@@ -25,14 +29,42 @@ class ScoreDistributions(object):
         n_handicaps, highest_score_idx = handicap_distributions.shape
         self._score_on_the_hole = tuple(i for i in range(1, highest_score_idx + 1))
         self._handicap_distributions = handicap_distributions
-        # Fix possible approximation errors (row probabilities need to sum up to 1)
-        for i in range(n_handicaps):
-            diff = 1 - np.sum(handicap_distributions[i, :])
-            if abs(diff) > 0:
-                for j in range(highest_score_idx-1, 0, -1):
-                    if handicap_distributions[i][j] > 0:
-                        handicap_distributions[i][j] += diff
-                        break
+        # Fix possible approximation errors (row probabilities need to sum up to 1): the error of each row is added
+        # to its highest possible score (the first score is never adjusted)
+        diffs = 1 - np.sum(handicap_distributions, axis=1)
+        possible = handicap_distributions[:, 1:] > 0
+        rows = np.flatnonzero((diffs != 0) & np.any(possible, axis=1))
+        highest_possible = highest_score_idx - 1 - np.argmax(possible[rows, ::-1], axis=1)
+        handicap_distributions[rows, highest_possible] += diffs[rows]
+        # Cumulative tables used by inverse-CDF sampling. The last column is forced to 1 so that rounding errors can
+        # never push a uniform draw past the end of the table
+        self._cumulative_distributions = np.cumsum(handicap_distributions, axis=1)
+        self._cumulative_distributions[:, -1] = 1.0
+
+    @classmethod
+    def from_tables(cls, handicap_distributions: np.ndarray,
+                    cumulative_distributions: np.ndarray) -> 'ScoreDistributions':
+        """
+        Create the distributions from tables built by a previous instance (see handicap_distributions and
+        cumulative_distributions), skipping the normalization
+        """
+        assert (handicap_distributions.shape == cumulative_distributions.shape)
+        score_distributions = cls.__new__(cls)
+        score_distributions._score_on_the_hole = tuple(range(1, handicap_distributions.shape[1] + 1))
+        score_distributions._handicap_distributions = handicap_distributions
+        score_distributions._cumulative_distributions = cumulative_distributions
+        return score_distributions
+
+    @property
+    def handicap_distributions(self) -> np.ndarray:
+        """
+        The normalized #handicaps x #scores distributions
+        """
+        return self._handicap_distributions
+
+    @property
+    def cumulative_distributions(self) -> np.ndarray:
+        return self._cumulative_distributions
 
     def get_distribution(self, handicap) -> np.ndarray:
         """
@@ -42,6 +74,51 @@ class ScoreDistributions(object):
         """
         return self._handicap_distributions[handicap, :]
 
+    def get_cumulative_distributions(self, handicaps) -> np.ndarray:
+        """
+        Return a 2-dimensional, #handicaps x #scores, array with the cumulative distributions of the given handicaps
+        :param handicaps:
+        :return:
+        """
+        return self._cumulative_distributions[np.asarray(handicaps, dtype=int), :]
+
+    def sample(self, handicaps, number_of_holes: int, number_of_scenarios: int,
+               random: np.random.Generator) -> np.ndarray:
+        """
+        Draw the scores of players with the given handicaps
+        :param handicaps:
+        :param number_of_holes:
+        :param number_of_scenarios:
+        :param random:
+        :return: a #scenarios x #players x #holes array of scores
+        """
+        return sample_scores(self.get_cumulative_distributions(handicaps), number_of_holes, number_of_scenarios,
+                             random)
+
     @property
     def score_on_the_hole(self):
         return self._score_on_the_hole
+
+
+def sample_scores(cumulative_distributions: np.ndarray, number_of_holes: int, number_of_scenarios: int,
+                  random: np.random.Generator) -> np.ndarray:
+    """
+    Returns a #scenarios x #players x #holes array of scores. Scores are drawn by inverting the cumulative
+    distribution of each player
+    :param cumulative_distributions: #players x #scores cumulative distributions
+    :param number_of_holes:
+    :param number_of_scenarios:
+    :param random:
+    :return:
+    """
+    n_players, _ = cumulative_distributions.shape
+    # The index of a score is the number of cumulative probabilities that the draw reaches. Draws always reach the
+    # scores that no player can make below the lowest possible one, and never the ones above the highest
+    impossible_below = np.all(cumulative_distributions <= 0, axis=0)
+    possible = np.flatnonzero(~impossible_below & np.any(cumulative_distributions < 1, axis=0))
+    draws = random.random((number_of_scenarios, n_players, number_of_holes))
+    s = np.full((number_of_scenarios, n_players, number_of_holes), 1 + np.count_nonzero(impossible_below),
+                dtype=SCORE_DTYPE)
+    for score_index in possible:
+        s += draws >= cumulative_distributions[np.newaxis, :, score_index, np.newaxis]
+    return s
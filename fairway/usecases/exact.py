@@ -0,0 +1,304 @@
+from functools import lru_cache, partial
+from itertools import combinations_with_replacement
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from fairway.usecases.bestball import GameWinsCounter, HoleWinsCounter, TeamScenarios
+from fairway.usecases.kernels import BestBallKernel
+from fairway.usecases.simulator import Simulator, SimulationTask
+
+
+# A discrete distribution over consecutive integer scores: probs[i] is the probability of scoring offset + i
+Distribution = Tuple[int, np.ndarray]
+
+
+class ExactResult(object):
+    """
+    Exact expected scores and probabilities of winning of the playing entities, and, for games, the probability that
+    each entity beats each other one
+    """
+
+    def __init__(self, expected_scores: np.ndarray, win_probabilities: np.ndarray, head_to_head: np.ndarray = None):
+        self._expected_scores = expected_scores
+        self._win_probabilities = win_probabilities
+        self._head_to_head = head_to_head
+
+    def __repr__(self):
+        return "{}: expected scores:{}, win probabilities:{}".format(
+            self.__class__.__name__, self._expected_scores, self._win_probabilities)
+
+    @property
+    def expected_scores(self) -> np.ndarray:
+        return self._expected_scores
+
+    @property
+    def win_probabilities(self) -> np.ndarray:
+        return self._win_probabilities
+
+    @property
+    def standard_errors(self) -> np.ndarray:
+        return np.zeros(len(self._win_probabilities))
+
+    @property
+    def head_to_head(self) -> Optional[np.ndarray]:
+        return self._head_to_head
+
+    def take(self, indexes: Sequence[int]) -> 'ExactResult':
+        """
+        Returns the result of the entities at the given indexes, in that order
+        """
+        indexes = np.asarray(indexes, dtype=int)
+        return ExactResult(self._expected_scores[indexes], self._win_probabilities[indexes],
+                           None if self._head_to_head is None else self._head_to_head[np.ix_(indexes, indexes)])
+
+    def save(self, file):
+        """
+        Write the result to a .npz file
+        :param file: a path, or a writable binary file
+        :return:
+        """
+        head_to_head = dict() if self._head_to_head is None else {'head_to_head': self._head_to_head}
+        np.savez(file, expected_scores=self._expected_scores, win_probabilities=self._win_probabilities,
+                 **head_to_head)
+
+    @classmethod
+    def load(cls, file) -> 'ExactResult':
+        """
+        Read a result written by save
+        :param file: a path, or a readable binary file
+        :return:
+        """
+        with np.load(file, allow_pickle=False) as data:
+            return cls(data['expected_scores'], data['win_probabilities'],
+                       data['head_to_head'] if 'head_to_head' in data.files else None)
+
+
+class ExactSimulator(Simulator):
+    """
+    Computes expected scores and probabilities of winning exactly, instead of sampling games. Players' hole scores are
+    independent, so the distribution of the best balls of a team on a hole follows from the order statistics of its
+    members, and the distribution of a total from the convolution of the holes. Ties are split exactly
+    """
+
+    def __init__(self):
+        super().__init__(0)
+
+    def simulate(self, task: SimulationTask) -> ExactResult:
+        hole_distributions = get_hole_distributions(task)
+        n_holes = len(hole_distributions)
+        n_entities = len(hole_distributions[0])
+        expected_scores = np.array([sum(mean(hole_distributions[hole][entity]) for hole in range(n_holes))
+                                    for entity in range(n_entities)])
+
+        # Counters of team games are bound to their kernel, which is checked along with the reduction
+        counter = task.counter.func if isinstance(task.counter, partial) else task.counter
+        head_to_head = None
+        if issubclass(counter, HoleWinsCounter):
+            win_probabilities = np.mean([win_probabilities_of(distributions) for distributions in hole_distributions],
+                                        axis=0)
+        elif issubclass(counter, GameWinsCounter):
+            totals = [hole_distributions[0][entity] for entity in range(n_entities)]
+            for hole in range(1, n_holes):
+                totals = [convolve(total, hole_distributions[hole][entity]) for entity, total in enumerate(totals)]
+            win_probabilities = win_probabilities_of(totals)
+            head_to_head = head_to_head_of(totals)
+        else:
+            raise ValueError("Exact evaluation does not support {}".format(counter.__name__))
+        return ExactResult(expected_scores, win_probabilities, head_to_head)
+
+    def reset(self):
+        pass
+
+
+def get_hole_distributions(task: SimulationTask) -> Sequence[Sequence[Distribution]]:
+    """
+    Returns the score distribution of each playing entity for each hole (#holes x #entities)
+    :param task:
+    :return:
+    """
+    probabilities = np.diff(task.cumulative_distributions, axis=1, prepend=0.0)
+    allowances = np.rint(task.allowances).astype(int)
+    n_players, n_holes = allowances.shape
+    # Scores on the hole start from 1
+    player_distributions = [[trim(1 + allowances[player, hole], probabilities[player]) for player in range(n_players)]
+                            for hole in range(n_holes)]
+    if task.reduce is None:
+        return player_distributions
+    if isinstance(task.reduce, TeamScenarios) and isinstance(task.reduce.kernel, BestBallKernel):
+        membership = task.reduce.membership
+        return [[best_balls_distribution(tuple(distributions[player] for player in membership[team, :team_size]),
+                                         task.reduce.kernel.number_of_best_balls)
+                 for team, team_size in enumerate(task.reduce.team_sizes)]
+                for distributions in player_distributions]
+    raise ValueError("Exact evaluation does not support {}".format(getattr(task.reduce, 'kernel', task.reduce)))
+
+
+def best_balls_distribution(distributions: Sequence[Distribution], number_of_best_balls: int) -> Distribution:
+    """
+    Returns the distribution of the sum of the number_of_best_balls lowest scores (all of them, for fewer scores)
+    :param distributions: the score distribution of each member of the team
+    :param number_of_best_balls:
+    :return:
+    """
+    # Teams with the same distributions (in any order) share the result
+    key = tuple(sorted((offset, probs.tobytes()) for offset, probs in distributions))
+    return _best_balls_distribution(key, number_of_best_balls)
+
+
+@lru_cache(maxsize=4096)
+def _best_balls_distribution(key, number_of_best_balls: int) -> Distribution:
+    distributions = [(offset, np.frombuffer(probs)) for offset, probs in key]
+    low = min(offset for offset, _ in distributions)
+    high = max(offset + len(probs) - 1 for offset, probs in distributions)
+    number_of_balls = min(number_of_best_balls, len(distributions))
+    transitions, sums = _best_balls_states(high - low + 1, number_of_balls)
+
+    # Add one member at a time, keeping track of the distribution of its lowest scores
+    states = np.zeros(len(sums))
+    states[0] = 1.0     # No scores yet
+    for offset, probs in distributions:
+        next_states = np.zeros(len(sums))
+        for score_index, prob in enumerate(probs, start=offset - low):
+            if prob > 0:
+                next_states += np.bincount(transitions[:, score_index], weights=states * prob, minlength=len(sums))
+        states = next_states
+
+    return trim(low * number_of_balls, np.bincount(sums, weights=states))
+
+
+@lru_cache(maxsize=64)
+def _best_balls_states(number_of_scores: int, number_of_balls: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Enumerates the sorted tuples of up to number_of_balls scores (from 0 to number_of_scores-1)
+    :return: the state reached from each state by adding each score, and the sum of the scores of each state
+    """
+    states = [state for length in range(number_of_balls + 1)
+              for state in combinations_with_replacement(range(number_of_scores), length)]
+    state_index = {state: index for index, state in enumerate(states)}
+    transitions = np.array([[state_index[tuple(sorted(state + (score,))[:number_of_balls])]
+                             for score in range(number_of_scores)] for state in states], dtype=int)
+    sums = np.array([sum(state) for state in states], dtype=int)
+    return transitions, sums
+
+
+def win_probabilities_of(distributions: Sequence[Distribution]) -> np.ndarray:
+    """
+    Returns the probability of winning (having the lowest score) of each of the independent entities whose score
+    distributions are given. Ties among k entities count as 1/k of a win for each of them
+    :param distributions:
+    :return:
+    """
+    return win_probabilities_against(distributions, distributions)
+
+
+def win_probabilities_against(distributions: Sequence[Distribution],
+                              opponent_distributions: Sequence[Distribution]) -> np.ndarray:
+    """
+    Returns the probability of winning of each entity, scoring as distributions[i], against the other entities,
+    scoring as opponent_distributions[j] for every j != i. All the scores are independent. Given the same
+    distributions, these are the probabilities of winning of the entities (see win_probabilities_of); given their
+    best and their worst possible distributions, these bound them (see BranchAndBoundSwapper)
+    :param distributions:
+    :param opponent_distributions:
+    :return:
+    """
+    assert (len(distributions) == len(opponent_distributions))
+    n_entities = len(distributions)
+    _, equal, opponent_equal = _align(distributions, opponent_distributions)
+    greater = np.clip(1.0 - np.cumsum(opponent_equal, axis=1), 0.0, 1.0)
+
+    # The share of a win when the k other entities tie is 1/(k+1) = integral of t^k over [0, 1]. Hence the expected
+    # share is the integral of prod_j (P(T_j > s) + t P(T_j = s)), a polynomial of degree #entities-1 that
+    # Gauss-Legendre quadrature integrates exactly
+    nodes, weights = _quadrature(n_entities // 2 + 1)
+    factors = greater[np.newaxis, :, :] + nodes[:, np.newaxis, np.newaxis] * opponent_equal[np.newaxis, :, :]
+    # Products over all the other entities: exclusive prefix products times exclusive suffix products
+    ones = np.ones_like(factors[:, :1, :])
+    prefix = np.cumprod(np.concatenate((ones, factors[:, :-1, :]), axis=1), axis=1)
+    suffix = np.cumprod(np.concatenate((ones, factors[:, :0:-1, :]), axis=1), axis=1)[:, ::-1, :]
+    shares = np.tensordot(weights, prefix * suffix, axes=1)
+    return np.sum(equal * shares, axis=1)
+
+
+@lru_cache(maxsize=64)
+def _quadrature(number_of_nodes: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Gauss-Legendre nodes and weights over [0, 1]
+    nodes, weights = np.polynomial.legendre.leggauss(number_of_nodes)
+    return (nodes + 1) / 2, weights / 2
+
+
+def head_to_head_of(distributions: Sequence[Distribution]) -> np.ndarray:
+    """
+    Returns the probability that each of the independent entities whose score distributions are given beats each
+    other one (ties count as half a win)
+    :param distributions:
+    :return: an #entities x #entities array
+    """
+    head_to_head = beat_probabilities(distributions, distributions)
+    np.fill_diagonal(head_to_head, 0.5)
+    return head_to_head
+
+
+def beat_probabilities(distributions: Sequence[Distribution],
+                       opponent_distributions: Sequence[Distribution]) -> np.ndarray:
+    """
+    Returns the probability that each entity beats (scores lower than) each opponent, all the scores being
+    independent. Ties count as half a win
+    :param distributions:
+    :param opponent_distributions:
+    :return: an #entities x #opponents array
+    """
+    _, equal, opponent_equal = _align(distributions, opponent_distributions)
+    greater = np.clip(1.0 - np.cumsum(opponent_equal, axis=1), 0.0, 1.0)
+    return equal @ (greater + 0.5 * opponent_equal).T
+
+
+def envelope(distributions: Sequence[Distribution], lowest: bool = True) -> Distribution:
+    """
+    Returns the distribution whose cumulative probabilities are the highest (or the lowest) ones of the given
+    distributions at every score: its scores are stochastically lower (higher) than, or as low as, each of theirs
+    :param distributions:
+    :param lowest:
+    :return:
+    """
+    low, equal = _align(distributions)
+    cumulative = np.cumsum(equal, axis=1)
+    cumulative = np.max(cumulative, axis=0) if lowest else np.min(cumulative, axis=0)
+    return trim(low, np.diff(cumulative, prepend=0.0))
+
+
+def _align(*distributions: Sequence[Distribution]) -> Tuple[int, ...]:
+    """
+    Lays the probabilities of each sequence of distributions over the same scores
+    :return: the lowest score, and an #entities x #scores array for each sequence
+    """
+    low = min(offset for sequence in distributions for offset, _ in sequence)
+    high = max(offset + len(probs) - 1 for sequence in distributions for offset, probs in sequence)
+    aligned = list()
+    for sequence in distributions:
+        equal = np.zeros((len(sequence), high - low + 1))
+        for entity, (offset, probs) in enumerate(sequence):
+            equal[entity, offset - low:offset - low + len(probs)] = probs
+        aligned.append(equal)
+    return (low, *aligned)
+
+
+def convolve(distribution_0: Distribution, distribution_1: Distribution) -> Distribution:
+    """
+    Returns the distribution of the sum of two independent scores
+    """
+    return distribution_0[0] + distribution_1[0], np.convolve(distribution_0[1], distribution_1[1])
+
+
+def mean(distribution: Distribution) -> float:
+    offset, probs = distribution
+    return float(np.dot(np.arange(offset, offset + len(probs)), probs))
+
+
+def trim(offset: int, probs: np.ndarray) -> Distribution:
+    """
+    Drops the impossible scores at the extremes of a distribution
+    """
+    possible = np.flatnonzero(probs > 0)
+    return offset + possible[0], np.array(probs[possible[0]:possible[-1] + 1], dtype=np.float64)
@@ -1,32 +1,62 @@
 from abc import ABC, abstractmethod
 from typing import Iterable
 
+import numpy as np
+
 from fairway.domain.team import Team
 
 
 class FairnessEvaluator(ABC):
 
+    # Whether the evaluator needs the head-to-head matrix of the teams (see PartialResult.head_to_head)
+    uses_head_to_head = False
+
     def __init__(self):
         super().__init__()
 
     @abstractmethod
-    def get_fairness(self, teams: Iterable[Team]) -> float:
+    def get_fairness(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> float:
         """
 
         :param teams:
+        :param head_to_head: the probability that each team beats each other one (#teams x #teams), if known
         :return: and index of fairness: the smaller the fairer (yeah, I know...)
         """
         pass
 
+    @abstractmethod
+    def get_fairness_of_probabilities(self, win_probabilities: np.ndarray,
+                                      head_to_head: np.ndarray = None) -> np.ndarray:
+        """
+        Vectorized get_fairness over the probabilities of winning of the teams
+        :param win_probabilities: a (... x #teams) array
+        :param head_to_head: a (... x #teams x #teams) array, if known
+        :return: the index of fairness of each set of teams (...)
+        """
+        pass
+
     @property
     @abstractmethod
     def tolerance(self) -> float:
         pass
 
     @abstractmethod
-    def is_fair_enough(self,teams: Iterable[Team]) -> bool:
+    def is_fair_enough(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> bool:
         pass
 
+    def get_fairness_bound(self, lower_win_probabilities: np.ndarray, upper_win_probabilities: np.ndarray,
+                           lower_head_to_head: np.ndarray) -> float:
+        """
+        Returns a lower bound of the index of fairness of any teams whose probabilities of winning, and whose
+        head-to-head matrix, are within the given bounds (see BranchAndBoundSwapper). Evaluators that cannot bound
+        their index return 0
+        :param lower_win_probabilities: (#teams)
+        :param upper_win_probabilities: (#teams)
+        :param lower_head_to_head: (#teams x #teams) the lowest probability that each team beats each other one
+        :return:
+        """
+        return 0.0
+
 
 class MaxDifference(FairnessEvaluator):
 
@@ -34,13 +64,133 @@ class MaxDifference(FairnessEvaluator):
         super().__init__()
         self._tolerance = tolerance
 
-    def get_fairness(self, teams: Iterable[Team]) -> float:
+    def get_fairness(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> float:
         sorted_teams = sorted(teams)
         return sorted_teams[-1].prob_of_winning - sorted_teams[0].prob_of_winning
 
+    def get_fairness_of_probabilities(self, win_probabilities: np.ndarray,
+                                      head_to_head: np.ndarray = None) -> np.ndarray:
+        return np.max(win_probabilities, axis=-1) - np.min(win_probabilities, axis=-1)
+
     @property
     def tolerance(self) -> float:
         return self._tolerance
 
-    def is_fair_enough(self, teams: Iterable[Team]) -> bool:
-        self.get_fairness(teams) < self.tolerance
+    def is_fair_enough(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> bool:
+        return self.get_fairness(teams) < self.tolerance
+
+    def get_fairness_bound(self, lower_win_probabilities: np.ndarray, upper_win_probabilities: np.ndarray,
+                           lower_head_to_head: np.ndarray) -> float:
+        return float(self.get_fairness_of_probabilities(most_even_probabilities(lower_win_probabilities,
+                                                                                upper_win_probabilities)))
+
+
+class ProbabilitiesFairnessEvaluator(FairnessEvaluator, ABC):
+    """
+    Evaluators whose index of fairness is computed, vectorized, from the probabilities of winning of all the teams
+    (and their head-to-head matrix). Unless they override get_fairness_bound, their index must be a convex and
+    symmetric function of the probabilities of winning: the most even probabilities within bounds have the lowest one
+    """
+
+    def __init__(self, tolerance: float):
+        super().__init__()
+        self._tolerance = tolerance
+
+    def get_fairness(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> float:
+        win_probabilities = np.array([team.prob_of_winning for team in teams])
+        return float(self.get_fairness_of_probabilities(win_probabilities, head_to_head))
+
+    @property
+    def tolerance(self) -> float:
+        return self._tolerance
+
+    def is_fair_enough(self, teams: Iterable[Team], head_to_head: np.ndarray = None) -> bool:
+        return self.get_fairness(teams, head_to_head) < self.tolerance
+
+    def get_fairness_bound(self, lower_win_probabilities: np.ndarray, upper_win_probabilities: np.ndarray,
+                           lower_head_to_head: np.ndarray) -> float:
+        return float(self.get_fairness_of_probabilities(most_even_probabilities(lower_win_probabilities,
+                                                                                upper_win_probabilities)))
+
+
+class Variance(ProbabilitiesFairnessEvaluator):
+    """
+    The variance of the probabilities of winning of the teams: unlike the max difference, every team counts
+    """
+
+    def __init__(self, tolerance: float = 0.0025):
+        super().__init__(tolerance)
+
+    def get_fairness_of_probabilities(self, win_probabilities: np.ndarray,
+                                      head_to_head: np.ndarray = None) -> np.ndarray:
+        return np.var(win_probabilities, axis=-1)
+
+
+class Gini(ProbabilitiesFairnessEvaluator):
+    """
+    The Gini coefficient of the probabilities of winning of the teams: the mean absolute difference of the
+    probabilities of every pair of teams, relative to twice their mean. 0 when all the teams are equally likely to win,
+    1 - 1/#teams when a single team always wins
+    """
+
+    def __init__(self, tolerance: float = 0.1):
+        super().__init__(tolerance)
+
+    def get_fairness_of_probabilities(self, win_probabilities: np.ndarray,
+                                      head_to_head: np.ndarray = None) -> np.ndarray:
+        differences = np.abs(win_probabilities[..., :, np.newaxis] - win_probabilities[..., np.newaxis, :])
+        n_teams = win_probabilities.shape[-1]
+        return np.sum(differences, axis=(-2, -1)) / (2 * n_teams * np.sum(win_probabilities, axis=-1))
+
+
+class WorstPairwise(ProbabilitiesFairnessEvaluator):
+    """
+    The worst imbalance of the head-to-head matrix: the highest difference between the probability that a team beats
+    another one and the probability that it is beaten by it. For two teams, it is the max difference. Without a
+    head-to-head matrix (e.g. for results cached before it was counted), the probability that a team beats another one
+    is estimated from their probabilities of winning, as p_i / (p_i + p_j)
+    """
+
+    uses_head_to_head = True
+
+    def __init__(self, tolerance: float = 0.2):
+        super().__init__(tolerance)
+
+    def get_fairness_of_probabilities(self, win_probabilities: np.ndarray,
+                                      head_to_head: np.ndarray = None) -> np.ndarray:
+        if head_to_head is None:
+            pair_probabilities = win_probabilities[..., :, np.newaxis] + win_probabilities[..., np.newaxis, :]
+            head_to_head = np.divide(win_probabilities[..., :, np.newaxis], pair_probabilities,
+                                     out=np.full_like(pair_probabilities, 0.5), where=pair_probabilities > 0)
+        return np.max(head_to_head - np.swapaxes(head_to_head, -2, -1), axis=(-2, -1))
+
+    def get_fairness_bound(self, lower_win_probabilities: np.ndarray, upper_win_probabilities: np.ndarray,
+                           lower_head_to_head: np.ndarray) -> float:
+        # A team beats another one with probability h, and is beaten with probability 1 - h
+        return max(float(np.max(2 * lower_head_to_head - 1)), 0.0)
+
+
+def most_even_probabilities(lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """
+    Returns the probabilities, within the given bounds and summing to 1, that are majorized by any other such ones:
+    clip(t, lower, upper), for the t that makes them sum to 1. Convex and symmetric indexes of fairness are the lowest
+    for them
+    :param lower:
+    :param upper:
+    :return:
+    """
+    lower = np.minimum(lower, upper)
+    # The sum of clip(t, lower, upper) is piecewise linear in t, with a breakpoint at each bound
+    breakpoints = np.sort(np.concatenate((lower, upper)))
+    sums = np.sum(np.clip(breakpoints[:, np.newaxis], lower, upper), axis=1)
+    index = int(np.searchsorted(sums, 1.0))
+    if index == 0 or index == len(sums):
+        # The bounds do not (numerically) allow for probabilities summing to 1
+        return np.clip(breakpoints[min(index, len(sums) - 1)], lower, upper)
+    t0, t1 = breakpoints[index - 1], breakpoints[index]
+    s0, s1 = sums[index - 1], sums[index]
+    return np.clip(t1 if s1 == s0 else t0 + (1.0 - s0) * (t1 - t0) / (s1 - s0), lower, upper)
+
+
+FAIRNESS_EVALUATORS = {'max-difference': MaxDifference, 'variance': Variance, 'gini': Gini,
+                       'worst-pairwise': WorstPairwise}
@@ -0,0 +1,164 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from fairway.usecases.bestball import team_membership_index
+from fairway.usecases.kernels import ScoringKernel, pairwise_wins
+from fairway.usecases.results import PartialResult
+
+
+class IncrementalEvaluator(object):
+    """
+    Re-evaluates a team game after swapping players between teams. The total scores of every team in every scenario
+    are kept, so a swap only recomputes the totals of the two affected teams and the split of the wins. Teams are
+    scored by a separable kernel (see ScoringKernel.separable)
+    """
+
+    def __init__(self, players_scenarios: np.ndarray, teams: Sequence[Sequence[int]], kernel: ScoringKernel,
+                 memory_budget: int = None):
+        """
+        :param players_scenarios: a #scenarios x #players x #holes array of player scores (allowances included)
+        :param teams: an enumerable containing the indexes of the players of each team
+        :param kernel:
+        :param memory_budget: if given, bounds the bytes of the totals of the candidate swaps evaluated at once
+        """
+        assert kernel.separable, "{} does not score teams independently".format(kernel)
+        self._players_scenarios = players_scenarios
+        self._kernel = kernel
+        self._memory_budget = memory_budget
+        self._membership, self._team_sizes = team_membership_index(teams)
+        self._team_of_player = dict()
+        for team_index, player_indexes in enumerate(teams):
+            for position, player_index in enumerate(player_indexes):
+                self._team_of_player[player_index] = (team_index, position)
+        # #scenarios x #teams
+        self._team_totals = self._totals_of(self._membership, self._team_sizes)
+        self._last_swap = None
+
+    def _totals_of(self, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        """
+        The total scores of the given teams in every scenario (#scenarios x #teams)
+        """
+        return self._kernel.game_scores(self._kernel.hole_scores(self._players_scenarios, membership, team_sizes))
+
+    @property
+    def number_of_scenarios(self) -> int:
+        return len(self._team_totals)
+
+    def team_of(self, player_index: int) -> int:
+        team_index, _ = self._team_of_player[player_index]
+        return team_index
+
+    def swap(self, player_index_0: int, player_index_1: int):
+        """
+        Move each player to the team of the other one
+        :param player_index_0:
+        :param player_index_1:
+        :return:
+        """
+        team_0, position_0 = self._team_of_player[player_index_0]
+        team_1, position_1 = self._team_of_player[player_index_1]
+        assert (team_0 != team_1), "Players {} and {} are in the same team".format(player_index_0, player_index_1)
+        self._membership[team_0, position_0] = player_index_1
+        self._membership[team_1, position_1] = player_index_0
+        self._team_of_player[player_index_0] = (team_1, position_1)
+        self._team_of_player[player_index_1] = (team_0, position_0)
+
+        affected_teams = [team_0, team_1]
+        self._last_swap = (player_index_0, player_index_1, self._team_totals[:, affected_teams])
+        self._team_totals[:, affected_teams] = self._totals_of(self._membership[affected_teams],
+                                                               self._team_sizes[affected_teams])
+
+    def swaps_win_probabilities(self, swaps: Sequence[Tuple[int, int]], batch_size: int = 64) -> np.ndarray:
+        """
+        Evaluate many candidate swaps at once, without applying any of them (see evaluate_swaps)
+        :return: a #swaps x #teams array with the probabilities of winning of the teams after each swap
+        """
+        win_probabilities, _ = self.evaluate_swaps(swaps, batch_size)
+        return win_probabilities
+
+    def evaluate_swaps(self, swaps: Sequence[Tuple[int, int]], batch_size: int = 64,
+                       head_to_head: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Evaluate many candidate swaps at once, without applying any of them. The two affected teams of every
+        candidate are re-played in one stacked pass over the scenarios, in batches of batch_size candidates. Only the
+        rows and the columns of the affected teams of the head-to-head matrix change, so only they are re-counted
+        :param swaps: pairs of indexes of players in different teams
+        :param batch_size: the number of candidates stacked in each pass (at most, given a memory budget, as many as
+        fit in it)
+        :param head_to_head: evaluate the head-to-head matrix of the teams after each swap too
+        :return: a #swaps x #teams array with the probabilities of winning of the teams after each swap, and, if
+        requested, a #swaps x #teams x #teams array with the probabilities that each team beats each other one
+        """
+        n_teams = len(self._team_sizes)
+        if self._memory_budget is not None:
+            # The totals of a candidate, the wins split from them, and the comparisons of the affected teams
+            candidate_bytes = self._team_totals.size * (self._team_totals.itemsize + 2 * np.dtype(float).itemsize +
+                                                        (4 if head_to_head else 0))
+            batch_size = max(1, min(batch_size, self._memory_budget // candidate_bytes))
+        win_probabilities = np.empty((len(swaps), n_teams))
+        head_to_heads = None
+        if head_to_head:
+            head_to_heads = np.empty((len(swaps), n_teams, n_teams))
+            current_wins = pairwise_wins(self._team_totals, self._team_totals, self._kernel.higher_wins)
+        for start in range(0, len(swaps), batch_size):
+            batch = swaps[start:start + batch_size]
+            # The memberships of the affected teams of each candidate: #candidates x 2 x max team size
+            teams = np.empty((len(batch), 2), dtype=int)
+            membership = np.empty((len(batch), 2, self._membership.shape[1]), dtype=int)
+            for index, (player_index_0, player_index_1) in enumerate(batch):
+                team_0, position_0 = self._team_of_player[player_index_0]
+                team_1, position_1 = self._team_of_player[player_index_1]
+                assert (team_0 != team_1), "Players {} and {} are in the same team".format(player_index_0,
+                                                                                            player_index_1)
+                teams[index] = team_0, team_1
+                membership[index] = self._membership[[team_0, team_1]]
+                membership[index, 0, position_0] = player_index_1
+                membership[index, 1, position_1] = player_index_0
+            # #scenarios x (#candidates * 2)
+            swapped_totals = self._totals_of(membership.reshape(2 * len(batch), -1), self._team_sizes[teams.ravel()])
+            # #candidates x #scenarios x #teams
+            totals = np.repeat(self._team_totals[np.newaxis, :, :], len(batch), axis=0)
+            candidates = np.arange(len(batch))[:, np.newaxis]
+            totals[candidates, :, teams] = swapped_totals.T.reshape(len(batch), 2, -1)
+            wins = np.sum(self._kernel.win_shares(totals, axis=2), axis=1)
+            win_probabilities[start:start + len(batch)] = wins / self.number_of_scenarios
+            if head_to_head:
+                # #candidates x 2 x #teams: the wins of the affected teams against every team
+                affected_wins = pairwise_wins(totals[candidates, :, teams].transpose(0, 2, 1), totals,
+                                              self._kernel.higher_wins)
+                batch_wins = np.repeat(current_wins[np.newaxis, :, :], len(batch), axis=0)
+                for affected in range(2):
+                    batch_wins[candidates[:, 0], teams[:, affected], :] = affected_wins[:, affected, :]
+                    batch_wins[candidates[:, 0], :, teams[:, affected]] = self.number_of_scenarios - \
+                        affected_wins[:, affected, :]
+                head_to_heads[start:start + len(batch)] = batch_wins / self.number_of_scenarios
+        return win_probabilities, head_to_heads
+
+    def undo(self):
+        """
+        Revert the last swap
+        :return:
+        """
+        assert (self._last_swap is not None), "There is no swap to undo"
+        player_index_0, player_index_1, previous_totals = self._last_swap
+        team_1, position_1 = self._team_of_player[player_index_0]
+        team_0, position_0 = self._team_of_player[player_index_1]
+        self._membership[team_0, position_0] = player_index_0
+        self._membership[team_1, position_1] = player_index_1
+        self._team_of_player[player_index_0] = (team_0, position_0)
+        self._team_of_player[player_index_1] = (team_1, position_1)
+        self._team_totals[:, [team_0, team_1]] = previous_totals
+        self._last_swap = None
+
+    def result(self, head_to_head: bool = True) -> PartialResult:
+        """
+        The results of the game with the current teams
+        :param head_to_head: count the head-to-head wins of the teams too
+        :return:
+        """
+        win_shares = self._kernel.win_shares(self._team_totals, axis=1)
+        head_to_head_wins = pairwise_wins(self._team_totals, self._team_totals, self._kernel.higher_wins) \
+            if head_to_head else None
+        return PartialResult(self.number_of_scenarios, np.sum(self._team_totals, axis=0, dtype=np.int64),
+                             np.sum(win_shares, axis=0), np.sum(np.square(win_shares), axis=0), head_to_head_wins)
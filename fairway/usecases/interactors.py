@@ -1,58 +1,173 @@
 import logging
 from collections import defaultdict
 from sys import float_info
-from typing import Iterable
+from typing import Iterable, Iterator, Sequence, Tuple
 
 import inject
 
+import numpy as np
+
 from fairway.domain.player import Player
 from fairway.domain.tournament import Tournament
 from fairway.usecases.assignment import ABCDByHandicap, ABCDByWinProbability, ZigZagByHandicap, \
     ZigZagByWinProbability, WeakestFirstByHandicap, WeakestFirstByWinProbability
 from fairway.usecases.bestball import BestBallGame
+from fairway.usecases.cache import ResultCache, teams_key
 from fairway.usecases.fairness import FairnessEvaluator
+from fairway.usecases.kernels import create_kernel
+from fairway.usecases.results import PartialResult, ShardInfo, check_shards
+from fairway.usecases.simulator import Simulator
 from fairway.usecases.swaps import Swapper
+from fairway.util import profiling
 
 
-def estimate_teams_fairness(players: Iterable[Player], number_of_best_balls: int, allowance_adjustment: float) -> Tournament:
+def estimate_teams_fairness(players: Iterable[Player], number_of_best_balls: int, allowance_adjustment: float,
+                            game_format: str = 'best-ball') -> Tournament:
     """
     Simulate a game where players play in teams
     :param players:
     :param number_of_best_balls:
     :param allowance_adjustment:
+    :param game_format: the scoring of the teams (see KERNELS)
+    :return:
+    """
+    tournament = _create_tournament_from_assigned_players(players, number_of_best_balls, allowance_adjustment,
+                                                          game_format)
+    result_cache, key, order = _get_cache_key(tournament)
+    if _apply_cached_result(tournament, result_cache, key, order):
+        return tournament
+
+    # Play game
+    tournament.game.play_team_game(tournament.players, tournament.teams)
+    result_cache.put(key, tournament.game.last_result.take(order))
+
+    return tournament
+
+
+def estimate_teams_fairness_progressively(players: Iterable[Player], number_of_best_balls: int,
+                                          allowance_adjustment: float, progress_interval: int,
+                                          game_format: str = 'best-ball') -> Iterator[Tuple[Tournament, PartialResult]]:
+    """
+    Simulate a game where players play in teams, like estimate_teams_fairness, and yield the tournament and the
+    running results every progress_interval iterations. The teams of the tournament hold the last yielded results, so
+    the estimate can be stopped at any time. Only complete estimates are cached
+    :param players:
+    :param number_of_best_balls:
+    :param allowance_adjustment:
+    :param progress_interval:
+    :param game_format: the scoring of the teams (see KERNELS)
     :return:
     """
+    tournament = _create_tournament_from_assigned_players(players, number_of_best_balls, allowance_adjustment,
+                                                          game_format)
+    # The games played depend on the progress interval, so it is part of the key
+    result_cache, key, order = _get_cache_key(tournament, progress_interval)
+    if _apply_cached_result(tournament, result_cache, key, order):
+        yield tournament, tournament.game.last_result
+        return
+
+    # Play game
+    result = None
+    for result in tournament.game.play_team_game_progressively(tournament.players, tournament.teams,
+                                                               progress_interval):
+        yield tournament, result
+    result_cache.put(key, result.take(order))
+
+
+def _get_cache_key(tournament: Tournament, progress_interval: int = None):
+    # Teams with the same handicaps may have been played before, in another order
+    result_cache = inject.instance(ResultCache)
+    key, order = _teams_key(tournament, progress_interval)
+    return result_cache, key, order
+
+
+def _teams_key(tournament: Tournament, progress_interval: int = None):
+    return teams_key(tournament.teams, tournament.game.number_of_best_balls, tournament.allowance_adjustment,
+                     tournament.game.number_of_holes, tournament.game.kernel.name, progress_interval)
+
+
+def _apply_cached_result(tournament: Tournament, result_cache: ResultCache, key: str, order) -> bool:
+    result = result_cache.get(key)
+    if result is None:
+        return False
+    tournament.game.apply_result(tournament.teams, result.take(np.argsort(order)))
+    return True
+
+
+def save_partial_result(tournament: Tournament, file):
+    """
+    Save the result of the last simulation of the teams of the tournament, with the shards of the simulation that it
+    covers (see merge_teams_fairness). Teams are saved in their canonical order (see teams_key)
+    :param tournament:
+    :param file:
+    :return:
+    """
+    simulator = inject.instance(Simulator)
+    key, order = _teams_key(tournament)
+    shard_info = ShardInfo(simulator.seed, simulator.number_of_iterations, simulator.number_of_shards,
+                           tuple(simulator.shard_indexes), key)
+    tournament.game.last_result.take(order).save(file, shard_info)
+
+
+def merge_teams_fairness(players: Iterable[Player], number_of_best_balls: int, allowance_adjustment: float,
+                         partial_results: Sequence[Tuple[PartialResult, ShardInfo]],
+                         game_format: str = 'best-ball') -> Tournament:
+    """
+    Combine the partial results of the shards of a simulation (see save_partial_result) of the given teams
+    :param players:
+    :param number_of_best_balls:
+    :param allowance_adjustment:
+    :param partial_results: the partial results, and their shard info
+    :param game_format: the scoring of the teams (see KERNELS)
+    :return:
+    :raise ValueError: if the results are not all the shards of a simulation of the teams (see check_shards)
+    """
+    tournament = _create_tournament_from_assigned_players(players, number_of_best_balls, allowance_adjustment,
+                                                          game_format)
+    key, order = _teams_key(tournament)
+    check_shards([shard_info for _, shard_info in partial_results], key)
+    merged_result = PartialResult.merge_all(result for result, _ in partial_results)
+    tournament.game.apply_result(tournament.teams, merged_result.take(np.argsort(order)))
+
+    return tournament
+
+
+def _create_tournament_from_assigned_players(players: Iterable[Player], number_of_best_balls: int,
+                                             allowance_adjustment: float, game_format: str) -> Tournament:
     # Group players by team
     players_by_team = defaultdict(list)
     for player in players:
         players_by_team[player.team_id].append(player)
 
     # Create tournament
-    game = BestBallGame(number_of_best_balls=number_of_best_balls)
+    game = _create_game(number_of_best_balls, game_format)
     tournament = Tournament(game, players, len(players_by_team), allowance_adjustment)
     for team, team_members in zip(tournament.teams, players_by_team.values()):
         team.add_players(team_members)
 
-    # Play game
-    game.play_team_game(tournament.players, tournament.teams)
-
     return tournament
 
 
-def create_teams(players: Iterable[Player], number_of_teams: int, number_of_best_balls: int, allowance_adjustment: float, optimize: bool) -> Tournament:
+def _create_game(number_of_best_balls: int, game_format: str) -> BestBallGame:
+    return BestBallGame(number_of_best_balls=number_of_best_balls,
+                        kernel=create_kernel(game_format, number_of_best_balls))
+
+
+def create_teams(players: Iterable[Player], number_of_teams: int, number_of_best_balls: int,
+                 allowance_adjustment: float, optimize: bool, game_format: str = 'best-ball') -> Tournament:
 
     for player in players:
         assert (player.team_id is None)
 
     fairness_evaluator = inject.instance(FairnessEvaluator)
-    game = BestBallGame(number_of_best_balls=number_of_best_balls)
+    game = _create_game(number_of_best_balls, game_format)
     tournament = Tournament(game, players, number_of_teams, allowance_adjustment)
 
     # Play individual game
     game.play_individual_game(players)
 
     for player in players:
-        print(player)
+        logging.debug(player)
 
     # Assign players to teams
     assignment_strategies = [
@@ -65,10 +180,11 @@ def create_teams(players: Iterable[Player], number_of_teams: int, number_of_best
     fairest_tournament = None
     fairness = float_info.max
     for strategy in assignment_strategies:
-        tournament = Tournament(game, players, number_of_teams, allowance_adjustment)
-        strategy.assign_players_to_teams(players, tournament.teams)
-        tournament = estimate_teams_fairness(players, number_of_best_balls, allowance_adjustment)
-        current_fairness = fairness_evaluator.get_fairness(tournament.teams)
+        with profiling.stage('assignment/' + strategy.__class__.__name__):
+            tournament = Tournament(game, players, number_of_teams, allowance_adjustment)
+            strategy.assign_players_to_teams(players, tournament.teams)
+            tournament = estimate_teams_fairness(players, number_of_best_balls, allowance_adjustment, game_format)
+        current_fairness = fairness_evaluator.get_fairness(tournament.teams, tournament.game.last_result.head_to_head)
         logging.debug("Strategy: {} Fairness: {}\tTeams: {}".
                       format(strategy.__class__.__name__, current_fairness, tournament.teams))
         if current_fairness < fairness:
@@ -86,5 +202,5 @@ def create_teams(players: Iterable[Player], number_of_teams: int, number_of_best
         swapper = inject.instance(Swapper)
         swapper.adjust_teams(fairest_tournament)
 
-    return tournament
+    return fairest_tournament
 
@@ -0,0 +1,256 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+
+
+# Total scores of an entity in a scenario
+TOTAL_DTYPE = np.int16
+
+# The par of the holes of the score distributions (see ScoreDistributions)
+PAR = 4
+
+
+class ScoringKernel(ABC):
+    """
+    Vectorized scoring of a team game format. A kernel reduces batches of player scenarios to the scores of the teams
+    on each hole, then to the score of each team in each scenario, and splits the win of each scenario among the
+    teams. Every format shares the sampling, the accumulation of the results and the parallel simulation.
+    Unless a kernel overrides them, game scores are the sum of the hole scores, and the lowest one wins
+    """
+
+    name = None
+
+    # Whether the higher scores win
+    higher_wins = False
+
+    # Whether the score of a team only depends on the scores of its members, so that teams can be re-scored
+    # independently (see IncrementalEvaluator)
+    separable = True
+
+    def __init__(self):
+        super().__init__()
+
+    @abstractmethod
+    def hole_scores(self, players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        """
+        :param players_scenarios: a (... x #players x #holes) array of player scores (allowances included)
+        :param membership: padded team membership index (see team_membership_index)
+        :param team_sizes:
+        :return: a (... x #teams x #holes) array with the score of each team on each hole
+        """
+        pass
+
+    def game_scores(self, hole_scores: np.ndarray) -> np.ndarray:
+        """
+        :param hole_scores: a (... x #teams x #holes) array
+        :return: a (... x #teams) array with the score of each team in each scenario
+        """
+        return np.sum(hole_scores, axis=-1, dtype=TOTAL_DTYPE)
+
+    def win_shares(self, scores: np.ndarray, axis: int = -1) -> np.ndarray:
+        """
+        Returns the share of the win of each team (ties are split evenly)
+        :param scores: game scores (see game_scores)
+        :param axis: the team axis
+        :return:
+        """
+        return split_ties(-scores if self.higher_wins else scores, axis=axis)
+
+    def head_to_head_wins(self, hole_scores: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """
+        Returns the wins of each team against each other team over a batch of scenarios: the higher game score, or
+        the lower one, beats the other, and ties count as half a win for both. Kernels that compare teams otherwise
+        are not separable
+        :param hole_scores: a #scenarios x #teams x #holes array (see hole_scores)
+        :param scores: a #scenarios x #teams array (see game_scores)
+        :return: a #teams x #teams array
+        """
+        return pairwise_wins(scores, scores, self.higher_wins)
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.name)
+
+
+class BestBallKernel(ScoringKernel):
+    """
+    Stroke play of the best balls: the score of a team on a hole is the sum of the number_of_best_balls lowest scores
+    of its members
+    """
+
+    name = 'best-ball'
+
+    def __init__(self, number_of_best_balls: int = 1):
+        super().__init__()
+        assert (number_of_best_balls > 0)
+        self.number_of_best_balls = number_of_best_balls
+
+    def hole_scores(self, players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        return best_balls_scenarios(players_scenarios, membership, team_sizes, self.number_of_best_balls)
+
+
+class ScrambleKernel(ScoringKernel):
+    """
+    Stroke play of a scramble. The members of a team play the best shot of the team on every stroke, so the team
+    scores at least as well as its best ball, and better when several members play the hole well: the score of the
+    team is approximated as its lowest score, one stroke lower when a second member matches it
+    """
+
+    name = 'scramble'
+
+    def hole_scores(self, players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        padding = _padding(players_scenarios.dtype)
+        best_ball, second_ball = (lowest_scores(players_scenarios, membership, 2) + [padding])[:2]
+        return best_ball - (second_ball == best_ball).astype(best_ball.dtype)
+
+
+class StablefordKernel(ScoringKernel):
+    """
+    Stableford: a player earns max(0, 2 + par - score) points on a hole (allowances included), and a team the points
+    of its number_of_best_balls best members. The most points win
+    """
+
+    name = 'stableford'
+    higher_wins = True
+
+    def __init__(self, number_of_best_balls: int = 1, par: int = PAR):
+        super().__init__()
+        assert (number_of_best_balls > 0)
+        self.number_of_best_balls = number_of_best_balls
+        self.par = par
+
+    def hole_scores(self, players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        # Points do not increase with the scores: the best points are the ones of the lowest scores. Missing members
+        # (padding) earn no points
+        points = 0
+        for scores in lowest_scores(players_scenarios, membership, self.number_of_best_balls):
+            points = points + np.maximum(2 + self.par - scores, 0).astype(scores.dtype)
+        return points
+
+
+class MatchPlayKernel(ScoringKernel):
+    """
+    Match play of the best balls, every team against every other one. A team wins a match when it wins more holes
+    (the lowest sum of its number_of_best_balls lowest scores) than its opponent. The score of a team is the number of
+    matches it won minus the number of matches it lost, and the highest one wins
+    """
+
+    name = 'match-play'
+    higher_wins = True
+    separable = False
+
+    def __init__(self, number_of_best_balls: int = 1):
+        super().__init__()
+        assert (number_of_best_balls > 0)
+        self.number_of_best_balls = number_of_best_balls
+
+    def hole_scores(self, players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray) -> np.ndarray:
+        return best_balls_scenarios(players_scenarios, membership, team_sizes, self.number_of_best_balls)
+
+    def game_scores(self, hole_scores: np.ndarray) -> np.ndarray:
+        # (... x #teams x #opponents): the holes won minus the holes lost by each team against each opponent
+        holes_up = np.sum(np.sign(hole_scores[..., np.newaxis, :, :] - hole_scores[..., :, np.newaxis, :]), axis=-1,
+                          dtype=TOTAL_DTYPE)
+        return np.sum(np.sign(holes_up), axis=-1, dtype=TOTAL_DTYPE)
+
+    def head_to_head_wins(self, hole_scores: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        # The result of the match of each pair of teams
+        holes_up = np.sum(np.sign(hole_scores[:, np.newaxis, :, :] - hole_scores[:, :, np.newaxis, :]), axis=-1,
+                          dtype=TOTAL_DTYPE)
+        return np.sum(holes_up > 0, axis=0) + 0.5 * np.sum(holes_up == 0, axis=0)
+
+
+KERNELS = {kernel.name: kernel for kernel in (BestBallKernel, ScrambleKernel, StablefordKernel, MatchPlayKernel)}
+
+
+def create_kernel(game_format: str, number_of_best_balls: int = 1) -> ScoringKernel:
+    """
+    Returns the kernel of a game format
+    :param game_format: one of the names of KERNELS
+    :param number_of_best_balls: the scores counted for each team on a hole (ignored by scrambles)
+    :return:
+    """
+    kernel = KERNELS.get(game_format)
+    if kernel is None:
+        raise ValueError("Unknown game format {}".format(game_format))
+    return kernel() if kernel is ScrambleKernel else kernel(number_of_best_balls)
+
+
+def lowest_scores(players_scenarios: np.ndarray, membership: np.ndarray, number_of_scores: int) -> List[np.ndarray]:
+    """
+    Returns, in order, the number_of_scores lowest scores of the members of each team on each hole. Teams with fewer
+    members than scores get padding (the highest value of the dtype of the scores) in the last ones
+    :param players_scenarios: a (... x #players x #holes) array
+    :param membership: padded team membership index (see team_membership_index)
+    :param number_of_scores:
+    :return: min(number_of_scores, #players-in-the-largest-team) (... x #teams x #holes) arrays
+    """
+    _, max_team_size = membership.shape
+    padding = _padding(players_scenarios.dtype)
+    lowest = [padding] * min(number_of_scores, max_team_size)
+    for member in range(max_team_size):
+        # The scores of the member-th player of each team: (... x #teams x #holes)
+        is_member = (membership[:, member] >= 0)[:, np.newaxis]
+        member_scores = np.take(players_scenarios, np.where(is_member[:, 0], membership[:, member], 0), axis=-2)
+        # Insert the scores in the sorted lowest ones. Padding scores sort last
+        member_scores = np.where(is_member, member_scores, padding)
+        for index in range(len(lowest)):
+            lowest[index], member_scores = np.minimum(lowest[index], member_scores), \
+                                           np.maximum(lowest[index], member_scores)
+    return lowest
+
+
+def best_balls_scenarios(players_scenarios: np.ndarray, membership: np.ndarray, team_sizes: np.ndarray,
+                         number_of_best_balls: int) -> np.ndarray:
+    """
+    Sum, for each team and hole, the number_of_best_balls lowest scores of the team members. Teams with fewer members
+    than best balls count all of their scores
+    :param players_scenarios: a (... x #players x #holes) array
+    :param membership: padded team membership index (see team_membership_index)
+    :param team_sizes:
+    :param number_of_best_balls:
+    :return: a (... x #teams x #holes) array
+    """
+    _, max_team_size = membership.shape
+    if number_of_best_balls >= max_team_size:
+        totals = 0
+        for member in range(max_team_size):
+            is_member = (membership[:, member] >= 0)[:, np.newaxis]
+            member_scores = np.take(players_scenarios, np.where(is_member[:, 0], membership[:, member], 0), axis=-2)
+            totals = totals + np.where(is_member, member_scores, 0)
+        return totals
+    # Scores keep the dtype of the players' ones (see check_score_range). Teams with fewer members than best balls
+    # leave padding in the last best balls
+    padding = _padding(players_scenarios.dtype)
+    return sum(np.where(best_ball == padding, 0, best_ball)
+               for best_ball in lowest_scores(players_scenarios, membership, number_of_best_balls))
+
+
+def _padding(dtype):
+    return np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else np.inf
+
+
+def pairwise_wins(scores: np.ndarray, opponent_scores: np.ndarray, higher_wins: bool = False) -> np.ndarray:
+    """
+    Returns the wins of each entity against each opponent over the scenarios: 1 for beating it, 1/2 for a tie
+    :param scores: a (... x #scenarios x #entities) array
+    :param opponent_scores: a (... x #scenarios x #opponents) array
+    :param higher_wins: whether the higher scores win
+    :return: a (... x #entities x #opponents) array
+    """
+    entities = scores[..., :, :, np.newaxis]
+    opponents = opponent_scores[..., :, np.newaxis, :]
+    beats = entities > opponents if higher_wins else entities < opponents
+    return np.sum(beats, axis=-3) + 0.5 * np.sum(entities == opponents, axis=-3)
+
+
+def split_ties(scores: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Returns the share of the win of each entity along the given axis: 1/k for each of the k entities with the lowest
+    score, 0 for the others
+    :param scores:
+    :param axis: the entity axis
+    :return:
+    """
+    is_winner = scores == np.min(scores, axis=axis, keepdims=True)
+    return is_winner / np.sum(is_winner, axis=axis, keepdims=True)
@@ -0,0 +1,187 @@
+import json
+from collections import namedtuple
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# What a saved partial result is a part of: the simulation (its master seed, and the iterations it plays split into
+# number_of_shards shards), the shards of it that were played, and the teams that played it (see teams_key)
+ShardInfo = namedtuple('ShardInfo', ['seed', 'number_of_iterations', 'number_of_shards', 'shard_indexes', 'teams_key'])
+
+
+class PartialResult(object):
+    """
+    Summary of a set of simulated games: number of games, total score and number of wins of each playing entity, the
+    sum of the squared win shares (the fraction of the wins of a game credited to the entity) used to estimate the
+    standard errors of the probabilities of winning and, for team games, the wins of each entity against each other
+    one (head to head).
+    Summaries of the same game are merged by summation, so a simulation can be split in shards that run in different
+    processes, or on different machines, and be recombined afterwards.
+    """
+
+    def __init__(self, number_of_scenarios: int, total_scores: np.ndarray, number_of_wins: np.ndarray,
+                 squared_win_shares: np.ndarray, head_to_head_wins: np.ndarray = None):
+        """
+
+        :param number_of_scenarios: the number of simulated games
+        :param total_scores: the sum of the scores of each entity over all the games
+        :param number_of_wins: the number of wins of each entity. Ties are split evenly, so counts can be fractional
+        :param squared_win_shares: the sum over all the games of the squared win share of each entity
+        :param head_to_head_wins: an #entities x #entities array with the number of games in which each entity beat
+        each other one (ties count as half a win for both), if it was counted
+        """
+        assert (len(total_scores) == len(number_of_wins) == len(squared_win_shares))
+        assert (head_to_head_wins is None or np.shape(head_to_head_wins) == (len(total_scores), len(total_scores)))
+        self._number_of_scenarios = int(number_of_scenarios)
+        self._total_scores = np.asarray(total_scores, dtype=np.int64)
+        self._number_of_wins = np.asarray(number_of_wins, dtype=np.float64)
+        self._squared_win_shares = np.asarray(squared_win_shares, dtype=np.float64)
+        self._head_to_head_wins = None if head_to_head_wins is None else np.asarray(head_to_head_wins,
+                                                                                      dtype=np.float64)
+
+    def __repr__(self):
+        return "{}: scenarios={}, total scores:{}, wins:{}".format(
+            self.__class__.__name__, self._number_of_scenarios, self._total_scores, self._number_of_wins)
+
+    @property
+    def number_of_scenarios(self) -> int:
+        return self._number_of_scenarios
+
+    @property
+    def total_scores(self) -> np.ndarray:
+        return self._total_scores
+
+    @property
+    def number_of_wins(self) -> np.ndarray:
+        return self._number_of_wins
+
+    @property
+    def squared_win_shares(self) -> np.ndarray:
+        return self._squared_win_shares
+
+    @property
+    def head_to_head_wins(self) -> Optional[np.ndarray]:
+        return self._head_to_head_wins
+
+    @property
+    def expected_scores(self) -> np.ndarray:
+        return self._total_scores / self._number_of_scenarios
+
+    @property
+    def win_probabilities(self) -> np.ndarray:
+        return self._number_of_wins / np.sum(self._number_of_wins)
+
+    @property
+    def standard_errors(self) -> np.ndarray:
+        """
+        The standard errors of the probabilities of winning
+        """
+        variances = self._squared_win_shares / self._number_of_scenarios - np.square(self.win_probabilities)
+        return np.sqrt(np.maximum(variances, 0.0) / self._number_of_scenarios)
+
+    @property
+    def head_to_head(self) -> Optional[np.ndarray]:
+        """
+        The probability that each entity beats each other one (ties count as half a win): an #entities x #entities
+        array, or None if the head-to-head wins were not counted
+        """
+        if self._head_to_head_wins is None:
+            return None
+        return self._head_to_head_wins / self._number_of_scenarios
+
+    def merge(self, other: 'PartialResult') -> 'PartialResult':
+        assert (len(self._total_scores) == len(other.total_scores)), "Results of different games cannot be merged"
+        head_to_head_wins = None
+        if self._head_to_head_wins is not None and other.head_to_head_wins is not None:
+            head_to_head_wins = self._head_to_head_wins + other.head_to_head_wins
+        return PartialResult(self._number_of_scenarios + other.number_of_scenarios,
+                             self._total_scores + other.total_scores,
+                             self._number_of_wins + other.number_of_wins,
+                             self._squared_win_shares + other.squared_win_shares,
+                             head_to_head_wins)
+
+    @staticmethod
+    def merge_all(results: Iterable['PartialResult']) -> 'PartialResult':
+        merged = None
+        for result in results:
+            merged = result if merged is None else merged.merge(result)
+        assert (merged is not None), "There are no results to merge"
+        return merged
+
+    def take(self, indexes: Sequence[int]) -> 'PartialResult':
+        """
+        Returns the result of the entities at the given indexes, in that order
+        """
+        indexes = np.asarray(indexes, dtype=int)
+        return PartialResult(self._number_of_scenarios, self._total_scores[indexes], self._number_of_wins[indexes],
+                             self._squared_win_shares[indexes],
+                             None if self._head_to_head_wins is None else self._head_to_head_wins[np.ix_(indexes,
+                                                                                                          indexes)])
+
+    def save(self, file, shard_info: ShardInfo = None):
+        """
+        Write the result to a .npz file
+        :param file: a path, or a writable binary file
+        :param shard_info: the simulation that the result is a part of (see check_shards), if any
+        :return:
+        """
+        extra = dict() if self._head_to_head_wins is None else {'head_to_head_wins': self._head_to_head_wins}
+        if shard_info is not None:
+            extra['shard_info'] = json.dumps(shard_info._asdict())
+        np.savez(file, number_of_scenarios=self._number_of_scenarios, total_scores=self._total_scores,
+                 number_of_wins=self._number_of_wins, squared_win_shares=self._squared_win_shares, **extra)
+
+    @classmethod
+    def load(cls, file) -> 'PartialResult':
+        """
+        Read a result written by save
+        :param file: a path, or a readable binary file
+        :return:
+        """
+        return cls.load_shard(file)[0]
+
+    @classmethod
+    def load_shard(cls, file) -> Tuple['PartialResult', Optional[ShardInfo]]:
+        """
+        Read a result written by save, and the simulation that it is a part of
+        :param file: a path, or a readable binary file
+        :return: the result, and its shard info (None if it was saved without)
+        """
+        with np.load(file, allow_pickle=False) as data:
+            result = cls(int(data['number_of_scenarios']), data['total_scores'], data['number_of_wins'],
+                         data['squared_win_shares'],
+                         data['head_to_head_wins'] if 'head_to_head_wins' in data.files else None)
+            shard_info = None
+            if 'shard_info' in data.files:
+                fields = json.loads(str(data['shard_info']))
+                shard_info = ShardInfo(**dict(fields, shard_indexes=tuple(fields['shard_indexes'])))
+        return result, shard_info
+
+
+def check_shards(shard_infos: Sequence[Optional[ShardInfo]], teams_key: str = None):
+    """
+    Check that partial results are the shards of the same simulation, each one once, and all of them, so that merging
+    them gives the result of the whole simulation
+    :param shard_infos: the shard info of each partial result
+    :param teams_key: the key of the teams that the results must have been played by, if known
+    :raise ValueError: if they are not
+    """
+    if not shard_infos:
+        raise ValueError("There are no results to merge")
+    if any(shard_info is None for shard_info in shard_infos):
+        raise ValueError("Partial results saved without their shard info cannot be merged")
+    first = shard_infos[0]
+    for field in ('seed', 'number_of_iterations', 'number_of_shards', 'teams_key'):
+        if any(getattr(shard_info, field) != getattr(first, field) for shard_info in shard_infos):
+            raise ValueError("The partial results are not shards of the same simulation (different {})"
+                             .format(field.replace('_', ' ')))
+    if teams_key is not None and first.teams_key != teams_key:
+        raise ValueError("The partial results were played by other teams")
+    shard_indexes = [index for shard_info in shard_infos for index in shard_info.shard_indexes]
+    if len(set(shard_indexes)) < len(shard_indexes):
+        raise ValueError("Some shards are merged more than once")
+    missing_shards = sorted(set(range(first.number_of_shards)) - set(shard_indexes))
+    if missing_shards:
+        raise ValueError("Shards {} of {} are missing".format(', '.join(str(index) for index in missing_shards),
+                                                              first.number_of_shards))
@@ -1,12 +1,31 @@
+import logging
+import signal
 from abc import ABC, abstractmethod
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from random import randint
-from typing import Iterable
+from statistics import NormalDist
+from typing import Iterable, Iterator, Optional, Sequence
 
 import numpy as np
 import inject
 
-from fairway.domain.player import Player
 from fairway.usecases.dataset import Dataset
+from fairway.usecases.distributions import SCORE_DTYPE, ScoreDistributions, sample_scores
+from fairway.usecases.results import PartialResult
+from fairway.util import profiling
+
+
+# What a simulation shard needs in order to play games on its own, possibly in another process:
+# - cumulative_distributions: #players x #scores cumulative score distributions of the players
+# - allowances: #players x #holes allowances
+# - reduce: callable that maps a batch of player scenarios to the scenarios of the playing entities (None: players)
+# - counter: callable that returns the accumulator of the wins (e.g. a WinsCounter class)
+SimulationTask = namedtuple('SimulationTask', ['cumulative_distributions', 'allowances', 'reduce', 'counter'])
+
+# Memory taken by a sampled score: kept as int8, and while a chunk is played (draws, comparisons, allowances, reduction)
+SCORE_BYTES = np.dtype(SCORE_DTYPE).itemsize
+CHUNK_BYTES_PER_SCORE = 16
 
 
 class Simulator(ABC):
@@ -14,15 +33,52 @@ class Simulator(ABC):
     def __init__(self, number_of_iterations: int):
         super().__init__()
         self._number_of_iterations = number_of_iterations
+        self._score_distributions = None
 
     @property
     def number_of_iterations(self):
         return self._number_of_iterations
 
+    @property
+    def score_distributions(self) -> ScoreDistributions:
+        if self._score_distributions is None:
+            self._score_distributions = inject.instance(Dataset).get_score_distributions()
+        return self._score_distributions
+
+    def create_task(self, player_handicaps: Iterable[int], allowances: np.ndarray, reduce, counter) -> SimulationTask:
+        return SimulationTask(self.score_distributions.get_cumulative_distributions(player_handicaps),
+                              allowances, reduce, counter)
+
     @abstractmethod
-    def sample_game_scenario(self, players: Iterable[Player], number_of_holes: int) -> np.ndarray:
+    def simulate(self, task: SimulationTask) -> PartialResult:
         pass
 
+    def simulate_progressively(self, task: SimulationTask, progress_interval: int) -> Iterator[PartialResult]:
+        """
+        Generator of the running results of the simulation of the task, every progress_interval iterations. The last
+        result is the one of the whole simulation. Simulators that do not play iterations yield their only result
+        :param task:
+        :param progress_interval:
+        :return:
+        """
+        yield self.simulate(task)
+
+    @property
+    def memory_budget(self) -> Optional[int]:
+        """
+        The bytes that the scenarios of a simulation may take (None: unbounded)
+        """
+        return None
+
+    def get_players_scenarios(self, task: SimulationTask) -> Optional[np.ndarray]:
+        """
+        Returns the #scenarios x #players x #holes scores (allowances included) that simulate plays for the task, or
+        None if the simulator does not sample scenarios
+        :param task:
+        :return:
+        """
+        return None
+
     @abstractmethod
     def reset(self):
         pass
@@ -30,9 +86,85 @@ class Simulator(ABC):
 
 class MonteCarloSimulator(Simulator):
 
-    def __init__(self, number_of_iterations):
+    def __init__(self, number_of_iterations, chunk_size: int = 1000, number_of_processes: int = 1,
+                 seed: int = None, number_of_shards: int = None, shard_indexes: Sequence[int] = None,
+                 precision: float = None, confidence: float = 0.95, round_size: int = 500,
+                 common_random_numbers: bool = False, number_of_cached_fields: int = 2, memory_budget: int = None):
+        """
+
+        :param number_of_iterations: the iteration budget of each simulation, split across all of its shards. It is
+        the maximum number of iterations when a precision is given
+        :param chunk_size: the maximum number of game scenarios sampled at once. It bounds the memory used by the
+        simulation to ~(chunk_size x #players x #holes) scores
+        :param number_of_processes: the number of processes simulating shards in parallel
+        :param seed: the master seed: each shard draws from an independent random stream derived from it
+        :param number_of_shards: the number of shards the iteration budget is split into (default: number_of_processes)
+        :param shard_indexes: the shards to be simulated (default: all of them). Simulating a subset of the shards
+        allows distributing a simulation over several machines, and merging the partial results afterwards
+        :param precision: if given, simulations stop as soon as the confidence intervals of all the probabilities of
+        winning are narrower than +/-precision
+        :param confidence: the confidence level of the intervals
+        :param round_size: the number of iterations played before each check of the confidence intervals
+        :param common_random_numbers: if True, the scores of the players of a field are sampled once, cached, and
+        reused by all the simulations of that field (e.g. by every candidate assignment of the players to teams). The
+        cached scores are the ones that the shards would sample, and they are evaluated in this process
+        :param number_of_cached_fields: the number of fields whose scores are kept in memory
+        :param memory_budget: if given, the bytes that the scenarios of a simulation may take: half of it sizes the
+        chunks (overriding chunk_size), the other half bounds the scores kept in memory for common random numbers and
+        for incremental evaluations. Fields whose scores do not fit are sampled again from the same seeds
+        """
+        assert (chunk_size > 0)
+        assert (number_of_processes > 0)
+        assert (precision is None or precision > 0)
+        assert (0 < confidence < 1)
+        assert (round_size > 0)
+        assert (memory_budget is None or memory_budget > 0)
         super().__init__(number_of_iterations)
-        self.seed = randint(0, 2**32-1)  # Generate seed
+        self.seed = seed if seed is not None else randint(0, 2**32-1)  # Generate seed
+        self._chunk_size = chunk_size
+        self._number_of_processes = number_of_processes
+        self._number_of_shards = number_of_shards if number_of_shards else number_of_processes
+        self._shard_indexes = tuple(shard_indexes) if shard_indexes is not None else tuple(range(self._number_of_shards))
+        assert (all(0 <= index < self._number_of_shards for index in self._shard_indexes))
+        assert (precision is None or len(self._shard_indexes) == self._number_of_shards), \
+            "Early stopping requires all the shards of a simulation"
+        self._precision = precision
+        self._z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self._round_size = round_size
+        self._random = np.random.default_rng(self.seed)
+        self._executor = None
+        self._common_random_numbers = common_random_numbers
+        self._number_of_cached_fields = number_of_cached_fields
+        self._fields = OrderedDict()
+        self._memory_budget = memory_budget
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def number_of_processes(self):
+        return self._number_of_processes
+
+    @property
+    def number_of_shards(self):
+        return self._number_of_shards
+
+    @property
+    def shard_indexes(self) -> Sequence[int]:
+        return self._shard_indexes
+
+    @property
+    def precision(self):
+        return self._precision
+
+    @property
+    def common_random_numbers(self):
+        return self._common_random_numbers
+
+    @property
+    def memory_budget(self) -> Optional[int]:
+        return self._memory_budget
 
     def sample_game_scenario(self, player_handicaps: Iterable[int], number_of_holes: int) -> np.ndarray:
         """
@@ -42,17 +174,277 @@ class MonteCarloSimulator(Simulator):
         :param number_of_holes:
         :return:
         """
-        dataset = inject.instance(Dataset)
-        score_prob_distributions = dataset.get_score_distributions()
+        return self.sample_game_scenarios(player_handicaps, number_of_holes, 1)[0]
 
-        n_players = len(player_handicaps)
-        s = np.zeros((n_players, number_of_holes), dtype=np.int8)
-        for row_index, handicap in enumerate(player_handicaps):
-            player_scenario = s[row_index, :]
-            distribution = score_prob_distributions.get_distribution(handicap)
-            scores = np.random.choice(score_prob_distributions.score_on_the_hole, number_of_holes, p=distribution)
-            np.copyto(player_scenario, scores)
-        return s
+    def sample_game_scenarios(self, player_handicaps: Iterable[int], number_of_holes: int,
+                              number_of_scenarios: int) -> np.ndarray:
+        """
+        Returns a 3-dimensional, #scenarios x #players x #holes, array containing the scores of each player for each
+        hole of each scenario
+        :param player_handicaps:
+        :param number_of_holes:
+        :param number_of_scenarios:
+        :return:
+        """
+        return self.score_distributions.sample(player_handicaps, number_of_holes, number_of_scenarios, self._random)
+
+    def simulate(self, task: SimulationTask) -> PartialResult:
+        """
+        Play number_of_iterations games (or the selected shards of them), and return the merged results. If a
+        precision is set, games are played in rounds until the confidence intervals are narrow enough
+        :param task:
+        :return:
+        """
+        result = None
+        for result in self._simulate_rounds(task, self._first_round_iterations()):
+            pass
+        return result
+
+    def simulate_progressively(self, task: SimulationTask, progress_interval: int) -> Iterator[PartialResult]:
+        """
+        Play the games in rounds of progress_interval iterations (instead of round_size ones, when a precision is set),
+        and yield the running results after each round. The games played depend on the rounds, so results are only
+        reproducible with the same seed and progress interval. Consumers can stop at any time, and keep the last
+        result: it merges all the rounds played so far
+        :param task:
+        :param progress_interval:
+        :return:
+        """
+        assert (progress_interval > 0)
+        return self._simulate_rounds(task, progress_interval)
+
+    def _simulate_rounds(self, task: SimulationTask, round_size: int) -> Iterator[PartialResult]:
+        field = self._get_field(task) if self._common_random_numbers else None
+        seed_sequence = field.seed_sequence if field else np.random.SeedSequence(self.seed)
+        result = None
+        round_index = 0
+        # The iterations of the rounds played so far, across all the shards: results only count the selected ones
+        iterations = 0
+        while iterations < self._number_of_iterations:
+            if field is not None and round_index < len(field.rounds):
+                # Common random numbers replay the recorded rounds, whatever their size
+                round_iterations = field.round_sizes[round_index]
+            else:
+                round_iterations = min(round_size, self._number_of_iterations - iterations)
+            round_result = self._simulate_round(task, round_index, round_iterations, seed_sequence, field)
+            result = round_result if result is None else result.merge(round_result)
+            iterations += round_iterations
+            round_index += 1
+            yield result
+            if self._precision is not None and np.max(self.confidence_half_widths(result)) <= self._precision:
+                break
+        if self._precision is not None:
+            logging.debug("Simulation stopped after {} iterations. Max half-width: {}"
+                          .format(result.number_of_scenarios, np.max(self.confidence_half_widths(result))))
+
+    def confidence_half_widths(self, result: PartialResult) -> np.ndarray:
+        """
+        Half-widths of the confidence intervals of the probabilities of winning. The variance is floored at the one
+        of z^2/2 pseudo-wins, so that entities that have not won (or lost) any game yet are not deemed precise
+        :param result:
+        :return:
+        """
+        n = result.number_of_scenarios
+        pseudo_probability = (self._z ** 2 / 2) / (n + self._z ** 2)
+        variances = np.maximum(np.square(result.standard_errors) * n, pseudo_probability * (1 - pseudo_probability))
+        return self._z * np.sqrt(variances / n)
+
+    def get_players_scenarios(self, task: SimulationTask) -> Optional[np.ndarray]:
+        """
+        Returns the scenarios of the players, or None if they do not fit in half of the memory budget
+        """
+        if self._common_random_numbers:
+            field = self._get_field(task)
+            if not field.rounds:
+                field.add_round(self._first_round_iterations(), self._get_shards(self._first_round_iterations(),
+                                                                                 field.seed_sequence))
+            rounds = [(field, round_index) for round_index in range(len(field.rounds))]
+            number_of_iterations = field.number_of_iterations
+        else:
+            rounds = [(None, self._get_shards(self._first_round_iterations(), np.random.SeedSequence(self.seed)))]
+            number_of_iterations = self._first_round_iterations()
+        if self._memory_budget is not None and \
+                number_of_iterations * task.allowances.size * SCORE_BYTES > self._memory_budget // 2:
+            logging.info("The scenarios of {} iterations of the field do not fit in the memory budget"
+                         .format(number_of_iterations))
+            return None
+        scenarios = np.concatenate([chunk for round_field, field_round in rounds
+                                    for chunk in (self._get_round_scenarios(task, round_field, field_round)
+                                                  if round_field else self._sample_shards(task, field_round))])
+        scenarios += task.allowances
+        return scenarios
+
+    def _first_round_iterations(self) -> int:
+        return self._number_of_iterations if self._precision is None else min(self._round_size,
+                                                                               self._number_of_iterations)
+
+    def chunk_size_of(self, task: SimulationTask) -> int:
+        """
+        The number of scenarios sampled at once for the task: chunk_size, or, given a memory budget, as many as fit
+        in the half of the budget left to each process
+        """
+        if self._memory_budget is None:
+            return self._chunk_size
+        scenario_bytes = task.allowances.size * CHUNK_BYTES_PER_SCORE
+        return max(1, self._memory_budget // (2 * self._number_of_processes * scenario_bytes))
+
+    def _simulate_round(self, task: SimulationTask, round_index: int, number_of_iterations: int,
+                        seed_sequence: np.random.SeedSequence, field: 'FieldScenarios' = None) -> PartialResult:
+        if field is None:
+            shards = self._get_shards(number_of_iterations, seed_sequence)
+        else:
+            # Common random numbers: every task of the field plays the same shards
+            if round_index == len(field.rounds):
+                field.add_round(number_of_iterations, self._get_shards(number_of_iterations, seed_sequence))
+            shards = field.rounds[round_index]
+            if field.keep_scenarios:
+                # Sample the round once, then replay it
+                return play_scenarios(task, self._get_round_scenarios(task, field, round_index))
+
+        chunk_size = self.chunk_size_of(task)
+        if self._number_of_processes == 1 or len(shards) == 1:
+            results = [simulate_shard(task, iterations, seed, chunk_size) for iterations, seed in shards]
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._number_of_processes,
+                                                     initializer=ignore_interrupts)
+            futures = [self._executor.submit(simulate_shard, task, iterations, seed, chunk_size)
+                       for iterations, seed in shards]
+            results = [future.result() for future in futures]
+        return PartialResult.merge_all(results)
+
+    def _get_round_scenarios(self, task: SimulationTask, field: 'FieldScenarios',
+                             round_index: int) -> Sequence[np.ndarray]:
+        """
+        The player scenarios of a round of the field: the kept ones, or sampled again from the seeds of its shards
+        """
+        if round_index < len(field.scenarios):
+            return field.scenarios[round_index]
+        chunks = self._sample_shards(task, field.rounds[round_index])
+        if field.keep_scenarios:
+            field.scenarios.append(chunks)
+        return chunks
+
+    def _sample_shards(self, task: SimulationTask, shards) -> Sequence[np.ndarray]:
+        """
+        Sample, in this process, the player scenarios that the given shards would play
+        """
+        _, number_of_holes = task.allowances.shape
+        chunk_size = self.chunk_size_of(task)
+        return [chunk for iterations, seed in shards
+                for chunk in sample_scenario_chunks(task.cumulative_distributions, number_of_holes, iterations,
+                                                    chunk_size, np.random.default_rng(seed))]
+
+    def _get_shards(self, number_of_iterations: int, seed_sequence: np.random.SeedSequence):
+        """
+        Split the iterations of a round across the shards
+        :return: the (number of iterations, seed) of each selected shard
+        """
+        shard_seeds = seed_sequence.spawn(self._number_of_shards)
+        iterations_per_shard, larger_shards = divmod(number_of_iterations, self._number_of_shards)
+        shard_iterations = [iterations_per_shard + (1 if index < larger_shards else 0)
+                            for index in range(self._number_of_shards)]
+        return [(shard_iterations[index], shard_seeds[index]) for index in self._shard_indexes
+                if shard_iterations[index] > 0]
+
+    def _get_field(self, task: SimulationTask) -> 'FieldScenarios':
+        """
+        Returns the cached scenarios of the players of the task (least recently used fields are evicted)
+        """
+        key = (task.cumulative_distributions.shape, task.cumulative_distributions.tobytes(), task.allowances.shape)
+        field = self._fields.pop(key, None)
+        if field is None:
+            # The kept scenarios of all the cached fields take at most half of the memory budget
+            field_bytes = self._number_of_iterations * task.allowances.size * SCORE_BYTES
+            field = FieldScenarios(self.seed, self._memory_budget is None or
+                                   field_bytes <= self._memory_budget // (2 * self._number_of_cached_fields))
+            while len(self._fields) >= self._number_of_cached_fields:
+                self._fields.popitem(last=False)
+        self._fields[key] = field
+        return field
 
     def reset(self):
-        np.random.seed(self.seed)
+        self._random = np.random.default_rng(self.seed)
+
+
+class FieldScenarios(object):
+    """
+    The rounds sampled for a field: the size (across all the shards) and the selected shards (iterations and seed) of
+    each round and, if they are kept in memory, their player scenarios
+    """
+
+    def __init__(self, seed: int, keep_scenarios: bool = True):
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.keep_scenarios = keep_scenarios
+        self.round_sizes = list()
+        self.rounds = list()
+        self.scenarios = list()
+
+    def add_round(self, number_of_iterations: int, shards):
+        self.round_sizes.append(number_of_iterations)
+        self.rounds.append(shards)
+
+    @property
+    def number_of_iterations(self) -> int:
+        return sum(iterations for shards in self.rounds for iterations, _ in shards)
+
+
+def ignore_interrupts():
+    """
+    Initializer of the worker processes: interruptions (Ctrl-C) are handled by the main process only
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def simulate_shard(task: SimulationTask, number_of_iterations: int, seed, chunk_size: int) -> PartialResult:
+    """
+    Play number_of_iterations games drawing from the random stream identified by seed
+    :param task:
+    :param number_of_iterations:
+    :param seed: an integer, or a numpy SeedSequence
+    :param chunk_size:
+    :return:
+    """
+    random = np.random.default_rng(seed)
+    _, number_of_holes = task.allowances.shape
+    return play_scenarios(task, sample_scenario_chunks(task.cumulative_distributions, number_of_holes,
+                                                       number_of_iterations, chunk_size, random))
+
+
+def play_scenarios(task: SimulationTask, players_scenarios: Iterable[np.ndarray]) -> PartialResult:
+    """
+    Play the games of the given batches of player scenarios
+    :param task:
+    :param players_scenarios: an enumerable of #scenarios x #players x #holes arrays
+    :return:
+    """
+    counter = task.counter()
+    for chunk in players_scenarios:
+        chunk = np.add(chunk, task.allowances)
+        if task.reduce is not None:
+            with profiling.stage('team reduction', len(chunk)):
+                chunk = task.reduce(chunk)
+        with profiling.stage('win counting', len(chunk)):
+            counter.update(chunk)
+    return counter.result()
+
+
+def sample_scenario_chunks(cumulative_distributions: np.ndarray, number_of_holes: int, number_of_scenarios: int,
+                           chunk_size: int, random: np.random.Generator) -> Iterator[np.ndarray]:
+    """
+    Generator that samples number_of_scenarios game scenarios, at most chunk_size at a time
+    :param cumulative_distributions:
+    :param number_of_holes:
+    :param number_of_scenarios:
+    :param chunk_size:
+    :param random:
+    :return:
+    """
+    remaining = number_of_scenarios
+    while remaining > 0:
+        chunk_scenarios = min(remaining, chunk_size)
+        remaining -= chunk_scenarios
+        with profiling.stage('sampling', chunk_scenarios):
+            chunk = sample_scores(cumulative_distributions, number_of_holes, chunk_scenarios, random)
+        yield chunk
+
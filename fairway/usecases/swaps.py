@@ -1,14 +1,19 @@
 import itertools
 import logging
+import time
 from abc import ABC, abstractmethod
+from collections import namedtuple
 from math import floor
-from typing import Tuple
+from typing import Sequence, Tuple
 
 import inject
 
+import numpy as np
+
 from fairway.domain.player import Player
 from fairway.domain.tournament import Tournament
 from fairway.usecases.fairness import FairnessEvaluator
+from fairway.util import profiling
 
 
 class SwapGenerator(ABC):
@@ -77,29 +82,176 @@ class SimpleSwapper(Swapper):
         super().__init__()
 
     def adjust_teams(self, tournament: Tournament):
+        evaluator = tournament.game.incremental_evaluator(tournament.players, tournament.teams)
+        index_of = tournament.roster.index_of
+
         def try_swaps():
-            current_fairness = self._fairness_evaluator.get_fairness(tournament.teams)
+            current_fairness = self._get_fairness(tournament)
             for players_to_swap in self._swap_generator.get_swaps(tournament):
+                previous_result = tournament.game.last_result
                 swap(players_to_swap, tournament)
-                new_fairness = self._fairness_evaluator.get_fairness(tournament.teams)
+                # Simulators using common random numbers evaluate every swap against the same scenarios
+                tournament.game.play_team_game(tournament.players, tournament.teams)
+                new_fairness = self._get_fairness(tournament)
                 if new_fairness < current_fairness:
                     logging.debug("Improved fairness: {} -> {}".format(current_fairness, new_fairness))
                     return True  # Candidate swaps set needs to be recomputed upon player assignment changes
                 else:
                     swap(players_to_swap, tournament)  # Not worth it, swap back
+                    tournament.game.apply_result(tournament.teams, previous_result)
             return False    # No swap performed
 
-        while not self._fairness_evaluator.is_fair_enough(tournament.teams):
-            if not try_swaps():
+        def try_best_swap():
+            # Evaluate all the candidates at once, and apply the one that improves fairness the most
+            swaps = self._swap_generator.get_swaps(tournament)
+            if not swaps:
+                return False
+            current_fairness = self._get_fairness(tournament)
+            fairness = self._fairness_evaluator.get_fairness_of_probabilities(*evaluator.evaluate_swaps(
+                [(index_of(player_0), index_of(player_1)) for player_0, player_1 in swaps],
+                head_to_head=self._fairness_evaluator.uses_head_to_head))
+            best = int(np.argmin(fairness))
+            if fairness[best] >= current_fairness:
+                return False    # No swap performed
+            logging.debug("Improved fairness: {} -> {}".format(current_fairness, fairness[best]))
+            player_0, player_1 = swaps[best]
+            swap((player_0, player_1), tournament)
+            evaluator.swap(index_of(player_0), index_of(player_1))
+            tournament.game.apply_result(tournament.teams, evaluator.result())
+            return True
+
+        if evaluator is not None:
+            # Estimate the teams on the same scenarios used to evaluate the swaps
+            tournament.game.apply_result(tournament.teams, evaluator.result())
+        while not self._fairness_evaluator.is_fair_enough(tournament.teams, tournament.game.last_result.head_to_head):
+            with profiling.stage('swap round'):
+                improved = try_swaps() if evaluator is None else try_best_swap()
+            if not improved:
                 break   # no improving swaps were found
 
+    def _get_fairness(self, tournament: Tournament) -> float:
+        return self._fairness_evaluator.get_fairness(tournament.teams, tournament.game.last_result.head_to_head)
 
-def swap(players_to_swap: Tuple[Player, Player], tournament: Tournament):
-    team_0 = tournament.get_team(players_to_swap[0].team_id)
-    team_1 = tournament.get_team(players_to_swap[1].team_id)
 
-    team_0.remove_player(players_to_swap[0])
-    team_1.remove_player(players_to_swap[1])
+TracePoint = namedtuple('TracePoint', ['elapsed_time', 'iteration', 'fairness', 'best_fairness'])
+
+
+class AnnealingSwapper(Swapper):
+    """
+    Simulated annealing over the assignments of players to teams. Random swaps of players of different teams are
+    evaluated against the cached scenarios of the field (see BestBallGame.incremental_evaluator); improving swaps are
+    always accepted, worsening ones with a probability that decreases with the temperature. The temperature cools
+    geometrically over a wall-clock budget, and the best assignment found is applied to the tournament
+    """
+
+    _fairness_evaluator = inject.attr(FairnessEvaluator)
+
+    def __init__(self, time_budget: float = 5.0, target_fairness: float = None, final_temperature_ratio: float = 1e-3,
+                 seed: int = None):
+        """
+        :param time_budget: the wall-clock seconds the search runs for
+        :param target_fairness: stop as soon as an assignment at least this fair is found (default: use the budget)
+        :param final_temperature_ratio: the temperature at the end of the budget, relative to the initial one
+        :param seed: the seed of the random choices of the search (default: random)
+        """
+        super().__init__()
+        assert (time_budget > 0)
+        assert (0.0 < final_temperature_ratio < 1.0)
+        self._time_budget = time_budget
+        self._target_fairness = target_fairness
+        self._final_temperature_ratio = final_temperature_ratio
+        self._seed = seed
+        self._trace = tuple()
+
+    @property
+    def trace(self) -> Sequence[TracePoint]:
+        """
+        The convergence trace of the last search: a point for each improvement of the best assignment
+        """
+        return self._trace
 
-    team_0.add_player(players_to_swap[1])
-    team_1.add_player(players_to_swap[0])
+    def adjust_teams(self, tournament: Tournament):
+        if sum(1 for team in tournament.teams if team.members) < 2:
+            logging.info("Annealing: there are no players of different teams to swap")
+            return
+        evaluator = tournament.game.incremental_evaluator(tournament.players, tournament.teams)
+        if evaluator is None:
+            logging.warning("The game cannot be re-evaluated incrementally: falling back to simple swaps")
+            SimpleSwapper().adjust_teams(tournament)
+            return
+
+        random = np.random.default_rng(self._seed)
+        n_players = len(tournament.players)
+        start_time = time.perf_counter()
+
+        uses_head_to_head = self._fairness_evaluator.uses_head_to_head
+
+        def fairness_of_current():
+            result = evaluator.result(head_to_head=uses_head_to_head)
+            return float(self._fairness_evaluator.get_fairness_of_probabilities(result.win_probabilities,
+                                                                                result.head_to_head))
+
+        def random_swap():
+            player_index_0 = int(random.integers(n_players))
+            while True:
+                player_index_1 = int(random.integers(n_players))
+                if evaluator.team_of(player_index_1) != evaluator.team_of(player_index_0):
+                    return player_index_0, player_index_1
+
+        fairness = fairness_of_current()
+        best_fairness = fairness
+        best_assignment = [evaluator.team_of(index) for index in range(n_players)]
+        trace = [TracePoint(0.0, 0, fairness, best_fairness)]
+        temperature = initial_temperature = self._initial_temperature(evaluator, random_swap, fairness_of_current)
+
+        iteration = 0
+        elapsed_time = 0.0
+        with profiling.stage('annealing'):
+            while elapsed_time < self._time_budget and \
+                    (self._target_fairness is None or best_fairness > self._target_fairness):
+                iteration += 1
+                evaluator.swap(*random_swap())
+                new_fairness = fairness_of_current()
+                if new_fairness <= fairness or random.random() < np.exp((fairness - new_fairness) / temperature):
+                    fairness = new_fairness
+                    if fairness < best_fairness:
+                        best_fairness = fairness
+                        best_assignment = [evaluator.team_of(index) for index in range(n_players)]
+                        trace.append(TracePoint(time.perf_counter() - start_time, iteration, fairness,
+                                                best_fairness))
+                else:
+                    evaluator.undo()
+                elapsed_time = time.perf_counter() - start_time
+                temperature = initial_temperature * \
+                    self._final_temperature_ratio ** (elapsed_time / self._time_budget)
+            profiling.count('annealing', iteration)
+
+        trace.append(TracePoint(elapsed_time, iteration, fairness, best_fairness))
+        self._trace = tuple(trace)
+        logging.info("Annealing: best fairness {} found in {} iterations ({:.2f}s)"
+                     .format(best_fairness, iteration, elapsed_time))
+
+        # Apply the best assignment, and estimate the teams on the same scenarios
+        tournament.roster.assign(best_assignment)
+        tournament.game.apply_result(tournament.teams, tournament.game.incremental_evaluator(
+            tournament.players, tournament.teams).result())
+
+    @staticmethod
+    def _initial_temperature(evaluator, random_swap, fairness_of_current, number_of_samples: int = 50) -> float:
+        """
+        The mean worsening of fairness over a sample of random swaps, so that typical worsening swaps are initially
+        accepted with probability 1/e
+        """
+        fairness = fairness_of_current()
+        worsening = list()
+        for _ in range(number_of_samples):
+            evaluator.swap(*random_swap())
+            delta = fairness_of_current() - fairness
+            if delta > 0:
+                worsening.append(delta)
+            evaluator.undo()
+        return float(np.mean(worsening)) if worsening else 1e-3
+
+
+def swap(players_to_swap: Tuple[Player, Player], tournament: Tournament):
+    tournament.roster.swap(*players_to_swap)
@@ -0,0 +1,171 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+
+class StageStatistics(object):
+    """
+    What a profiled stage cost over all of its calls
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.iterations = 0
+        self.peak_memory = 0
+
+    @property
+    def iterations_per_second(self) -> Optional[float]:
+        return self.iterations / self.wall_time if self.iterations and self.wall_time > 0 else None
+
+    def to_json(self) -> dict:
+        return {'calls': self.calls, 'wall_time': self.wall_time, 'iterations': self.iterations,
+                'iterations_per_second': self.iterations_per_second, 'peak_memory': self.peak_memory}
+
+
+class _Frame(object):
+
+    def __init__(self, start_memory: int):
+        self.start_memory = start_memory
+        self.peak_memory = start_memory
+
+
+class Profiler(object):
+    """
+    Collects the wall time, the calls, the iterations (e.g. game scenarios) and the peak memory of the stages of a
+    run. Memory is traced with tracemalloc: the peak memory of a stage is the highest memory allocated (in bytes)
+    above the one at its start, nested stages included
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self._trace_memory = trace_memory
+        self._statistics = dict()
+        self._frames = list()
+        self._start_time = time.perf_counter()
+        self._end_time = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def statistics(self):
+        """
+        The statistics of each stage, by name
+        """
+        return self._statistics
+
+    @contextmanager
+    def stage(self, name: str, iterations: int = 0):
+        statistics = self._get_statistics(name)
+        if self._trace_memory:
+            self._record_peak()
+            self._frames.append(_Frame(tracemalloc.get_traced_memory()[0]))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            statistics.calls += 1
+            statistics.wall_time += wall_time
+            statistics.iterations += iterations
+            if self._trace_memory:
+                self._record_peak()
+                frame = self._frames.pop()
+                statistics.peak_memory = max(statistics.peak_memory, frame.peak_memory - frame.start_memory)
+                if self._frames:
+                    self._frames[-1].peak_memory = max(self._frames[-1].peak_memory, frame.peak_memory)
+
+    def count(self, name: str, iterations: int):
+        """
+        Add iterations to a stage, e.g. once they are known
+        """
+        self._get_statistics(name).iterations += iterations
+
+    def _get_statistics(self, name: str) -> StageStatistics:
+        statistics = self._statistics.get(name)
+        if statistics is None:
+            statistics = self._statistics[name] = StageStatistics()
+        return statistics
+
+    def _record_peak(self):
+        # The peak since the last reset belongs to the innermost stage (and then to the ones it is nested in)
+        _, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1].peak_memory = max(self._frames[-1].peak_memory, peak)
+        tracemalloc.reset_peak()
+
+    def stop(self):
+        self._end_time = time.perf_counter()
+        if self._trace_memory:
+            tracemalloc.stop()
+
+    def report(self) -> dict:
+        end_time = self._end_time if self._end_time is not None else time.perf_counter()
+        return {'wall_time': end_time - self._start_time,
+                'stages': {name: statistics.to_json() for name, statistics in self._statistics.items()}}
+
+    def summary(self) -> str:
+        """
+        A table of the stages, from the most expensive one
+        """
+        lines = ["{:<40} {:>8} {:>10} {:>12} {:>14} {:>12}".format("Stage", "Calls", "Time (s)", "Iterations",
+                                                                  "Iterations/s", "Peak (MB)")]
+        for name, statistics in sorted(self._statistics.items(), key=lambda item: item[1].wall_time, reverse=True):
+            iterations_per_second = statistics.iterations_per_second
+            lines.append("{:<40} {:>8} {:>10.3f} {:>12} {:>14} {:>12.1f}".format(
+                name, statistics.calls, statistics.wall_time, statistics.iterations or '',
+                "{:.0f}".format(iterations_per_second) if iterations_per_second else '',
+                statistics.peak_memory / 2**20))
+        lines.append("Total time: {:.3f}s".format(self.report()['wall_time']))
+        return "\n".join(lines)
+
+
+# The profiler of the process, if profiling is enabled
+_profiler = None
+
+
+# Stages are not profiled when profiling is disabled
+_disabled_stage = nullcontext()
+
+
+def enable(trace_memory: bool = True) -> Profiler:
+    """
+    Start profiling the stages of this process
+    :param trace_memory: trace the peak memory of the stages (it slows allocations down)
+    :return: the profiler
+    """
+    global _profiler
+    _profiler = Profiler(trace_memory)
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    """
+    Stop profiling
+    :return: the profiler that was enabled, if any
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def stage(name: str, iterations: int = 0):
+    """
+    Context manager that profiles a stage of the run, if profiling is enabled
+    :param name:
+    :param iterations: the iterations (e.g. game scenarios) performed by the stage
+    :return:
+    """
+    if _profiler is None:
+        return _disabled_stage
+    return _profiler.stage(name, iterations)
+
+
+def count(name: str, iterations: int):
+    """
+    Add iterations to a stage, if profiling is enabled
+    """
+    if _profiler is not None:
+        _profiler.count(name, iterations)
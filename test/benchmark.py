@@ -0,0 +1,372 @@
+"""
+Benchmarks of the hot paths of Fairway, swept over a matrix of players, teams, best balls and iterations.
+
+    python -m test.benchmark --matrix quick --output results.json
+    python -m test.benchmark --matrix quick --baseline results.json -t 0.2 -t assignment/=0.5
+
+(run from the root of the project, so that fairway is importable)
+
+Results are written as JSON. Given a baseline (the results of a previous run), the cases slower than their baseline by
+more than the threshold of their benchmark are reported as regressions, and the script exits with status 1
+"""
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from itertools import product
+from statistics import median
+
+import click
+import inject
+import numpy as np
+
+from fairway.app.config import create_config
+from fairway.domain import allowance
+from fairway.domain.player import Player
+from fairway.domain.tournament import Tournament
+from fairway.usecases.assignment import ABCDByHandicap, ABCDByWinProbability, ZigZagByHandicap, \
+    ZigZagByWinProbability, WeakestFirstByHandicap, WeakestFirstByWinProbability
+from fairway.usecases.bestball import BestBallGame, GameWinsCounter, HoleWinsCounter, team_membership_index
+from fairway.usecases.dataset import Dataset
+from fairway.usecases.interactors import create_teams
+from fairway.usecases.kernels import KERNELS, create_kernel
+from fairway.usecases.branch_and_bound import BranchAndBoundSwapper
+from fairway.usecases.swaps import SimpleSwapper
+
+
+project_root = pathlib.Path(__file__).parent.parent
+score_distribution_by_handicap_file = project_root / 'data/default_usga_handicap_distributions.csv'
+number_of_holes = 18
+chunk_size = 1000   # Scenarios are processed in chunks, like the simulator does
+number_of_handicaps = 36
+
+MATRICES = {
+    'quick': {'players': (8, 32, 128), 'teams': (2, 4), 'best_balls': (1, 2), 'iterations': (500, 5000)},
+    'full': {'players': (8, 32, 128, 512, 2000), 'teams': (2, 4, 8, 16), 'best_balls': (1, 2, 3),
+             'iterations': (500, 5000, 20000, 100000)},
+}
+
+# A benchmark times the callable returned by setup(**parameters) for every case of the matrix over its axes
+Benchmark = namedtuple('Benchmark', ['name', 'axes', 'setup'])
+
+
+# Inputs
+
+def random_handicaps(number_of_players: int, seed: int = 0):
+    return np.random.default_rng(seed).integers(0, number_of_handicaps, number_of_players).tolist()
+
+
+def create_players(number_of_players: int):
+    players = Player.create_all(random_handicaps(number_of_players))
+    for player, win_probability in zip(players, np.random.default_rng(1).dirichlet(np.ones(number_of_players))):
+        player.prob_of_winning = win_probability
+    return players
+
+
+def create_tournament(players, teams: int, best_balls: int) -> Tournament:
+    tournament = Tournament(BestBallGame(number_of_best_balls=best_balls), players, teams, 1.0)
+    ZigZagByHandicap().assign_players_to_teams(players, tournament.teams)
+    return tournament
+
+
+def score_distributions():
+    return inject.instance(Dataset).get_score_distributions()
+
+
+def sample_chunk(players: int, iterations: int) -> np.ndarray:
+    return score_distributions().sample(random_handicaps(players), number_of_holes, min(iterations, chunk_size),
+                                        np.random.default_rng(2))
+
+
+def chunks(iterations: int):
+    return [min(chunk_size, iterations - start) for start in range(0, iterations, chunk_size)]
+
+
+# Benchmarks
+
+def setup_sample_scores(players: int, iterations: int):
+    distributions = score_distributions()
+    handicaps = random_handicaps(players)
+    random = np.random.default_rng(3)
+
+    def run():
+        for scenarios in chunks(iterations):
+            distributions.sample(handicaps, number_of_holes, scenarios, random)
+    return run
+
+
+def setup_to_team_scenario(players: int, teams: int, best_balls: int, iterations: int):
+    game = BestBallGame(number_of_best_balls=best_balls)
+    players_scenarios = sample_chunk(players, iterations)
+    team_indexes = [tuple(range(team, players, teams)) for team in range(teams)]
+
+    def run():
+        for scenarios in chunks(iterations):
+            game.to_team_scenario(players_scenarios[:scenarios], team_indexes)
+    return run
+
+
+def setup_kernel(game_format: str):
+    def setup(players: int, teams: int, best_balls: int, iterations: int):
+        kernel = create_kernel(game_format, best_balls)
+        players_scenarios = sample_chunk(players, iterations)
+        membership, team_sizes = team_membership_index([tuple(range(team, players, teams)) for team in range(teams)])
+
+        def run():
+            for scenarios in chunks(iterations):
+                scores = kernel.game_scores(kernel.hole_scores(players_scenarios[:scenarios], membership, team_sizes))
+                kernel.win_shares(scores, axis=1)
+        return run
+    return setup
+
+
+def setup_game_wins_counter(teams: int, iterations: int):
+    team_scenarios = sample_chunk(teams, iterations)
+
+    def run():
+        counter = GameWinsCounter()
+        for scenarios in chunks(iterations):
+            counter.update(team_scenarios[:scenarios])
+        counter.result()
+    return run
+
+
+def setup_hole_wins_counter(players: int, iterations: int):
+    players_scenarios = sample_chunk(players, iterations)
+
+    def run():
+        counter = HoleWinsCounter()
+        for scenarios in chunks(iterations):
+            counter.update(players_scenarios[:scenarios])
+        counter.result()
+    return run
+
+
+def setup_get_allowances(players: int):
+    players = create_players(players)
+
+    def run():
+        allowance._get_allowances.cache_clear()     # Time the computation, not the cache
+        allowance.get_allowances(players, number_of_holes, 1.0)
+    return run
+
+
+def setup_assignment(strategy_type):
+    def setup(players: int, teams: int):
+        players = create_players(players)
+        tournament = Tournament(BestBallGame(), players, teams, 1.0)
+        strategy = strategy_type()
+
+        def run():
+            strategy.assign_players_to_teams(players, tournament.teams)
+        return run
+    return setup
+
+
+def setup_simple_swapper(players: int, teams: int, best_balls: int, iterations: int):
+    configure(iterations)
+    tournament = create_tournament(create_players(players), teams, best_balls)
+    tournament.game.play_team_game(tournament.players, tournament.teams)
+    swapper = SimpleSwapper()
+
+    def run():
+        swapper.adjust_teams(tournament)
+    return run
+
+
+def setup_branch_and_bound(players: int, teams: int, best_balls: int):
+    configure(exact=True)
+    tournament = create_tournament(create_players(players), teams, best_balls)
+    tournament.game.play_team_game(tournament.players, tournament.teams)
+    swapper = BranchAndBoundSwapper(time_budget=600.0)
+
+    def run():
+        swapper.adjust_teams(tournament)
+    return run
+
+
+def setup_create_teams(players: int, teams: int, best_balls: int, iterations: int):
+    configure(iterations)
+    players = create_players(players)
+
+    def run():
+        create_teams(players, teams, best_balls, 1.0, False)
+    return run
+
+
+BENCHMARKS = [
+    Benchmark('sample_scores', ('players', 'iterations'), setup_sample_scores),
+    Benchmark('to_team_scenario', ('players', 'teams', 'best_balls', 'iterations'), setup_to_team_scenario),
+] + [
+    Benchmark('kernel/' + game_format, ('players', 'teams', 'best_balls', 'iterations'), setup_kernel(game_format))
+    for game_format in KERNELS
+] + [
+    Benchmark('game_wins_counter', ('teams', 'iterations'), setup_game_wins_counter),
+    Benchmark('hole_wins_counter', ('players', 'iterations'), setup_hole_wins_counter),
+    Benchmark('get_allowances', ('players',), setup_get_allowances),
+] + [
+    Benchmark('assignment/' + strategy_type.__name__, ('players', 'teams'), setup_assignment(strategy_type))
+    for strategy_type in (ABCDByHandicap, ABCDByWinProbability, ZigZagByHandicap, ZigZagByWinProbability,
+                          WeakestFirstByHandicap, WeakestFirstByWinProbability)
+] + [
+    Benchmark('simple_swapper', ('players', 'teams', 'best_balls', 'iterations'), setup_simple_swapper),
+    Benchmark('branch_and_bound', ('players', 'teams', 'best_balls'), setup_branch_and_bound),
+    Benchmark('create_teams', ('players', 'teams', 'best_balls', 'iterations'), setup_create_teams),
+]
+
+
+# Runner
+
+def configure(iterations: int = 1000, exact: bool = False):
+    inject.clear_and_configure(create_config(score_distribution_by_handicap_file, iterations, seed=0, exact=exact))
+
+
+def cases(benchmark: Benchmark, matrix: dict, max_scores: int):
+    """
+    The parameters of the feasible cases of the matrix over the axes of the benchmark
+    """
+    for values in product(*(matrix[axis] for axis in benchmark.axes)):
+        parameters = dict(zip(benchmark.axes, values))
+        players = parameters.get('players', parameters.get('teams', 1))
+        teams = parameters.get('teams', 1)
+        if teams > players or parameters.get('best_balls', 1) > players // teams:
+            continue
+        if benchmark.name in ('simple_swapper', 'create_teams') and \
+                players * parameters['iterations'] * number_of_holes > max_scores:
+            continue    # The scenarios of the whole field are kept in memory
+        if benchmark.name == 'branch_and_bound' and players > 8:
+            continue    # The exact search of larger fields takes minutes
+        yield parameters
+
+
+def measure(benchmark: Benchmark, parameters: dict, repeat: int) -> dict:
+    """
+    Time the benchmark: the first run warms up, and every run has its own setup
+    """
+    timings = list()
+    for index in range(repeat + 1):
+        run = benchmark.setup(**parameters)
+        start = time.perf_counter()
+        run()
+        if index > 0:
+            timings.append(time.perf_counter() - start)
+    return {'benchmark': benchmark.name, 'parameters': parameters, 'min': min(timings), 'median': median(timings),
+            'repeat': repeat}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(project_root), capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'commit': commit}
+
+
+def case_key(result: dict):
+    return result['benchmark'], tuple(sorted(result['parameters'].items()))
+
+
+def threshold_of(benchmark: str, thresholds: dict, default_threshold: float) -> float:
+    # The threshold of the longest matching prefix applies
+    matches = [prefix for prefix in thresholds if benchmark.startswith(prefix)]
+    return thresholds[max(matches, key=len)] if matches else default_threshold
+
+
+def compare(results, baseline, thresholds: dict, default_threshold: float):
+    """
+    Compare the fastest timing of each case to the one of the baseline
+    :return: the (result, baseline result, ratio) of the regressions
+    """
+    baseline_results = {case_key(result): result for result in baseline['results']}
+    regressions = list()
+    for result in results:
+        baseline_result = baseline_results.get(case_key(result))
+        if baseline_result is None:
+            continue
+        ratio = result['min'] / baseline_result['min']
+        if ratio > 1 + threshold_of(result['benchmark'], thresholds, default_threshold):
+            regressions.append((result, baseline_result, ratio))
+    return regressions
+
+
+def parse_thresholds(values):
+    default_threshold, thresholds = 0.25, dict()
+    for value in values:
+        name, _, fraction = value.rpartition('=')
+        try:
+            fraction = float(fraction)
+        except ValueError:
+            raise click.BadParameter("thresholds need to be in the format FRACTION or NAME=FRACTION, e.g. 0.2")
+        if name:
+            thresholds[name] = fraction
+        else:
+            default_threshold = fraction
+    return default_threshold, thresholds
+
+
+def parse_axis(value):
+    return tuple(int(v) for v in value.split(',')) if value else None
+
+
+@click.command()
+@click.option('-m', '--matrix', type=click.Choice(sorted(MATRICES)), default='quick',
+              help="the values of players, teams, best balls and iterations to sweep")
+@click.option('--players', help="override the players of the matrix (comma separated)")
+@click.option('--teams', help="override the teams of the matrix (comma separated)")
+@click.option('--best-balls', help="override the best balls of the matrix (comma separated)")
+@click.option('--iterations', help="override the iterations of the matrix (comma separated)")
+@click.option('-k', '--select', 'selected', multiple=True,
+              help="run only the benchmarks whose name starts with the given prefix")
+@click.option('-r', '--repeat', type=click.IntRange(min=1), default=3,
+              help="the number of timed runs of each case")
+@click.option('--max-scores', type=click.IntRange(min=1), default=2 * 10**8,
+              help="skip the end-to-end cases whose field scenarios (players x iterations x holes) exceed this")
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True),
+              help="write the results in the given JSON file")
+@click.option('-b', '--baseline', type=click.Path(exists=True, dir_okay=False),
+              help="compare the results with the ones of a previous run")
+@click.option('-t', '--threshold', 'threshold_values', multiple=True,
+              help="the slowdown tolerated before reporting a regression, as a fraction (default: 0.25). NAME=FRACTION "
+                   "sets the threshold of the benchmarks whose name starts with NAME")
+def main(matrix, players, teams, best_balls, iterations, selected, repeat, max_scores, output, baseline,
+         threshold_values):
+    default_threshold, thresholds = parse_thresholds(threshold_values)
+    matrix = dict(MATRICES[matrix])
+    for axis, value in (('players', players), ('teams', teams), ('best_balls', best_balls),
+                        ('iterations', iterations)):
+        matrix[axis] = parse_axis(value) or matrix[axis]
+    configure()
+
+    results = list()
+    for benchmark in BENCHMARKS:
+        if selected and not any(benchmark.name.startswith(prefix) for prefix in selected):
+            continue
+        for parameters in cases(benchmark, matrix, max_scores):
+            result = measure(benchmark, parameters, repeat)
+            results.append(result)
+            click.echo("{:<40} {:<70} {:>10.4f}s".format(benchmark.name, json.dumps(parameters), result['min']))
+
+    report = {'environment': environment(), 'matrix': matrix, 'results': results}
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if baseline:
+        with open(baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), thresholds, default_threshold)
+        for result, baseline_result, ratio in regressions:
+            click.echo("REGRESSION {} {}: {:.4f}s -> {:.4f}s (x{:.2f})"
+                       .format(result['benchmark'], json.dumps(result['parameters']), baseline_result['min'],
+                               result['min'], ratio), err=True)
+        click.echo("{} regressions in {} cases".format(len(regressions), len(results)), err=True)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import pathlib
+import time
+from itertools import combinations
+
+import inject
+import pytest
+
+from fairway.app.config import create_config
+from fairway.domain.player import Player
+from fairway.domain.tournament import Tournament
+from fairway.usecases.bestball import BestBallGame
+from fairway.usecases.branch_and_bound import AssignmentSearch
+from fairway.usecases.fairness import FAIRNESS_EVALUATORS
+
+
+project_root = pathlib.Path(__file__).parent.parent
+score_distribution_by_handicap_file = project_root / 'data/default_usga_handicap_distributions.csv'
+
+# Small fields (two players share a handicap), the team sizes and the number of best balls
+FIELDS = [((2, 8, 8, 13, 17, 22, 30), (3, 2, 2), 2),
+          ((0, 5, 11, 11, 19, 26), (2, 2, 2), 1)]
+
+
+def search_inputs(handicaps, number_of_teams: int, number_of_best_balls: int):
+    """
+    The distributions of the players of each handicap on each hole, the number of players of each handicap, and the
+    handicap index of each player
+    """
+    inject.clear_and_configure(create_config(score_distribution_by_handicap_file, 1, exact=True))
+    players = Player.create_all(handicaps)
+    game = BestBallGame(number_of_best_balls=number_of_best_balls)
+    Tournament(game, players, number_of_teams, 1.0)  # Sets the allowances of the players
+    distinct_handicaps = sorted(set(handicaps))
+    first_players = [handicaps.index(handicap) for handicap in distinct_handicaps]
+    distributions = [[hole[player] for player in first_players] for hole in game.hole_distributions(players)]
+    return (distributions, [handicaps.count(handicap) for handicap in distinct_handicaps],
+            [distinct_handicaps.index(handicap) for handicap in handicaps])
+
+
+def assignments(items, team_sizes):
+    """
+    Every split of items into teams of the given sizes
+    """
+    if not team_sizes:
+        yield ()
+        return
+    for team in combinations(range(len(items)), team_sizes[0]):
+        rest = [item for index, item in enumerate(items) if index not in team]
+        for teams in assignments(rest, team_sizes[1:]):
+            yield (tuple(sorted(items[index] for index in team)),) + teams
+
+
+@pytest.mark.parametrize('fairness', sorted(FAIRNESS_EVALUATORS))
+@pytest.mark.parametrize('handicaps, team_sizes, number_of_best_balls', FIELDS)
+def test_search_finds_the_brute_force_optimum(fairness, handicaps, team_sizes, number_of_best_balls):
+    distributions, counts, handicap_indexes = search_inputs(handicaps, len(team_sizes), number_of_best_balls)
+    search = AssignmentSearch(distributions, counts, team_sizes, number_of_best_balls,
+                              FAIRNESS_EVALUATORS[fairness]())
+    best_fairness = min(search.fairness(teams) for teams in assignments(handicap_indexes, team_sizes))
+
+    initial_teams = next(assignments(handicap_indexes, team_sizes))
+    teams, search_fairness, complete = AssignmentSearch(
+        distributions, counts, team_sizes, number_of_best_balls, FAIRNESS_EVALUATORS[fairness]()).run(
+        initial_teams, time.perf_counter() + 60)
+    assert complete
+    assert search_fairness == pytest.approx(best_fairness, abs=1e-12)
+    assert search.fairness(teams) == pytest.approx(search_fairness, abs=1e-12)
+    assert sorted(handicap for team in teams for handicap in team) == sorted(handicap_indexes)
+    assert [len(team) for team in teams] == list(team_sizes)
@@ -0,0 +1,61 @@
+import pathlib
+from itertools import product
+
+import inject
+import numpy as np
+
+from fairway.app.config import create_config
+from fairway.domain.player import Player
+from fairway.usecases.exact import best_balls_distribution, win_probabilities_of
+from fairway.usecases.interactors import estimate_teams_fairness
+
+
+project_root = pathlib.Path(__file__).parent.parent
+score_distribution_by_handicap_file = project_root / 'data/default_usga_handicap_distributions.csv'
+
+# Two teams of four players
+HANDICAPS = (1, 5, 7, 9, 10, 12, 18, 21)
+TEAM_IDS = (0, 1, 1, 0, 0, 1, 1, 0)
+
+
+def estimate(exact: bool, number_of_iterations: int = 500):
+    inject.clear_and_configure(create_config(score_distribution_by_handicap_file, number_of_iterations, seed=0,
+                                             exact=exact))
+    tournament = estimate_teams_fairness(Player.create_all(HANDICAPS, TEAM_IDS), 2, 1.0)
+    return tournament.game.last_result
+
+
+def enumerate_scores(distributions, score_of):
+    """
+    The distribution of score_of the scores of independent entities, by enumeration
+    """
+    probabilities = dict()
+    for scores in product(*(range(offset, offset + len(probs)) for offset, probs in distributions)):
+        probability = np.prod([probs[score - offset] for score, (offset, probs) in zip(scores, distributions)])
+        probabilities[score_of(scores)] = probabilities.get(score_of(scores), 0.0) + probability
+    return probabilities
+
+
+def test_best_balls_distribution():
+    distributions = [(3, np.array([0.2, 0.5, 0.3])), (4, np.array([0.6, 0.4])), (2, np.array([0.1, 0.1, 0.8]))]
+    for number_of_best_balls in (1, 2, 3):
+        offset, probs = best_balls_distribution(distributions, number_of_best_balls)
+        expected = enumerate_scores(distributions, lambda scores: sum(sorted(scores)[:number_of_best_balls]))
+        assert np.allclose(probs, [expected.get(offset + index, 0.0) for index in range(len(probs))])
+        assert np.isclose(np.sum(probs), 1.0)
+
+
+def test_win_probabilities_split_ties():
+    distributions = [(0, np.array([0.5, 0.5])), (0, np.array([0.5, 0.5])), (1, np.array([1.0]))]
+    # The first two win alone a quarter of the time each, and tie the rest: half of it at 0, half of it with the third
+    assert np.allclose(win_probabilities_of(distributions), [0.25 + 0.125 + 0.25 / 3, 0.25 + 0.125 + 0.25 / 3,
+                                                             0.25 / 3])
+
+
+def test_exact_estimates_agree_with_monte_carlo():
+    exact_result = estimate(True)
+    simulated_result = estimate(False, 20000)
+    assert np.all(np.abs(exact_result.win_probabilities - simulated_result.win_probabilities)
+                  < 4 * simulated_result.standard_errors)
+    assert np.allclose(exact_result.expected_scores, simulated_result.expected_scores, atol=0.2)
+    assert np.allclose(exact_result.head_to_head, simulated_result.head_to_head, atol=0.03)
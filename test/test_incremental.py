@@ -0,0 +1,61 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from fairway.usecases.incremental import IncrementalEvaluator
+from fairway.usecases.kernels import create_kernel
+
+
+# Three teams of uneven sizes
+TEAMS = ((0, 1, 2, 3), (4, 5, 6), (7, 8, 9, 10))
+NUMBER_OF_PLAYERS = 11
+
+
+def players_scenarios(number_of_scenarios: int = 300, number_of_holes: int = 9):
+    return np.random.default_rng(0).integers(2, 9, size=(number_of_scenarios, NUMBER_OF_PLAYERS, number_of_holes),
+                                             dtype=np.int8)
+
+
+def swapped(teams, player_index_0: int, player_index_1: int):
+    return tuple(tuple(player_index_1 if player_index == player_index_0 else
+                       player_index_0 if player_index == player_index_1 else player_index
+                       for player_index in team) for team in teams)
+
+
+def candidate_swaps(teams):
+    return [(player_index_0, player_index_1) for team_0, team_1 in combinations(teams, 2)
+            for player_index_0 in team_0 for player_index_1 in team_1]
+
+
+@pytest.mark.parametrize('game_format', ['best-ball', 'scramble', 'stableford'])
+def test_swap_deltas_match_full_evaluations(game_format):
+    scenarios = players_scenarios()
+    kernel = create_kernel(game_format, 2)
+    evaluator = IncrementalEvaluator(scenarios, TEAMS, kernel)
+    swaps = candidate_swaps(TEAMS)
+    win_probabilities, head_to_heads = evaluator.evaluate_swaps(swaps, batch_size=7, head_to_head=True)
+    for index, (player_index_0, player_index_1) in enumerate(swaps):
+        result = IncrementalEvaluator(scenarios, swapped(TEAMS, player_index_0, player_index_1), kernel).result()
+        assert np.allclose(win_probabilities[index], result.win_probabilities)
+        assert np.allclose(head_to_heads[index], result.head_to_head)
+
+
+def test_swap_and_undo_match_full_evaluations():
+    scenarios = players_scenarios()
+    kernel = create_kernel('best-ball', 2)
+    evaluator = IncrementalEvaluator(scenarios, TEAMS, kernel)
+    initial_result = evaluator.result()
+
+    evaluator.swap(2, 8)
+    teams = swapped(TEAMS, 2, 8)
+    assert evaluator.team_of(2) == 2 and evaluator.team_of(8) == 0
+    result, expected_result = evaluator.result(), IncrementalEvaluator(scenarios, teams, kernel).result()
+    assert np.array_equal(result.total_scores, expected_result.total_scores)
+    assert np.allclose(result.number_of_wins, expected_result.number_of_wins)
+    assert np.allclose(result.head_to_head, expected_result.head_to_head)
+
+    evaluator.undo()
+    result = evaluator.result()
+    assert np.array_equal(result.total_scores, initial_result.total_scores)
+    assert np.allclose(result.number_of_wins, initial_result.number_of_wins)